@@ -0,0 +1,204 @@
+from collections.abc import Callable
+from json import dumps, load, loads
+from logging import getLogger
+from os import replace, truncate
+from pathlib import Path
+from time import monotonic
+from typing import BinaryIO, NamedTuple
+
+from clusters import DuplicateGroup
+from image_index import IndexEntry
+from report import entry_from_dict, entry_to_dict, group_from_dict, group_to_dict
+from shard_index import parse_shard
+
+
+log = getLogger()
+
+
+class ScanProgress(NamedTuple):
+	"""Sent periodically by the scanner, so the state of the walk can be
+	checkpointed by the process which knows what has been indexed
+	"""
+	pending: list[str]  # directories not yet listed, each to be walked with everything beneath it
+	relist: list[str]  # directories left unfinished by a previous run, whose files are still to be listed again
+	listed: dict[str, int]  # directories listed since the last progress, to the number of file batches queued from each
+
+
+class Checkpoint(NamedTuple):
+	root_directories: list[Path]
+	pending: list[str]
+	unfinished: list[str]  # directories listed, but not all of whose files were indexed
+	completed: list[str]
+	entries: list[IndexEntry]
+	groups: list[DuplicateGroup]
+	entries_size: int  # bytes of the log of entries the checkpoint covers
+	shard: tuple[int, int] | None  # the shard the scan takes, as its index from 0 and the number of shards, if any
+	scan_id: int  # marks the hash cache entries the scan has seen
+
+
+class ScanState:
+	"""Tracks which directories have had every one of their files indexed
+
+	A directory is complete once the scanner has said how many batches of files
+	it queued from it, and workers have reported finishing that many. Workers
+	report finished batches alongside the records of their files, so a
+	directory is only complete once its entries are in the index.
+	"""
+
+	def __init__(self, pending: list[str] | None = None, relist: list[str] | None = None, completed: list[str] | None = None) -> None:
+		self.pending = pending or []
+		self.relist = relist or []
+		self.completed: set[str] = set(completed or ())
+		self.expected: dict[str, int] = {}
+		self.finished: dict[str, int] = {}
+
+	def __check(self, directory: str) -> None:
+		if directory in self.expected and self.finished.get(directory, 0) >= self.expected[directory]:
+			del self.expected[directory]
+			self.finished.pop(directory, None)
+			self.completed.add(directory)
+
+	def update(self, progress: ScanProgress) -> None:
+		self.pending = progress.pending
+		self.relist = progress.relist
+		for directory, batch_count in progress.listed.items():
+			self.expected[directory] = self.expected.get(directory, 0) + batch_count  # a watched directory may be listed again
+			self.__check(directory)
+
+	def finish_batch(self, directory: str) -> None:
+		self.finished[directory] = self.finished.get(directory, 0) + 1
+		self.__check(directory)
+
+	def is_complete(self) -> bool:
+		return not (self.pending or self.relist or self.expected)
+
+
+def entry_log_path(path: Path) -> Path:
+	"""Path to the log of entries kept beside a checkpoint"""
+	return path.with_name(path.name + ".entries")
+
+
+class Checkpointer:
+	"""Periodically saves enough of the state of a scan to disk for it to be
+	resumed where it left off
+
+	The index is saved incrementally: each checkpoint only appends the entries
+	indexed or removed since the last one to a log, as JSON Lines, so saving
+	takes time in proportion to the changes rather than to the whole index.
+	The checkpoint itself records how much of the log it covers.
+	"""
+
+	def __init__(
+		self,
+		path: Path,
+		interval: float,
+		unresolved_groups: Callable[[], list[DuplicateGroup]],
+		shard: tuple[int, int] | None = None,
+		scan_id: int = 0
+	) -> None:
+		"""
+		Parameters
+		----------
+		path: Path to the checkpoint file, replaced on every save
+		interval: Seconds between saves
+		unresolved_groups: Gets the duplicate groups still waiting on a decision
+		shard: The shard the scan takes, as its index from 0 and the number of
+			shards, if any
+		scan_id: Marks the hash cache entries the scan sees, kept so a resumed
+			scan marks them the same
+		"""
+		self.path = path
+		self.interval = interval
+		self.unresolved_groups = unresolved_groups
+		self.shard = shard
+		self.scan_id = scan_id
+		self.root_directories: list[Path] = []
+		self.entries_file: BinaryIO | None = None
+		self.last_saved = monotonic()
+
+	def due(self) -> bool:
+		return monotonic() - self.last_saved >= self.interval
+
+	def start(self, root_directories: list[Path], resumed: Checkpoint | None = None) -> None:
+		"""Begin checkpointing a scan, continuing the log of entries of the
+		checkpoint it resumes, or else replacing any previous checkpoint
+
+		Parameters
+		----------
+		root_directories: The directories the scan walks
+		resumed: The checkpoint the scan resumes, if any
+		"""
+		self.root_directories = root_directories
+		if resumed:
+			truncate(entry_log_path(self.path), resumed.entries_size)  # anything past it was appended after the checkpoint was saved
+		else:
+			self.discard()
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		self.entries_file = entry_log_path(self.path).open("ab")
+
+	def save(self, state: ScanState, changes: list[tuple[Path, IndexEntry | None]]) -> None:
+		"""Append the changes to the index to the log of entries, then write a
+		checkpoint covering them, replacing the previous one only once it is
+		completely written
+
+		Parameters
+		----------
+		state: The state of the walk
+		changes: The path of each entry indexed or removed since the last
+			checkpoint, with the entry, or None if it was removed, as taken
+			from the index
+		"""
+		if self.entries_file is None:
+			raise ValueError("The checkpointer was not started")
+		for path, entry in changes:
+			change = entry_to_dict(entry) if entry else {"removed": str(path)}
+			self.entries_file.write(dumps(change).encode("utf-8", "surrogateescape") + b"\n")
+		self.entries_file.flush()
+		checkpoint = {
+			"root_directories": [str(root_directory) for root_directory in self.root_directories],
+			"shard": f"{self.shard[0] + 1}/{self.shard[1]}" if self.shard else None,
+			"scan_id": self.scan_id,
+			"pending": state.pending,
+			"unfinished": list(state.expected) + state.relist,
+			"completed": sorted(state.completed),
+			"entries_size": self.entries_file.tell(),
+			"groups": [group_to_dict(group) for group in self.unresolved_groups()]
+		}
+		temporary_path = self.path.with_name(self.path.name + ".tmp")
+		temporary_path.write_text(dumps(checkpoint), encoding="utf-8")
+		replace(temporary_path, self.path)
+		self.last_saved = monotonic()
+		log.debug("Saved checkpoint of %s changes to the index to %s", len(changes), self.path)
+
+	def discard(self) -> None:
+		"""Delete the checkpoint and its log of entries, once the scan it is of
+		is complete"""
+		if self.entries_file:
+			self.entries_file.close()
+			self.entries_file = None
+		self.path.unlink(missing_ok=True)
+		entry_log_path(self.path).unlink(missing_ok=True)
+
+
+def load_checkpoint(path: Path) -> Checkpoint:
+	with path.open("r", encoding="utf-8") as file:
+		data = load(file)
+	entries: dict[str, IndexEntry] = {}
+	with entry_log_path(path).open("rb") as file:
+		for line in file.read(data["entries_size"]).splitlines():  # replayed in order, so only the latest change to each path counts
+			change = loads(line.decode("utf-8", "surrogateescape"))
+			if "removed" in change:
+				entries.pop(change["removed"], None)
+			else:
+				entries[change["path"]] = entry_from_dict(change)
+	return Checkpoint(
+		[Path(root_directory) for root_directory in data["root_directories"]],
+		data["pending"],
+		data["unfinished"],
+		data["completed"],
+		list(entries.values()),
+		[group_from_dict(group) for group in data["groups"]],
+		data["entries_size"],
+		parse_shard(data["shard"]) if data.get("shard") else None,
+		data.get("scan_id", 0)
+	)
\ No newline at end of file
@@ -0,0 +1,123 @@
+from itertools import count
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+from typing import NamedTuple
+
+from image_index import IndexEntry
+
+
+class DuplicateGroup(NamedTuple):
+	entries: list[IndexEntry]  # the indexed image first, then each of its duplicates
+	exact: list[bool]  # for each duplicate, whether it is byte for byte identical to the first image
+
+
+class DuplicateClusters:
+	"""Merges duplicate pairs into groups, holding each group back until it
+	has stopped growing
+
+	Pairs are joined by a union-find over their paths, so however the matches
+	arrive, every image ends up in one group with everything it was matched
+	to. A group is stable once no pair has joined it for a while, and is then
+	taken to be decided on as a whole, rather than one pair at a time.
+
+	Exactness is tracked by labelling each image with the class of images it
+	is byte for byte identical to, which exact pairs merge, so it is always
+	reported relative to whichever image ends up first in the group. An image
+	whose entry changes since it joined is given a class of its own, as it
+	may no longer be identical to anything.
+	"""
+
+	def __init__(self, stable_after: float = 2.0) -> None:
+		"""
+		Parameters
+		----------
+		stable_after: Seconds a group must go without growing to be stable
+		"""
+		self.stable_after = stable_after
+		self.parents: dict[Path, Path] = {}
+		self.members: dict[Path, dict[Path, tuple[IndexEntry, int]]] = {}  # each root to its group's entries, in the order they joined, and the class of identical images each is in
+		self.updated_at: dict[Path, float] = {}
+		self.labels = count()
+		self.lock = Lock()
+
+	def __len__(self) -> int:
+		return len(self.members)
+
+	def __find(self, path: Path) -> Path:
+		parents = self.parents
+		while parents[path] != path:
+			parents[path] = parents[parents[path]]  # path halving keeps the trees shallow
+			path = parents[path]
+		return path
+
+	def __join(self, entry: IndexEntry) -> Path:
+		if entry.path not in self.parents:
+			self.parents[entry.path] = entry.path
+			self.members[entry.path] = {entry.path: (entry, next(self.labels))}
+			return entry.path
+		root = self.__find(entry.path)
+		previous, _ = self.members[root][entry.path]
+		if previous != entry:
+			self.members[root][entry.path] = (entry, next(self.labels))  # the image changed, so whatever it was identical to is stale
+		return root
+
+	def add(self, left: IndexEntry, right: IndexEntry, exact: bool = False) -> None:
+		"""Add a duplicate pair, merging the groups of its images
+
+		Parameters
+		----------
+		left: The entry of the indexed image
+		right: The entry of its duplicate
+		exact: Whether the images are byte for byte identical
+		"""
+		with self.lock:
+			root = self.__join(left)
+			other = self.__join(right)
+			if other != root:
+				self.parents[other] = root  # always into the indexed image's group, which keeps it first
+				self.members[root].update(self.members.pop(other))
+				self.updated_at.pop(other, None)
+			members = self.members[root]
+			if exact:
+				old_label, new_label = members[right.path][1], members[left.path][1]
+				for path, (entry, label) in members.items():
+					if label == old_label:
+						members[path] = (entry, new_label)
+			self.updated_at[root] = monotonic()
+
+	def __group(self, members: dict[Path, tuple[IndexEntry, int]]) -> DuplicateGroup:
+		entries = [entry for entry, _ in members.values()]
+		labels = [label for _, label in members.values()]
+		return DuplicateGroup(entries, [label == labels[0] for label in labels[1:]])
+
+	def take_stable(self, flush: bool = False) -> list[DuplicateGroup]:
+		"""Take every stable group out of the clusters; an image matched again
+		afterwards starts a new group
+
+		Parameters
+		----------
+		flush: Whether to take every group, stable or not, such as once no
+			more pairs can arrive
+
+		Returns
+		-------
+		The stable groups
+		"""
+		groups = []
+		with self.lock:
+			now = monotonic()
+			for root, updated_at in list(self.updated_at.items()):
+				if not flush and now - updated_at < self.stable_after:
+					continue
+				del self.updated_at[root]
+				members = self.members.pop(root)
+				for path in members:
+					del self.parents[path]
+				groups.append(self.__group(members))
+		return groups
+
+	def pending(self) -> list[DuplicateGroup]:
+		"""Get every group not yet taken, without taking it"""
+		with self.lock:
+			return [self.__group(members) for members in self.members.values()]
\ No newline at end of file
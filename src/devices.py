@@ -0,0 +1,127 @@
+from functools import lru_cache
+from multiprocessing import Lock as MultiprocessingLock
+from multiprocessing.sharedctypes import RawArray, RawValue
+from pathlib import Path
+
+try:
+	from os import major, minor
+except ImportError:  # not on Windows
+	major = minor = None
+
+
+DEVICE_CLASSES = ("rotational", "solid_state", "network", "other")
+NETWORK_FILE_SYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "ceph", "glusterfs", "9p", "afs", "fuse.sshfs")
+SYS_BLOCK = Path("/sys/dev/block")
+MOUNT_INFO = Path("/proc/self/mountinfo")
+
+
+def __rotational(block_device: Path) -> bool | None:
+	"""Read the rotational flag of a block device's queue, or of the whole
+	disk's, if the device is a partition
+	"""
+	for queue in (block_device.joinpath("queue"), block_device.joinpath("..", "queue")):
+		try:
+			return queue.joinpath("rotational").read_text().strip() == "1"
+		except OSError:
+			continue
+	return None
+
+
+def __mount_source(device: int) -> tuple[str, str] | None:
+	"""Find the file system type and source of the mount with a device
+	number, for file systems which have no block device of their own, such as
+	network shares and btrfs
+	"""
+	device_number = f"{major(device)}:{minor(device)}"
+	try:
+		lines = MOUNT_INFO.read_text().splitlines()
+	except OSError:
+		return None
+	for line in lines:
+		fields = line.split()
+		if len(fields) > 2 and fields[2] == device_number and "-" in fields:
+			separator = fields.index("-")
+			return fields[separator + 1], fields[separator + 2]
+	return None
+
+
+@lru_cache(maxsize=None)
+def device_class(device: int) -> str:
+	"""Classify the storage a device number belongs to, one of DEVICE_CLASSES,
+	from sysfs; anything which cannot be identified, such as on platforms
+	other than Linux, is "other"
+
+	Parameters
+	----------
+	device: A file's st_dev
+	"""
+	if major is None:
+		return "other"
+	rotational = __rotational(SYS_BLOCK.joinpath(f"{major(device)}:{minor(device)}"))
+	if rotational is None:
+		mount = __mount_source(device)
+		if mount is None:
+			return "other"
+		file_system, source = mount
+		if file_system in NETWORK_FILE_SYSTEMS:
+			return "network"
+		if not source.startswith("/dev/"):
+			return "other"
+		try:
+			block_device = Path("/sys/class/block", Path(source).resolve().name)
+		except (OSError, RuntimeError):  # such as a symlink loop
+			return "other"
+		rotational = __rotational(block_device)
+		if rotational is None:
+			return "other"
+	return "rotational" if rotational else "solid_state"
+
+
+class DeviceLimiter:
+	"""Counts the batches of files in flight from each storage device, shared
+	by the scanner, which only queues a device's next batch while it is under
+	its cap, and the workers, which report each batch they finish
+
+	Devices are numbered in the order the scanner finds them, and any beyond
+	the number of slots share slots. The workers also count themselves out as
+	they exit, so the scanner does not hold batches back for workers which
+	are gone.
+	"""
+
+	SLOTS = 64
+
+	def __init__(self, limits: dict[str, int] | None = None) -> None:
+		"""
+		Parameters
+		----------
+		limits: The most batches of each class of device, one of
+			DEVICE_CLASSES, to have in flight at once, or 0 for no limit
+		"""
+		self.limits = limits or {}
+		self.in_flight = RawArray("i", self.SLOTS)
+		self.workers_exited = RawValue("i", 0)
+		self.lock = MultiprocessingLock()
+
+	def limit(self, device: int) -> int:
+		return self.limits.get(device_class(device), 0)
+
+	def try_start(self, slot: int, limit: int) -> bool:
+		"""Count a batch as in flight, if the device is under its limit
+
+		Returns
+		-------
+		Whether the batch may be queued
+		"""
+		with self.lock:
+			if limit and self.in_flight[slot] >= limit:
+				return False
+			self.in_flight[slot] += 1
+			return True
+
+	def finish(self, slot: int) -> None:
+		with self.lock:
+			self.in_flight[slot] -= 1
+
+	def worker_exited(self) -> None:
+		with self.lock:
+			self.workers_exited.value += 1
\ No newline at end of file
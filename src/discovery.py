@@ -0,0 +1,325 @@
+from collections import deque
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from logging import getLogger
+from multiprocessing import Process, Queue
+from multiprocessing.synchronize import Event as MultiprocessingEventType
+from os import scandir, stat
+from os.path import join
+from pathlib import Path
+from signal import SIG_IGN, SIGINT, signal
+from threading import Lock
+from time import monotonic
+
+from checkpoint import ScanProgress
+from devices import device_class, DeviceLimiter
+from image_index import RecordBatch, Removal
+from metrics import MetricsRecorder
+from profiling import Profiler
+from scheduler import WorkerThrottle
+from shard_index import relative_to_root, shard_of
+from watcher import IN_CLOSE_WRITE, IN_CREATE, IN_DELETE, IN_DELETE_SELF, IN_MOVED_FROM, IN_MOVED_TO, IN_Q_OVERFLOW, Inotify
+
+
+log = getLogger()
+
+FileBatch = tuple[str, list[str], int]  # a directory, the names of files in it, and the slot of its device
+
+
+class DirectoryScanner(Process):
+	"""The sole discovery stage, which walks the directory tree and feeds
+	batches of candidate files to the hashing workers
+
+	Once the walk is complete, one None is queued for each worker to signal
+	that no more work is coming. In watch mode, the scanner instead keeps
+	watching the tree until killed, queueing files as they are written or moved
+	in, and reporting files which are deleted or moved out.
+
+	The state of the walk is periodically sent to the index service, so that
+	the scan can be checkpointed and later resumed.
+
+	Batches are held back per storage device, and a device's next batch is
+	only queued while it has fewer in flight than its class of device is
+	limited to, so workers spread across devices rather than all contending
+	for one disk. Directories on spinning disks are read in inode order.
+	"""
+
+	BATCH_SIZE = 256
+	PROGRESS_INTERVAL = 1.0
+	DISPATCH_INTERVAL = 0.05
+
+	def __init__(
+		self,
+		root_directories: list[Path],
+		file_queue: "Queue[FileBatch | None]",
+		record_queue: "Queue[RecordBatch | Removal | ScanProgress | None]",
+		worker_count: int,
+		kill_flag: MultiprocessingEventType,
+		extensions: tuple[str, ...] | None,
+		metrics: MetricsRecorder,
+		profiler: Profiler | None = None,
+		watch: bool = False,
+		pending: list[str] | None = None,
+		relist: list[str] | None = None,
+		completed: set[str] | None = None,
+		listing_threads: int = 1,
+		shard: tuple[int, int] | None = None,
+		devices: DeviceLimiter | None = None,
+		throttle: WorkerThrottle | None = None
+	) -> None:
+		"""
+		Parameters
+		----------
+		root_directories: The directories to walk
+		file_queue: The queue to feed batches of files into
+		record_queue: The queue to send the progress of the walk, and any
+			removed files, to the index service through
+		worker_count: The number of workers consuming the file queue
+		kill_flag: Set to stop the walk early
+		extensions: Upper case file extensions, without the dot, of the files to
+			queue, or None to queue every file for the workers to identify by
+			its contents
+		metrics: Where to record listing times and the number of files found
+		profiler: Profiles the walk, if given and enabled
+		watch: Whether to keep watching the tree for changes after the walk
+		pending: When resuming, the stack of directories still to walk, in
+			place of the root directories
+		relist: When resuming, directories whose files must be listed again,
+			but whose subdirectories were already queued
+		completed: When resuming, directories whose files were all indexed, to
+			walk through without queueing their files again; only needed when
+			watching, as every directory must be watched
+		listing_threads: The most directories to list at once, which hides
+			the latency of network and spinning disks
+		shard: The index of the shard of files to queue, counting from 0, and
+			the number of shards, if only one shard is to be scanned
+		devices: Limits the batches in flight from each device, shared with
+			the workers, if given
+		throttle: Sets how many directories to list at once, at most
+			listing_threads, if given
+		"""
+		Process.__init__(self)
+		self.root_directories = root_directories
+		self.file_queue = file_queue
+		self.worker_count = worker_count
+		self.kill_flag = kill_flag
+		self.extensions = extensions
+		self.metrics = metrics
+		self.profiler = profiler or Profiler()
+		self.record_queue = record_queue
+		self.watch = watch
+		self.pending = pending if pending is not None else [str(root_directory) for root_directory in reversed(root_directories)]
+		self.relist = relist or []
+		self.completed = completed or set()
+		self.listing_threads = max(1, listing_threads)
+		self.shard = shard
+		self.devices = devices
+		self.throttle = throttle
+		self.device_slots: dict[int, int] = {}  # each device found to its slot in the limiter
+		self.slot_limits: dict[int, int] = {}
+		self.held_batches: dict[int, deque[FileBatch]] = {}  # each slot to its batches not yet queued
+		self.dispatch_lock = Lock()
+		self.listing_pool: ThreadPoolExecutor | None = None
+		self.listed: dict[str, int] = {}
+		self.last_progress = 0.0
+		self.inotify: Inotify | None = None
+
+	def __getstate__(self) -> dict:
+		state = self.__dict__.copy()
+		del state["dispatch_lock"]  # cannot be pickled, such as to spawn the scanner, and is only used within it
+		return state
+
+	def __setstate__(self, state: dict) -> None:
+		self.__dict__.update(state)
+		self.dispatch_lock = Lock()
+
+	def is_candidate(self, name: str) -> bool:
+		return self.extensions is None or name.rpartition(".")[2].upper() in self.extensions
+
+	def in_shard(self, directory: str) -> Callable[[str], bool]:
+		"""Get a test of whether a file in a directory is in the shard being
+		scanned
+		"""
+		if not self.shard:
+			return lambda name: True
+		index, count = self.shard
+		relative = relative_to_root(directory, [str(root_directory) for root_directory in self.root_directories])
+		return lambda name: shard_of(join(relative, name), count) == index
+
+	def device_of(self, directory: str) -> tuple[int, bool]:
+		"""Get the slot of the device a directory is on, and whether its files
+		are best read in inode order
+		"""
+		if not self.devices:
+			return 0, False
+		try:
+			device = stat(directory).st_dev
+		except OSError:
+			return 0, False
+		with self.dispatch_lock:
+			slot = self.device_slots.get(device)
+			if slot is None:
+				slot = self.device_slots[device] = len(self.device_slots) % DeviceLimiter.SLOTS
+				self.slot_limits.setdefault(slot, self.devices.limit(device))
+				limit = self.slot_limits[slot]
+				log.debug("(%s) Found %s device %s, %s", self.pid, device_class(device), device, f"limited to {limit} batches in flight" if limit else "unlimited")
+		return slot, device_class(device) == "rotational"
+
+	def queue_batch(self, directory: str, names: list[str], slot: int) -> None:
+		self.metrics.add("files_listed", len(names))
+		if not self.devices:
+			self.file_queue.put((directory, names, slot))
+			return
+		with self.dispatch_lock:
+			self.held_batches.setdefault(slot, deque()).append((directory, names, slot))
+		self.dispatch()
+
+	def dispatch(self) -> None:
+		"""Queue as many held batches as each device's limit allows"""
+		if not self.devices:
+			return
+		with self.dispatch_lock:
+			for slot, batches in self.held_batches.items():
+				while batches and self.devices.try_start(slot, self.slot_limits[slot]):
+					self.file_queue.put(batches.popleft())
+
+	def drain(self) -> None:
+		"""Queue every held batch, as workers finish those in flight, unless
+		every worker has exited"""
+		while not self.kill_flag.is_set() and any(self.held_batches.values()):
+			if self.devices and self.devices.workers_exited.value >= self.worker_count:
+				log.warning("(%s) Every worker has exited, abandoning %s held batches", self.pid, sum(map(len, self.held_batches.values())))
+				return
+			self.dispatch()
+			self.send_progress()
+			self.kill_flag.wait(self.DISPATCH_INTERVAL)
+
+	def scan_directory(self, directory: str) -> list[str]:
+		with self.metrics.time("listing"):
+			return self.__scan_directory(directory)
+
+	def __scan_directory(self, directory: str) -> list[str]:
+		subdirectories: list[tuple[int, str]] = []
+		files: list[tuple[int, str]] = []
+		batch_count = 0
+		if self.inotify:
+			try:
+				self.inotify.watch(directory)  # before listing, so no file can slip in between
+			except OSError as error:
+				log.warning("(%s) Cannot watch %s: %s", self.pid, directory, error)
+		skip_files = directory in self.completed
+		in_shard = self.in_shard(directory)
+		slot, in_inode_order = self.device_of(directory)
+		try:
+			with scandir(directory) as entries:
+				for entry in entries:
+					try:
+						if entry.is_dir(follow_symlinks=False):
+							subdirectories.append((entry.inode() if in_inode_order else 0, entry.path))
+						elif not skip_files and entry.is_file(follow_symlinks=False) and self.is_candidate(entry.name) and in_shard(entry.name):
+							files.append((entry.inode() if in_inode_order else 0, entry.name))
+					except OSError:
+						continue
+					if len(files) >= self.BATCH_SIZE and not in_inode_order:
+						self.queue_batch(directory, [name for _, name in files], slot)
+						batch_count += 1
+						files = []
+		except OSError as error:
+			log.debug("(%s) Skipping %s: %s", self.pid, directory, error)
+		if in_inode_order:
+			files.sort()  # inode numbers roughly follow where files were laid down, so a spinning disk seeks less
+			subdirectories.sort()
+		for start in range(0, len(files), self.BATCH_SIZE):
+			self.queue_batch(directory, [name for _, name in files[start:start + self.BATCH_SIZE]], slot)
+			batch_count += 1
+		self.listed[directory] = self.listed.get(directory, 0) + batch_count
+		return [path for _, path in subdirectories]
+
+	def send_progress(self, force: bool = False) -> None:
+		if not force and monotonic() - self.last_progress < self.PROGRESS_INTERVAL:
+			return
+		self.record_queue.put(ScanProgress(list(self.pending), list(self.relist), self.listed))
+		self.listed = {}
+		self.last_progress = monotonic()
+
+	def walk(self) -> None:
+		while (self.relist or self.pending) and not self.kill_flag.is_set():
+			if self.relist:
+				self.scan_directory(self.relist.pop())  # its subdirectories were queued when it was first listed
+			elif self.listing_pool and len(self.pending) > 1:
+				listing_threads = self.throttle.listing_threads.value if self.throttle else self.listing_threads
+				directories = [self.pending.pop() for _ in range(min(listing_threads, len(self.pending)))]
+				for subdirectories in reversed(list(self.listing_pool.map(self.scan_directory, directories))):
+					self.pending.extend(reversed(subdirectories))  # keeps the walk depth first, in the same order
+			else:
+				self.pending.extend(reversed(self.scan_directory(self.pending.pop())))
+			self.dispatch()
+			self.send_progress()
+		self.dispatch()  # when watching, batches of changed files may be held with nothing left to walk
+		self.send_progress(force=True)
+
+	def watch_tree(self) -> None:
+		"""Queue files as they are written or moved into the tree, and send the
+		paths of files removed from it to the index service, until killed
+		"""
+		log.debug("(%s) Watching for changes...", self.pid)
+		while not self.kill_flag.is_set():
+			changed: dict[str, set[str]] = {}
+			removed: list[Path] = []
+			new_directories: list[str] = []
+			for event in self.inotify.read(1):
+				if event.mask & IN_Q_OVERFLOW:
+					log.warning("(%s) Changes were missed, rescanning...", self.pid)
+					self.completed = set()
+					new_directories.extend(str(root_directory) for root_directory in self.root_directories)  # adding a watch twice is harmless
+					continue
+				path = join(event.directory, event.name) if event.name else event.directory
+				if event.mask & (IN_DELETE | IN_DELETE_SELF | IN_MOVED_FROM):
+					if event.is_directory:
+						self.inotify.unwatch_tree(path)
+					changed.get(event.directory, set()).discard(event.name)
+					removed.append(Path(path))
+				elif event.is_directory:
+					if event.mask & (IN_CREATE | IN_MOVED_TO):
+						new_directories.append(path)
+				elif event.mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and self.is_candidate(event.name):
+					changed.setdefault(event.directory, set()).add(event.name)
+			if removed:
+				self.record_queue.put(Removal(removed))
+			for directory, names in changed.items():
+				in_shard = self.in_shard(directory)
+				names = {name for name in names if in_shard(name)}
+				if names:
+					self.queue_batch(directory, sorted(names), self.device_of(directory)[0])
+					self.listed[directory] = self.listed.get(directory, 0) + 1
+			self.pending.extend(reversed(new_directories))
+			self.walk()
+
+	def run(self) -> None:
+		signal(SIGINT, SIG_IGN)  # interrupts are handled by the main process, which sets the kill flag
+		with self.profiler.profile("scanner"):
+			log.debug("(%s) Starting discovery...", self.pid)
+			try:
+				if self.watch:
+					self.inotify = Inotify()
+				if self.listing_threads > 1:
+					self.listing_pool = ThreadPoolExecutor(self.listing_threads)
+				self.walk()
+				if not self.kill_flag.is_set():
+					self.metrics.add("listing_complete")
+					log.debug("(%s) Discovery complete", self.pid)
+					if self.inotify:
+						self.watch_tree()
+					else:
+						self.drain()
+			finally:  # the workers must be told to exit, even if discovery fails
+				if self.inotify:
+					self.inotify.close()
+				if self.listing_pool:
+					self.listing_pool.shutdown()
+				if self.kill_flag.is_set():
+					self.file_queue.cancel_join_thread()
+					self.record_queue.cancel_join_thread()
+				else:
+					for _ in range(self.worker_count):
+						self.file_queue.put(None)
\ No newline at end of file
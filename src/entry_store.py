@@ -0,0 +1,252 @@
+from array import array
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from sqlite3 import connect
+
+from revamp.pdd_defaultcomparators.similarity_index import hamming_distance, MultiIndexHash, neighbours
+
+EntryFields = tuple[int, str, int, str, int]  # directory id, name, identity hash, image hash, area
+ENTRY_BYTES = 200  # rough memory cost of an entry besides its name, including its share of the hash table
+
+
+def to_signed(value: int) -> int:
+	"""Fit a 64 bit unsigned hash into SQLite's signed integers"""
+	return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value: int) -> int:
+	return value + (1 << 64) if value < 0 else value
+
+
+class MemoryEntryStore:
+	"""Index entries packed into parallel arrays, addressed by integer ids
+
+	Identity hashes and areas are stored as fixed width integers, image hashes
+	as raw digest bytes (only for the few entries which have one), and paths as
+	interned directory ids and names. The ids of removed entries are reused.
+	Entries are found by identity hash through a multi-index hash table of
+	their ids.
+	"""
+
+	def __init__(self, max_distance: int = 0) -> None:
+		"""
+		Parameters
+		----------
+		max_distance: The distance searches are tuned for
+		"""
+		self.hashes = MultiIndexHash(max_distance)
+		self.identity_hashes = array("Q")
+		self.directory_ids = array("I")
+		self.areas = array("Q")
+		self.names: list[str | None] = []
+		self.image_hashes: dict[int, bytes] = {}
+		self.ids: dict[int, dict[str, int]] = {}  # directory id to the id of each of its files' entries
+		self.free: list[int] = []
+		self.bytes_used = 0
+
+	def __len__(self) -> int:
+		return len(self.names) - len(self.free)
+
+	def add(self, fields: EntryFields) -> int:
+		directory_id, name, identity_hash, image_hash, area = fields
+		if self.free:
+			entry_id = self.free.pop()
+			self.identity_hashes[entry_id] = identity_hash
+			self.directory_ids[entry_id] = directory_id
+			self.areas[entry_id] = area
+			self.names[entry_id] = name
+		else:
+			entry_id = len(self.names)
+			self.identity_hashes.append(identity_hash)
+			self.directory_ids.append(directory_id)
+			self.areas.append(area)
+			self.names.append(name)
+		if image_hash:
+			self.image_hashes[entry_id] = bytes.fromhex(image_hash)
+		self.hashes.insert(identity_hash, entry_id)
+		self.ids.setdefault(directory_id, {})[name] = entry_id
+		self.bytes_used += ENTRY_BYTES + len(name)
+		return entry_id
+
+	def get(self, entry_id: int) -> EntryFields:
+		image_hash = self.image_hashes.get(entry_id)
+		return (
+			self.directory_ids[entry_id],
+			self.names[entry_id],
+			self.identity_hashes[entry_id],
+			image_hash.hex() if image_hash else "",
+			self.areas[entry_id]
+		)
+
+	def find(self, directory_id: int, name: str) -> int | None:
+		return self.ids.get(directory_id, {}).get(name)
+
+	def find_beneath(self, directory_ids: Iterable[int]) -> list[int]:
+		return [entry_id for directory_id in directory_ids for entry_id in self.ids.get(directory_id, {}).values()]
+
+	def search(self, identity_hash: int, max_distance: int) -> list[tuple[int, int]]:
+		"""Find every entry whose identity hash is within a distance of the
+		given one
+
+		Returns
+		-------
+		The distance and id of each entry, closest first
+		"""
+		return [(distance, entry_id) for distance, _, entry_id in self.hashes.search(identity_hash, max_distance)]
+
+	def remove(self, entry_id: int) -> None:
+		self.hashes.remove(self.identity_hashes[entry_id], entry_id)
+		directory_id, name = self.directory_ids[entry_id], self.names[entry_id]
+		files = self.ids[directory_id]
+		del files[name]
+		if not files:
+			del self.ids[directory_id]
+		self.names[entry_id] = None
+		self.image_hashes.pop(entry_id, None)
+		self.free.append(entry_id)
+		self.bytes_used -= ENTRY_BYTES + len(name)
+
+	def __iter__(self) -> Iterator[tuple[int, EntryFields]]:
+		for entry_id, name in enumerate(self.names):
+			if name is not None:
+				yield entry_id, self.get(entry_id)
+
+	def close(self) -> None:
+		pass
+
+
+class DiskEntryStore:
+	"""Index entries stored in an SQLite database, for once they no longer
+	fit in memory
+
+	Nothing is held in memory per entry: entries are found by identity hash
+	through a multi-index hash table in the database itself, with each band of
+	the hashes in an indexed column of its own. The database is only a spill
+	file, so it is recreated empty, written without durability guarantees,
+	and only committed every COMMIT_INTERVAL changes.
+	"""
+
+	COMMIT_INTERVAL = 4096
+
+	def __init__(self, path: Path, bands: list[tuple[int, int]]) -> None:
+		"""
+		Parameters
+		----------
+		path: Path to the database, replaced if it exists
+		bands: The shift and width of each band of the identity hashes, as
+			split by a MultiIndexHash
+		"""
+		path.parent.mkdir(parents=True, exist_ok=True)
+		path.unlink(missing_ok=True)
+		self.path = path
+		self.bands = bands
+		self.connection = connect(path, check_same_thread=False)  # callers serialize access
+		self.connection.execute("PRAGMA journal_mode=OFF")
+		self.connection.execute("PRAGMA synchronous=OFF")
+		self.connection.execute(f"""
+			CREATE TABLE entries (
+				id INTEGER PRIMARY KEY,
+				directory_id INTEGER NOT NULL,
+				name TEXT NOT NULL,
+				identity_hash INTEGER NOT NULL,
+				image_hash BLOB,
+				area INTEGER NOT NULL,
+				{"".join(f"band{band} INTEGER NOT NULL, " for band in range(len(bands)))}
+				UNIQUE (directory_id, name)
+			)
+		""")
+		for band in range(len(bands)):
+			self.connection.execute(f"CREATE INDEX band{band}_index ON entries (band{band})")
+		self.columns = ", ".join("?" * (6 + len(bands)))
+		self.count = 0
+		self.uncommitted = 0
+		self.bytes_used = 0  # nothing is held in memory
+
+	def __len__(self) -> int:
+		return self.count
+
+	def __row(self, entry_id: int | None, fields: EntryFields) -> tuple:
+		directory_id, name, identity_hash, image_hash, area = fields
+		return (
+			entry_id, directory_id, name, to_signed(identity_hash), bytes.fromhex(image_hash) if image_hash else None, area,
+			*(to_signed((identity_hash >> shift) & ((1 << width) - 1)) for shift, width in self.bands)
+		)
+
+	def __changed(self) -> None:
+		self.uncommitted += 1
+		if self.uncommitted >= self.COMMIT_INTERVAL:
+			self.connection.commit()
+			self.uncommitted = 0
+
+	def load(self, entries: Iterable[tuple[int, EntryFields]]) -> None:
+		"""Copy in entries, keeping their ids"""
+		with self.connection:
+			cursor = self.connection.executemany(
+				f"INSERT INTO entries VALUES ({self.columns})",
+				(self.__row(entry_id, fields) for entry_id, fields in entries)
+			)
+		self.count += cursor.rowcount
+
+	def add(self, fields: EntryFields) -> int:
+		cursor = self.connection.execute(f"INSERT INTO entries VALUES ({self.columns})", self.__row(None, fields))
+		self.count += 1
+		self.__changed()
+		return cursor.lastrowid
+
+	def get(self, entry_id: int) -> EntryFields:
+		directory_id, name, identity_hash, image_hash, area = self.connection.execute(
+			"SELECT directory_id, name, identity_hash, image_hash, area FROM entries WHERE id = ?", (entry_id,)
+		).fetchone()
+		return directory_id, name, to_unsigned(identity_hash), image_hash.hex() if image_hash else "", area
+
+	def find(self, directory_id: int, name: str) -> int | None:
+		row = self.connection.execute(
+			"SELECT id FROM entries WHERE directory_id = ? AND name = ?", (directory_id, name)
+		).fetchone()
+		return row[0] if row else None
+
+	def find_beneath(self, directory_ids: Iterable[int]) -> list[int]:
+		entry_ids = []
+		for directory_id in directory_ids:
+			entry_ids.extend(row[0] for row in self.connection.execute("SELECT id FROM entries WHERE directory_id = ?", (directory_id,)))
+		return entry_ids
+
+	def search(self, identity_hash: int, max_distance: int) -> list[tuple[int, int]]:
+		"""Find every entry whose identity hash is within a distance of the
+		given one, looking up the bands of the hash as a MultiIndexHash does
+
+		Returns
+		-------
+		The distance and id of each entry, closest first
+		"""
+		radius = max_distance // len(self.bands)
+		conditions = []
+		parameters: list[int] = []
+		for band, (shift, width) in enumerate(self.bands):
+			values = [to_signed(value) for value in neighbours((identity_hash >> shift) & ((1 << width) - 1), width, radius)]
+			conditions.append(f"band{band} IN ({', '.join('?' * len(values))})")
+			parameters.extend(values)
+		matches = []
+		for entry_id, candidate_hash in self.connection.execute(
+			f"SELECT id, identity_hash FROM entries WHERE {' OR '.join(conditions)}", parameters
+		):
+			distance = hamming_distance(identity_hash, to_unsigned(candidate_hash))
+			if distance <= max_distance:
+				matches.append((distance, entry_id))
+		matches.sort()
+		return matches
+
+	def remove(self, entry_id: int) -> None:
+		self.connection.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+		self.count -= 1
+		self.__changed()
+
+	def __iter__(self) -> Iterator[tuple[int, EntryFields]]:
+		for entry_id, directory_id, name, identity_hash, image_hash, area in self.connection.execute(
+			"SELECT id, directory_id, name, identity_hash, image_hash, area FROM entries"
+		):
+			yield entry_id, (directory_id, name, to_unsigned(identity_hash), image_hash.hex() if image_hash else "", area)
+
+	def close(self) -> None:
+		self.connection.close()
+		self.path.unlink(missing_ok=True)
\ No newline at end of file
@@ -0,0 +1,219 @@
+from collections.abc import Callable
+from os import stat_result
+from os.path import join
+from pathlib import Path
+from sqlite3 import connect, Connection
+from typing import NamedTuple
+
+
+class CachedHashes(NamedTuple):
+	identity_hash: str
+	image_hash: str
+	width: int
+	height: int
+
+
+class HashCache:
+	"""A persistent, SQLite-backed store of previously computed image hashes
+
+	The strict hash of an entry is left empty until the file's contents have
+	actually needed to be hashed in full.
+
+	Entries are keyed by (device, inode, size, mtime_ns), so a hit only costs
+	the stat of the file, and any modification to the file invalidates its
+	entry. A cache may be shared between processes, but each process must open
+	its own instance. Writes are buffered in memory and written together in
+	one short transaction, so that no process holds the database's write lock
+	while it hashes.
+
+	Every entry a scan looks up or stores is marked with the scan's id, so once
+	the scan is complete, entries beneath its roots which it did not see can be
+	evicted without checking any files.
+	"""
+
+	COMMIT_INTERVAL = 256
+
+	def __init__(
+		self,
+		path: Path,
+		algorithm: str = "sha256",
+		identity_algorithm: str = "average",
+		check_same_thread: bool = True,
+		scan_id: int | None = None
+	) -> None:
+		"""
+		Parameters
+		----------
+		path: Path to the SQLite database file, created if it does not exist
+		algorithm: The algorithm strict hashes are computed with; cached
+			strict hashes are discarded if it has changed since they were stored
+		identity_algorithm: The algorithm comparative hashes are computed with;
+			the whole cache is discarded if it has changed since it was filled
+		check_same_thread: Whether to forbid use of the cache from threads
+			other than the one which opened it; if not, the caller must
+			serialize access itself
+		scan_id: Identifies the scan using the cache, to mark the entries it
+			sees with, if any
+		"""
+		self.path = path
+		self.path.parent.mkdir(parents=True, exist_ok=True)
+		self.connection: Connection = connect(str(path), timeout=30, check_same_thread=check_same_thread)
+		if self.connection.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+			self.connection.execute("PRAGMA journal_mode=WAL")
+		self.connection.execute("PRAGMA synchronous=NORMAL")
+		self.connection.execute(
+			"CREATE TABLE IF NOT EXISTS hashes ("
+			"device INTEGER NOT NULL, "
+			"inode INTEGER NOT NULL, "
+			"size INTEGER NOT NULL, "
+			"mtime_ns INTEGER NOT NULL, "
+			"path TEXT NOT NULL, "
+			"identity_hash TEXT NOT NULL, "
+			"image_hash TEXT NOT NULL, "
+			"width INTEGER NOT NULL, "
+			"height INTEGER NOT NULL, "
+			"seen INTEGER NOT NULL DEFAULT 0, "
+			"PRIMARY KEY (device, inode, size, mtime_ns))"
+		)
+		if "seen" not in [column[1] for column in self.connection.execute("PRAGMA table_info(hashes)")]:  # made before scans were marked
+			self.connection.execute("ALTER TABLE hashes ADD COLUMN seen INTEGER NOT NULL DEFAULT 0")
+		self.connection.execute(
+			"CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+		)
+		meta = dict(self.connection.execute("SELECT key, value FROM meta").fetchall())
+		if meta.get("identity_algorithm") != identity_algorithm:
+			self.connection.execute("DELETE FROM hashes")
+			self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('identity_algorithm', ?)", (identity_algorithm,))
+		if meta.get("algorithm") != algorithm:
+			self.connection.execute("UPDATE hashes SET image_hash = ''")
+			self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('algorithm', ?)", (algorithm,))
+		self.connection.commit()
+		self.scan_id = scan_id
+		self.pending_puts: dict[tuple[int, int, int, int], tuple[str, CachedHashes]] = {}
+		self.pending_image_hashes: dict[tuple[int, int, int, int], str] = {}
+		self.pending_seen: set[tuple[int, int, int, int]] = set()
+
+	@staticmethod
+	def __key(stat: stat_result) -> tuple[int, int, int, int]:
+		return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+	def get(self, stat: stat_result) -> CachedHashes | None:
+		"""Look up the hashes of a file by its stat result
+
+		Parameters
+		----------
+		stat: The result of stat() on the file
+
+		Returns
+		-------
+		The cached hashes, or None if the file is unknown or has changed
+		"""
+		key = self.__key(stat)
+		if key in self.pending_puts:
+			return self.pending_puts[key][1]
+		row = self.connection.execute(
+			"SELECT identity_hash, image_hash, width, height, seen FROM hashes "
+			"WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+			key
+		).fetchone()
+		if not row:
+			return None
+		hashes = CachedHashes(*row[:4])
+		if self.scan_id is not None and row[4] != self.scan_id:
+			self.pending_seen.add(key)
+			self.__commit_if_full()
+		if key in self.pending_image_hashes:
+			return hashes._replace(image_hash=self.pending_image_hashes[key])
+		return hashes
+
+	def put(self, path: Path, stat: stat_result, hashes: CachedHashes) -> None:
+		"""Store the hashes of a file
+
+		Parameters
+		----------
+		path: Path to the file
+		stat: The result of stat() on the file, taken before it was hashed
+		hashes: The hashes to store
+		"""
+		self.pending_puts[self.__key(stat)] = (str(path), hashes)
+		self.__commit_if_full()
+
+	def set_image_hash(self, stat: stat_result, image_hash: str) -> None:
+		"""Fill in the strict hash of an already cached file
+
+		Parameters
+		----------
+		stat: The result of stat() on the file, taken before it was hashed
+		image_hash: The strict hash of the file's contents
+		"""
+		key = self.__key(stat)
+		if key in self.pending_puts:
+			path, hashes = self.pending_puts[key]
+			self.pending_puts[key] = (path, hashes._replace(image_hash=image_hash))
+		else:
+			self.pending_image_hashes[key] = image_hash
+		self.__commit_if_full()
+
+	def evict_unseen(self, root_directories: list[Path], in_scope: Callable[[str], bool] | None = None) -> int:
+		"""Remove entries of files beneath the root directories which this
+		scan did not see, as they no longer exist or have since changed
+
+		Only call this once the scan has walked all of the root directories.
+
+		Parameters
+		----------
+		root_directories: The directories the scan walked
+		in_scope: Whether the scan took the file at a path, if it only took
+			some of those beneath the root directories, such as one shard
+
+		Returns
+		-------
+		The number of entries removed
+		"""
+		self.commit()
+		stale = []
+		for root_directory in root_directories:
+			prefix = join(str(root_directory), "")
+			for *key, path in self.connection.execute(
+				"SELECT device, inode, size, mtime_ns, path FROM hashes "
+				"WHERE seen != ? AND substr(path, 1, ?) = ?",  # not LIKE, which would treat _ and % in the path as wildcards
+				(self.scan_id, len(prefix), prefix)
+			):
+				if in_scope is None or in_scope(path):
+					stale.append(key)
+		self.connection.executemany(
+			"DELETE FROM hashes WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+			stale
+		)
+		self.connection.commit()
+		return len(stale)
+
+	def __commit_if_full(self) -> None:
+		if len(self.pending_puts) + len(self.pending_image_hashes) + len(self.pending_seen) >= self.COMMIT_INTERVAL:
+			self.commit()
+
+	def commit(self) -> None:
+		if not (self.pending_puts or self.pending_image_hashes or self.pending_seen):
+			return
+		with self.connection:
+			self.connection.executemany(
+				"INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+				[(*key, path, *hashes, self.scan_id or 0) for key, (path, hashes) in self.pending_puts.items()]
+			)
+			self.connection.executemany(
+				"UPDATE hashes SET seen = ? "
+				"WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+				[(self.scan_id, *key) for key in self.pending_seen]
+			)
+			self.connection.executemany(
+				"UPDATE hashes SET image_hash = ? "
+				"WHERE device = ? AND inode = ? AND size = ? AND mtime_ns = ?",
+				[(image_hash, *key) for key, image_hash in self.pending_image_hashes.items()]
+			)
+		self.pending_puts = {}
+		self.pending_image_hashes = {}
+		self.pending_seen = set()
+
+	def close(self) -> None:
+		self.commit()
+		self.connection.close()
\ No newline at end of file
@@ -1,84 +1,281 @@
-from hashlib import sha256
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from copy import copy
+from io import BytesIO
 from logging import getLogger
 from multiprocessing import Process, Queue
-from multiprocessing.managers import DictProxy
+from multiprocessing.shared_memory import SharedMemory
 from multiprocessing.synchronize import Event as MultiprocessingEventType
+from os import stat_result
 from pathlib import Path
-from PIL import Image as PILImage
 from queue import Empty
+from signal import SIG_IGN, SIGINT, signal
+from sys import platform
+from time import perf_counter, time
 
-from imagehash import average_hash, dhash, phash
+from devices import DeviceLimiter
+from discovery import FileBatch
+from hash_cache import CachedHashes, HashCache
+from image_index import IndexEntry, RecordBatch
+from metrics import MetricsRecorder
+from profiling import Profiler
+from revamp.pdd_defaultcomparators.default_comparators import IMAGE_FILE_TYPES
+from revamp.pdd_defaultcomparators.file_types import FileTypeDetector
+from revamp.pdd_defaultcomparators.hashing import ALGORITHMS, HashEngine
+from revamp.pdd_defaultcomparators.image_hashing import decode_reduced, HASH_FUNCTIONS
+from scheduler import WorkerThrottle
+from thumbnails import make_thumbnail, Previews, share_thumbnail
 
 
 log = getLogger()
 
 
+def read_file(path: Path) -> bytes | None:
+	try:
+		return path.read_bytes()
+	except OSError:
+		return None
+
+
 class DiscoveryWorker(Process):
 	IMAGE_EXTENSIONS = ("JPEG", "JPG", "PNG", "GIF", "TIFF", "RAW", "BMP", "WEBP", "SVG")
+	BATCH_SIZE = 64
+	IDLE_INTERVAL = 0.5
+	READ_AHEAD_LIMIT = 4 << 20  # largest file read ahead whole; larger ones are read as they are decoded, to bound each worker's memory
 
 	def __init__(
 		self,
-		directory_queue: "Queue[Path]",
-		duplicate_queue: "Queue[tuple[str, Path, Path, str]]",
-		image_map: "DictProxy[str, tuple[Path, str]]",
-		kill_flag: MultiprocessingEventType
+		file_queue: "Queue[FileBatch | None]",
+		record_queue: "Queue[RecordBatch | Previews | None]",
+		kill_flag: MultiprocessingEventType,
+		metrics: MetricsRecorder,
+		hash_cache_path: Path | None = None,
+		hash_engine: HashEngine | None = None,
+		identity_algorithm: str = "average",
+		profiler: Profiler | None = None,
+		detect_file_types: bool = False,
+		use_libmagic: bool = True,
+		index: int = 0,
+		throttle: WorkerThrottle | None = None,
+		read_threads: int = 0,
+		preview_queue: "Queue[list[Path]] | None" = None,
+		content_hashes: bool = False,
+		devices: DeviceLimiter | None = None,
+		scan_id: int | None = None
 	) -> None:
 		Process.__init__(self)
-		self.directory_queue = directory_queue
-		self.duplicate_queue = duplicate_queue
-		self.image_map = image_map
+		self.file_queue = file_queue
+		self.record_queue = record_queue
 		self.kill_flag = kill_flag
+		self.metrics = metrics
+		self.hash_cache_path = hash_cache_path
+		self.hash_engine = hash_engine or HashEngine()
+		self.identity_algorithm = identity_algorithm
+		self.profiler = profiler or Profiler()
+		self.detect_file_types = detect_file_types
+		self.use_libmagic = use_libmagic
+		self.index = index
+		self.throttle = throttle
+		self.read_threads = read_threads
+		self.read_ahead = 2 * read_threads
+		self.preview_queue = preview_queue
+		self.content_hashes = content_hashes
+		self.devices = devices
+		self.scan_id = scan_id
+		self.read_pool: ThreadPoolExecutor | None = None
+		self.hash_cache: HashCache | None = None
+		self.type_detector: FileTypeDetector | None = None
+		self.records: list[IndexEntry] = []
+		self.sizes: list[int] = []
+		self.finished_batches: list[str] = []
+		self.shared_previews: list[SharedMemory] = []
+
+	def prepare(self, image_path: Path) -> tuple[stat_result, CachedHashes | None] | None:
+		"""Stat an image and look up its hashes in the cache
+
+		Returns
+		-------
+		The image's stat and its cached hashes, if any, or None if it cannot
+		be read or is not an image
+		"""
+		try:
+			with self.metrics.time("stat"):
+				stat = image_path.stat()
+		except OSError:
+			return None
+		if self.hash_cache:
+			cached = self.hash_cache.get(stat)
+			if cached and (cached.image_hash or not self.content_hashes):  # else it is hashed again, content and all
+				self.metrics.add("cache_hits")
+				return stat, cached
+		if self.type_detector and self.type_detector.detect(image_path, stat) not in IMAGE_FILE_TYPES:
+			return None  # not an image, whatever its name
+		return stat, None
 
-	def check_image(self, image_path: Path) -> None:
+	def hash_image(self, image_path: Path, stat: stat_result, data: bytes | None = None) -> CachedHashes | None:
+		"""Decode and hash an image, from its contents if they were already
+		read, or else from the file
+
+		When content hashes are wanted for every image, rather than only for
+		those which must be compared, contents already read are hashed in
+		memory; otherwise the file is hashed in chunks by the hash engine, so
+		no file is ever held whole.
+		"""
 		try:
-			with PILImage.open(image_path) as image:
-				r_width, r_hight = image.size
-				identity_hash = str(average_hash(image))  # comparative hash used to judge similarity to other images
-				# identity_hash = str(dhash(image))
-				# identity_hash = str(phash(image))
+			with self.metrics.time("decode"):
+				grayscale, (width, hight) = decode_reduced(BytesIO(data) if data is not None else image_path)
+			with self.metrics.time("perceptual_hash"):
+				identity_hash = str(HASH_FUNCTIONS[self.identity_algorithm](grayscale))  # comparative hash used to judge similarity to other images
 		except:
+			return None
+		image_hash = ""  # strict hash is only computed if contents must be compared
+		if self.content_hashes:
+			try:
+				with self.metrics.time("content_hash"):
+					image_hash = ALGORITHMS[self.hash_engine.algorithm](data).hexdigest() if data is not None else self.hash_engine.digest(image_path)
+			except OSError:
+				return None
+		self.metrics.add("bytes_hashed", stat.st_size)  # only files actually read and decoded, not cache hits or skipped files
+		hashes = CachedHashes(identity_hash, image_hash, width, hight)
+		if self.hash_cache:
+			self.hash_cache.put(image_path, stat, hashes)
+		return hashes
+
+	def add_record(self, image_path: Path, hashes: CachedHashes | None, size: int = 0) -> None:
+		self.metrics.add("files_hashed")
+		if not hashes:
 			return
-		with image_path.open("rb") as file:
-			data = file.read()
-		image_hash = sha256(data).hexdigest()  # strict hash used to identify equivalent images
-		mapped_path, mapped_hash = self.image_map.get(identity_hash, (Path(), ""))
-		if not mapped_hash:
-			self.image_map[identity_hash] = (image_path, image_hash)
-			return
-		if mapped_hash != image_hash:
-			log.debug("(%s) Adding to queue: %s", self.pid, image_path)
-			self.duplicate_queue.put((identity_hash, mapped_path, image_path, image_hash))
-			return
-		with PILImage.open(str(mapped_path.resolve())) as l_img:
-			l_width, l_hight = l_img.size
-		if l_width * l_hight >= r_width * r_hight:
-			log.info("(%s) Removing %s", self.pid, image_path)
-			image_path.unlink()
-		else:
-			log.info("(%s) Removing %s", self.pid, mapped_path)
-			self.image_map[identity_hash] = (image_path, image_hash)
-			mapped_path.unlink()
-
-	def process_directories(self, directory: Path) -> None:
-		for child_path in directory.iterdir():
+		identity_hash, image_hash, width, hight = hashes
+		self.records.append(IndexEntry(int(identity_hash, 16), image_path, image_hash, width * hight))
+		self.sizes.append(size)
+		if len(self.records) >= self.BATCH_SIZE:
+			self.flush_records()
+
+	def check_batch(self, directory: str, names: list[str]) -> bool:
+		"""Hash every image in a batch, reading the files ahead on the read
+		threads while earlier ones are decoded
+
+		Only files up to READ_AHEAD_LIMIT are read ahead, so the files held by
+		a worker at once take at most that much memory each.
+
+		Returns
+		-------
+		Whether every image was checked, rather than the worker being killed
+		"""
+		reads: deque[tuple[Path, stat_result, Future[bytes | None]]] = deque()
+		for name in names:
 			if self.kill_flag.is_set():
+				break
+			image_path = Path(directory, name)
+			prepared = self.prepare(image_path)
+			if prepared is None:
+				self.add_record(image_path, None)
+			elif prepared[1] or not self.read_pool or prepared[0].st_size > self.READ_AHEAD_LIMIT:
+				self.add_record(image_path, prepared[1] or self.hash_image(image_path, prepared[0]), prepared[0].st_size)
+			else:
+				reads.append((image_path, prepared[0], self.read_pool.submit(read_file, image_path)))
+				if len(reads) > (self.throttle.read_ahead.value if self.throttle else self.read_ahead):
+					image_path, stat, read = reads.popleft()
+					self.add_record(image_path, self.hash_image(image_path, stat, read.result()), stat.st_size)
+		while reads:
+			image_path, stat, read = reads.popleft()
+			if self.kill_flag.is_set():
+				read.cancel()
+				continue
+			self.add_record(image_path, self.hash_image(image_path, stat, read.result()), stat.st_size)
+		return not self.kill_flag.is_set()
+
+	def render_previews(self) -> None:
+		"""Render the thumbnails the index service requests, of images it
+		matched as duplicates, into shared memory for the UI
+
+		On Windows, a block is freed once no process has it open, so the worker
+		keeps its handles to the blocks until it exits; elsewhere a block lasts
+		until it is unlinked, and the worker unmaps it as soon as it is sent.
+		"""
+		while self.preview_queue and not self.kill_flag.is_set():
+			try:
+				paths = self.preview_queue.get_nowait()
+			except Empty:
 				return
-			if child_path.is_dir():
-				self.directory_queue.put(child_path)
-			elif child_path.is_file() and child_path.suffix[1:].upper() in self.IMAGE_EXTENSIONS:
-				self.check_image(child_path)
+			previews = []
+			shared_blocks = []
+			for path in paths:
+				try:
+					with self.metrics.time("preview_render"):
+						thumbnail, shared = share_thumbnail(make_thumbnail(path))
+				except Exception:  # the UI decodes it itself instead
+					previews.append((path, None))
+					continue
+				shared_blocks.append(shared)
+				previews.append((path, thumbnail))
+			self.record_queue.put(Previews(previews))
+			if platform == "win32":
+				self.shared_previews.extend(shared_blocks)
+			else:
+				for shared in shared_blocks:
+					shared.close()
+
+	def flush_records(self) -> None:
+		if self.records or self.finished_batches:
+			self.record_queue.put((time(), self.records, self.finished_batches, self.sizes))
+			self.records = []
+			self.finished_batches = []
+			self.sizes = []
 
 	def run(self) -> None:
-		log.debug("(%s) Starting...", self.pid)
-		empty_passes = 0
-		while not self.kill_flag.is_set():
+		signal(SIGINT, SIG_IGN)  # interrupts are handled by the main process, which sets the kill flag
+		with self.profiler.profile("worker"):
 			try:
-				directory: Path = self.directory_queue.get(True, 1)
-				empty_passes = 0
-				log.debug("(%s) Acquired %s", self.pid, directory)
-				self.process_directories(directory)
-			except Empty:
-				empty_passes += 1
-				if empty_passes >= 10:
-					break
-		log.debug("(%s) Exiting...", self.pid)
\ No newline at end of file
+				log.debug("(%s) Starting...", self.pid)
+				if self.hash_cache_path:
+					self.hash_cache = HashCache(self.hash_cache_path, self.hash_engine.algorithm, self.identity_algorithm, scan_id=self.scan_id)
+				if self.detect_file_types:
+					self.type_detector = FileTypeDetector(use_libmagic=self.use_libmagic)
+				if self.read_threads:
+					self.read_pool = ThreadPoolExecutor(self.read_threads)
+				self.hash_engine = copy(self.hash_engine)  # with its own threads, which a forked copy of the parent's would lack
+				while not self.kill_flag.is_set():
+					self.render_previews()
+					if self.throttle and not self.throttle.may_work(self.index):
+						self.flush_records()
+						self.kill_flag.wait(self.IDLE_INTERVAL)
+						continue
+					waiting_since = perf_counter()
+					try:
+						batch = self.file_queue.get(True, 1)
+					except Empty:
+						self.flush_records()
+						continue
+					self.metrics.observe("queue_wait", perf_counter() - waiting_since)
+					if batch is None:
+						if self.throttle:
+							self.throttle.exhaust()  # wake any idle workers, so each receives its end of input signal
+						break
+					directory, names, slot = batch
+					log.debug("(%s) Acquired %s files in %s", self.pid, len(names), directory)
+					try:
+						finished = self.check_batch(directory, names)
+					finally:
+						if self.devices:
+							self.devices.finish(slot)  # so the scanner may queue the device's next batch
+					if finished:
+						self.finished_batches.append(directory)
+					if self.file_queue.empty():
+						self.flush_records()  # don't hold records back while waiting on more work
+				if self.kill_flag.is_set():
+					self.record_queue.cancel_join_thread()
+				else:
+					self.flush_records()
+					self.render_previews()
+				if self.read_pool:
+					self.read_pool.shutdown(cancel_futures=True)
+				self.hash_engine.close()
+				if self.hash_cache:
+					self.hash_cache.close()
+				for shared in self.shared_previews:
+					shared.close()
+				log.debug("(%s) Exiting...", self.pid)
+			finally:
+				if self.devices:
+					self.devices.worker_exited()  # so the scanner stops waiting on batches no worker will take
\ No newline at end of file
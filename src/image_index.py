@@ -0,0 +1,219 @@
+from logging import getLogger
+from pathlib import Path
+from threading import Lock
+from typing import NamedTuple
+
+from entry_store import DiskEntryStore, MemoryEntryStore
+from revamp.pdd_defaultcomparators.path_table import PathTable
+
+
+log = getLogger()
+
+DIRECTORY_BYTES = 150  # rough memory cost of an interned directory besides its path
+
+
+class IndexEntry(NamedTuple):
+	identity_hash: int  # comparative hash used to judge similarity to other images
+	path: Path
+	image_hash: str  # strict hash used to identify equivalent images, if computed yet
+	area: int
+
+
+RecordBatch = tuple[float, list[IndexEntry], list[str], list[int]]  # when a worker sent the batch, its entries, the directory of each file batch finished, and the size of each entry's file
+
+
+class Removal(NamedTuple):
+	paths: list[Path]  # files, or whole directories, which no longer exist
+
+
+class SimilarityIndex:
+	"""A thread-safe index of images by the Hamming distance between their
+	identity hashes
+
+	Entries are stored compactly in arrays, found by identity hash through a
+	multi-index hash table of their ids, and their paths are split into
+	interned directories and names. Once the entries, hash table and interned
+	directories together outgrow the memory budget, the entries and hash table
+	are spilled to an SQLite database on disk, leaving only the interned
+	directories in memory.
+	"""
+
+	def __init__(self, max_distance: int = 0, memory_budget: int = 0, spill_path: Path | None = None) -> None:
+		"""
+		Parameters
+		----------
+		max_distance: The greatest Hamming distance between two identity hashes
+			for their images to be considered duplicates
+		memory_budget: The most bytes of memory the index may take before its
+			entries are spilled to disk, or 0 never to spill them
+		spill_path: Path to the database to spill entries to, which is
+			deleted once the index is closed
+		"""
+		self.max_distance = max_distance
+		self.memory_budget = memory_budget if spill_path else 0
+		self.spill_path = spill_path
+		self.table = PathTable()
+		self.table_bytes = 0
+		self.store: MemoryEntryStore | DiskEntryStore = MemoryEntryStore(max_distance)
+		self.changes: list[tuple[Path, IndexEntry | None]] | None = None  # entries indexed or removed since they were last taken, if tracked
+		self.lock = Lock()
+
+	def __len__(self) -> int:
+		return len(self.store)
+
+	def __entry(self, entry_id: int) -> IndexEntry:
+		directory_id, name, identity_hash, image_hash, area = self.store.get(entry_id)
+		return IndexEntry(identity_hash, self.table.path(directory_id, name), image_hash, area)
+
+	def __insert(self, entry: IndexEntry) -> None:
+		directory_count = len(self.table)
+		directory_id, name = self.table.intern(entry.path)
+		if len(self.table) > directory_count:
+			self.table_bytes += DIRECTORY_BYTES + len(self.table.directories[directory_id])
+		self.store.add((directory_id, name, entry.identity_hash, entry.image_hash, entry.area))
+		if self.changes is not None:
+			self.changes.append((entry.path, entry))
+		if (
+			self.memory_budget
+			and isinstance(self.store, MemoryEntryStore)
+			and self.store.bytes_used + self.table_bytes > self.memory_budget
+		):
+			log.info("Index exceeded its memory budget at %s entries, spilling to %s", len(self.store), self.spill_path)
+			store = DiskEntryStore(self.spill_path, self.store.hashes.bands)
+			store.load(self.store)
+			self.store = store
+
+	def __find(self, path: Path) -> int | None:
+		reference = self.table.find(path)
+		return None if reference is None else self.store.find(*reference)
+
+	def __delete(self, entry_id: int) -> None:
+		if self.changes is not None:
+			self.changes.append((self.table.path(*self.store.get(entry_id)[:2]), None))
+		self.store.remove(entry_id)
+
+	def entries(self) -> list[IndexEntry]:
+		with self.lock:
+			return [
+				IndexEntry(identity_hash, self.table.path(directory_id, name), image_hash, area)
+				for _, (directory_id, name, identity_hash, image_hash, area) in self.store
+			]
+
+	def track_changes(self) -> None:
+		"""Record every entry indexed or removed from now on, to be taken with
+		take_changes, such as to checkpoint the index incrementally"""
+		with self.lock:
+			self.changes = []
+
+	def take_changes(self) -> list[tuple[Path, IndexEntry | None]]:
+		"""Take the changes recorded since they were last taken
+
+		Returns
+		-------
+		The path of each entry indexed or removed, in order, with the entry,
+		or None if it was removed
+		"""
+		with self.lock:
+			changes = self.changes or []
+			if self.changes is not None:
+				self.changes = []
+			return changes
+
+	def load(self, entries: list[IndexEntry]) -> None:
+		"""Index entries without matching them, such as those of a previous
+		run being resumed
+
+		Parameters
+		----------
+		entries: The entries to index
+		"""
+		with self.lock:
+			for entry in entries:
+				previous = self.__find(entry.path)
+				if previous is not None:
+					self.__delete(previous)
+				self.__insert(entry)
+
+	def match_or_insert(self, entry: IndexEntry) -> IndexEntry | None:
+		"""Find the closest indexed image to an entry, or atomically index the
+		entry if there is none
+
+		Parameters
+		----------
+		entry: The entry to match
+
+		Returns
+		-------
+		The closest matching entry, or None if the entry was indexed instead
+		"""
+		with self.lock:
+			previous = self.__find(entry.path)
+			if previous is not None:
+				self.__delete(previous)  # the image has changed since it was indexed
+			matches = self.store.search(entry.identity_hash, self.max_distance)
+			if matches:
+				return self.__entry(matches[0][1])
+			self.__insert(entry)
+			return None
+
+	def replace(self, old_entry: IndexEntry, new_entry: IndexEntry) -> None:
+		"""Swap an indexed entry for another, such as when the original image
+		is removed in favor of its duplicate
+
+		Parameters
+		----------
+		old_entry: The entry to remove
+		new_entry: The entry to index in its place
+		"""
+		with self.lock:
+			self.__remove(old_entry)
+			previous = self.__find(new_entry.path)
+			if previous is not None:
+				self.__delete(previous)
+			self.__insert(new_entry)
+
+	def __remove(self, entry: IndexEntry) -> bool:
+		entry_id = self.__find(entry.path)
+		if entry_id is None or self.__entry(entry_id) != entry:
+			return False
+		self.__delete(entry_id)
+		return True
+
+	def remove(self, entry: IndexEntry) -> bool:
+		"""Remove an entry from the index
+
+		Parameters
+		----------
+		entry: The entry to remove
+
+		Returns
+		-------
+		Whether the entry was indexed
+		"""
+		with self.lock:
+			return self.__remove(entry)
+
+	def remove_path(self, path: Path) -> list[IndexEntry]:
+		"""Remove the entry of a file, or of every file beneath a directory,
+		from the index
+
+		Parameters
+		----------
+		path: Path to the file or directory
+
+		Returns
+		-------
+		The removed entries
+		"""
+		with self.lock:
+			entry_id = self.__find(path)
+			entry_ids = [entry_id] if entry_id is not None else self.store.find_beneath(self.table.beneath(path))
+			removed = [self.__entry(entry_id) for entry_id in entry_ids]
+			for entry_id in entry_ids:
+				self.__delete(entry_id)
+			return removed
+
+	def close(self) -> None:
+		"""Delete the spilled entries, if any"""
+		with self.lock:
+			self.store.close()
\ No newline at end of file
@@ -0,0 +1,249 @@
+from concurrent.futures import Future, wait
+from logging import getLogger
+from multiprocessing import Queue
+from multiprocessing.synchronize import Event as MultiprocessingEventType
+from pathlib import Path
+from queue import Empty, Queue as ThreadQueue
+from threading import Lock, Thread
+from time import monotonic, time
+
+from checkpoint import Checkpointer, ScanProgress, ScanState
+from clusters import DuplicateClusters, DuplicateGroup
+from hash_cache import HashCache
+from image_index import IndexEntry, RecordBatch, Removal, SimilarityIndex
+from metrics import MetricsRecorder
+from profiling import Profiler
+from revamp.pdd_defaultcomparators.exact_matching import is_exact_match
+from revamp.pdd_defaultcomparators.hashing import HashEngine
+from shard_index import ShardIndexWriter
+from thumbnails import Previews, ThumbnailCache
+
+
+log = getLogger()
+
+
+class IndexService(Thread):
+	"""The sole owner of the image index
+
+	Workers send batches of index entries one way through the record queue,
+	rather than making a round-trip per image, and every check-then-set on the
+	index is resolved here. Candidate pairs are checked for exact equality on
+	a thread pool, then merged into groups of duplicates. Once a group is
+	stable, its exact duplicates are resolved by removing all but the largest
+	image (unless auto_resolve is off), and whatever remains of it is passed on
+	to the duplicate queue. When watching for changes, the scanner also sends the
+	paths of removed files through the record queue, to drop from the index.
+
+	When there is a UI to review duplicates, the workers are asked to render
+	thumbnails of matched images into shared memory, through the preview
+	queue, and send back handles to them through the record queue, which are
+	adopted into the UI's thumbnail cache; so the UI need not decode them.
+
+	Every entry received can also be written to a portable index file, to be
+	merged with the indexes of other scans.
+
+	The scanner's progress, and the file batches workers have finished, are
+	tallied here too, so the scan can be checkpointed with only the
+	directories whose files are all indexed counted as complete.
+	"""
+
+	DELIVERY_INTERVAL = 0.5
+
+	def __init__(
+		self,
+		record_queue: "Queue[RecordBatch | Removal | ScanProgress | Previews | None]",
+		duplicate_queue: "ThreadQueue[DuplicateGroup]",
+		image_index: SimilarityIndex,
+		kill_flag: MultiprocessingEventType,
+		hash_engine: HashEngine,
+		metrics: MetricsRecorder,
+		hash_cache_path: Path | None = None,
+		identity_algorithm: str = "average",
+		auto_resolve: bool = True,
+		profiler: Profiler | None = None,
+		scan_state: ScanState | None = None,
+		checkpointer: Checkpointer | None = None,
+		clusters: DuplicateClusters | None = None,
+		thumbnails: ThumbnailCache | None = None,
+		preview_queue: "Queue[list[Path]] | None" = None,
+		index_writer: ShardIndexWriter | None = None
+	) -> None:
+		Thread.__init__(self)
+		self.record_queue = record_queue
+		self.duplicate_queue = duplicate_queue
+		self.image_index = image_index
+		self.kill_flag = kill_flag
+		self.hash_engine = hash_engine
+		self.metrics = metrics
+		self.hash_cache_path = hash_cache_path
+		self.identity_algorithm = identity_algorithm
+		self.auto_resolve = auto_resolve
+		self.profiler = profiler or Profiler()
+		self.scan_state = scan_state or ScanState()
+		self.checkpointer = checkpointer
+		self.clusters = clusters if clusters is not None else DuplicateClusters()  # an empty one is falsy
+		self.thumbnails = thumbnails
+		self.preview_queue = preview_queue
+		self.index_writer = index_writer
+		self.hash_cache: HashCache | None = None
+		self.hash_cache_lock = Lock()
+
+	def content_digest(self, path: Path) -> str:
+		if not self.hash_cache:
+			with self.metrics.time("content_hash"):
+				return self.hash_engine.digest(path)
+		stat = path.stat()
+		with self.hash_cache_lock:
+			cached = self.hash_cache.get(stat)
+		if cached and cached.image_hash:
+			return cached.image_hash
+		with self.metrics.time("content_hash"):
+			image_hash = self.hash_engine.digest(path)  # strict hash used to identify equivalent images
+		if cached:
+			with self.hash_cache_lock:
+				self.hash_cache.set_image_hash(stat, image_hash)
+		return image_hash
+
+	def resolve(self, mapped: IndexEntry, entry: IndexEntry) -> None:
+		try:
+			if mapped.image_hash and entry.image_hash:
+				is_exact = mapped.image_hash == entry.image_hash
+			else:
+				is_exact = is_exact_match(mapped.path, entry.path, self.content_digest)
+		except OSError:
+			if not mapped.path.exists():
+				self.image_index.remove(mapped)  # removed since it was indexed
+				remapped = self.image_index.match_or_insert(entry)
+				if remapped is not None:
+					self.resolve(remapped, entry)
+				return
+			is_exact = False
+		self.metrics.add("duplicates_found")
+		self.clusters.add(mapped, entry, is_exact)
+
+	def resolve_group(self, group: DuplicateGroup) -> DuplicateGroup | None:
+		"""Remove all but the largest of a group's exact duplicates
+
+		Parameters
+		----------
+		group: The group to resolve
+
+		Returns
+		-------
+		What remains of the group, or None if it no longer has duplicates
+		"""
+		original = group.entries[0]
+		identical = [original] + [entry for entry, exact in zip(group.entries[1:], group.exact) if exact]
+		if len(identical) == 1:
+			return group
+		kept = max(identical, key=lambda entry: entry.area)  # the original, unless a duplicate is larger
+		removed = set()
+		for entry in identical:
+			if entry is kept:
+				continue
+			try:
+				still_exact = is_exact_match(kept.path, entry.path, self.content_digest)  # either may have changed since they were matched
+			except OSError:
+				still_exact = False
+			if not still_exact:
+				log.warning("Keeping %s, which no longer matches %s exactly", entry.path, kept.path)
+				continue
+			log.info("Removing %s", entry.path)
+			entry.path.unlink(missing_ok=True)
+			removed.add(entry.path)
+			if self.thumbnails:
+				self.thumbnails.discard(entry.path)
+		if original.path in removed:
+			self.image_index.replace(original, kept)
+		remaining = [kept] + [entry for entry in group.entries if entry is not kept and entry.path not in removed]
+		return DuplicateGroup(remaining, [False] * (len(remaining) - 1)) if len(remaining) > 1 else None
+
+	@staticmethod
+	def reap(pending: set[Future]) -> set[Future]:
+		"""Log the exception of each finished resolution which raised one
+
+		Returns
+		-------
+		The resolutions which have not finished yet
+		"""
+		for future in pending:
+			if future.done() and future.exception() is not None:
+				log.error("Failed to resolve a duplicate pair", exc_info=future.exception())
+		return {future for future in pending if not future.done()}
+
+	def request_previews(self, paths: list[Path]) -> None:
+		if not (self.thumbnails and self.preview_queue and paths):
+			return
+		paths = self.thumbnails.reserve(paths)
+		if paths:
+			self.preview_queue.put(paths)
+
+	def deliver_groups(self, flush: bool = False) -> None:
+		for group in self.clusters.take_stable(flush):
+			if self.auto_resolve:
+				group = self.resolve_group(group)
+			if group:
+				log.debug("Adding group of %s to queue: %s", len(group.entries), group.entries[0].path)
+				self.duplicate_queue.put(group)
+
+	def run(self) -> None:
+		with self.profiler.profile("index_service"):
+			log.debug("Index service starting...")
+			if self.hash_cache_path:
+				self.hash_cache = HashCache(
+					self.hash_cache_path,
+					self.hash_engine.algorithm,
+					self.identity_algorithm,
+					check_same_thread=False
+				)
+			pending: set[Future] = set()
+			last_delivered = monotonic()
+			while not self.kill_flag.is_set():
+				if monotonic() - last_delivered >= self.DELIVERY_INTERVAL:
+					self.deliver_groups()
+					last_delivered = monotonic()
+				if self.checkpointer and self.checkpointer.due():
+					wait(pending)  # so every candidate is either indexed or queued as a duplicate
+					pending = self.reap(pending)
+					self.checkpointer.save(self.scan_state, self.image_index.take_changes())
+				try:
+					batch = self.record_queue.get(True, 1)
+				except Empty:
+					continue
+				if batch is None:
+					break
+				if isinstance(batch, ScanProgress):
+					self.scan_state.update(batch)
+					continue
+				if isinstance(batch, Previews):
+					for path, thumbnail in batch.thumbnails:
+						self.thumbnails.adopt(path, thumbnail)
+					continue
+				if isinstance(batch, Removal):
+					for path in batch.paths:
+						for removed in self.image_index.remove_path(path):
+							log.debug("Removed %s from the index", removed.path)
+					continue
+				sent_at, entries, finished_batches, sizes = batch
+				self.metrics.observe("index_ipc", time() - sent_at)
+				matched = []
+				for entry, size in zip(entries, sizes):
+					if self.index_writer:
+						self.index_writer.write(entry, size)
+					mapped = self.image_index.match_or_insert(entry)
+					if mapped is not None:
+						pending.add(self.hash_engine.file_pool.submit(self.resolve, mapped, entry))
+						matched.extend((mapped.path, entry.path))
+				self.request_previews(matched)
+				for directory in finished_batches:
+					self.scan_state.finish_batch(directory)
+				pending = self.reap(pending)
+			wait(pending)
+			self.reap(pending)
+			if not self.kill_flag.is_set():
+				self.deliver_groups(flush=True)  # no more pairs can join any group; if killed, they are checkpointed instead
+			if self.thumbnails:
+				self.thumbnails.cancel_reservations()  # the workers have exited
+			if self.hash_cache:
+				self.hash_cache.close()
+			log.debug("Index service exiting...")
\ No newline at end of file
@@ -1,17 +1,35 @@
 # TODO: Add docstrings
 # TODO: Make catch more similar images
-# TODO: Make exit gracefully on full completion
 # TODO: Make handle other file types
-# TODO: Experiment with using a dedicated discovery process and let comparisons happen on a per-image basis
 
+from argparse import ArgumentParser, Namespace
 from logging import DEBUG, Formatter, getLevelName, getLogger, handlers, WARNING
-from multiprocessing import cpu_count, Event as MultiprocessingEvent, Manager, Process, Queue
-from multiprocessing.managers import DictProxy
+from multiprocessing import Event as MultiprocessingEvent, Process, Queue, resource_tracker
+from multiprocessing.connection import wait
 from multiprocessing.synchronize import Event as MultiprocessingEventType
+from os import getpid
+from os.path import join, split
 from pathlib import Path
+from queue import Empty, Queue as ThreadQueue
+from sys import platform
 from threading import Thread
+from time import time_ns
 
+from checkpoint import Checkpointer, load_checkpoint, ScanProgress, ScanState
+from clusters import DuplicateClusters, DuplicateGroup
+from devices import DeviceLimiter
+from discovery import DirectoryScanner, FileBatch
+from hash_cache import HashCache
 from image_handler import DiscoveryWorker
+from image_index import RecordBatch, Removal, SimilarityIndex
+from index_service import IndexService
+from metrics import Metrics, MetricsWriter
+from profiling import merge_profiles, Profiler
+from report import read_report, ReportWriter
+from revamp.pdd_defaultcomparators.hashing import HashEngine, set_default_engine
+from scheduler import pool_limits, Scheduler, WorkerThrottle
+from shard_index import merge_shard_indexes, parse_shard, relative_to_root, shard_of, ShardIndexWriter
+from thumbnails import Previews, ThumbnailCache
 from user_interface import UserInterface
 from utils import backup, BASE_DIRECTORY, CONFIGS
 
@@ -22,6 +40,32 @@ if not LOG_PATH.is_absolute():
 if not LOG_PATH.parent.exists():
 	LOG_PATH = BASE_DIRECTORY.joinpath("logs", LOG_PATH.name)
 LOG_LEVEL = getLevelName(CONFIGS["logging"]["level"])
+IDENTITY_ALGORITHM = CONFIGS.get("perceptual_hash", {}).get("algorithm", "average")
+HASH_CACHE_PATH: Path | None = None
+if CONFIGS.get("hash_cache", {}).get("enabled", False):
+	HASH_CACHE_PATH = Path(CONFIGS["hash_cache"]["path"])
+	if not HASH_CACHE_PATH.is_absolute():
+		HASH_CACHE_PATH = BASE_DIRECTORY.joinpath(HASH_CACHE_PATH)
+METRICS_PATH: Path | None = None
+if CONFIGS.get("metrics", {}).get("enabled", False):
+	METRICS_PATH = Path(CONFIGS["metrics"]["path"])
+	if not METRICS_PATH.is_absolute():
+		METRICS_PATH = BASE_DIRECTORY.joinpath(METRICS_PATH)
+PROFILING_CONFIGS = CONFIGS.get("profiling", {})
+SCHEDULER_CONFIGS = CONFIGS.get("scheduler", {})
+REVIEW_CONFIGS = CONFIGS.get("review", {})
+DEVICE_CONFIGS = CONFIGS.get("devices", {})
+INDEX_MEMORY_BUDGET = int(CONFIGS.get("index", {}).get("memory_budget_mb", 0) * (1 << 20))
+INDEX_SPILL_PATH = Path(CONFIGS.get("index", {}).get("spill_path", "resources/index_spill.sqlite3"))
+if not INDEX_SPILL_PATH.is_absolute():
+	INDEX_SPILL_PATH = BASE_DIRECTORY.joinpath(INDEX_SPILL_PATH)
+DETECT_FILE_TYPES = CONFIGS.get("file_types", {}).get("detect", False)
+USE_LIBMAGIC = CONFIGS.get("file_types", {}).get("libmagic", True)
+CHECKPOINT_PATH: Path | None = None
+if CONFIGS.get("checkpoint", {}).get("enabled", False):
+	CHECKPOINT_PATH = Path(CONFIGS["checkpoint"]["path"])
+	if not CHECKPOINT_PATH.is_absolute():
+		CHECKPOINT_PATH = BASE_DIRECTORY.joinpath(CHECKPOINT_PATH)
 
 log = getLogger()
 log.setLevel(LOG_LEVEL)
@@ -31,51 +75,381 @@ file_handler.setFormatter(Formatter('%(asctime)s - %(name)s - %(levelname)s - %(
 log.addHandler(file_handler)
 getLogger("PIL").setLevel(WARNING)
 
+
 class Main:
-	def __init__(self) -> None:
+	def __init__(self, arguments: Namespace) -> None:
 		log.info("Starting application...")
-		self.duplicate_queue: Queue[tuple[str, Path, Path, str]] = Queue()
-		self.image_map: DictProxy[str, tuple[Path, str]] = Manager().dict()
+		self.duplicate_queue: ThreadQueue[DuplicateGroup] = ThreadQueue()
+		self.clusters = DuplicateClusters(CONFIGS.get("clusters", {}).get("stable_after", 2))
+		self.record_queue: Queue[RecordBatch | Removal | ScanProgress | Previews | None] = Queue()
+		self.image_index = SimilarityIndex(
+			CONFIGS.get("perceptual_hash", {}).get("max_distance", 0),
+			INDEX_MEMORY_BUDGET,
+			INDEX_SPILL_PATH.with_name(f"{INDEX_SPILL_PATH.stem}-{getpid()}{INDEX_SPILL_PATH.suffix}")  # never shared, even by concurrent scans
+		)
+		if arguments.merge:
+			self.merge_indexes([Path(index_path) for index_path in arguments.merge], Path(arguments.output), arguments.format)
+			return
+		self.hash_engine = HashEngine(**CONFIGS.get("hashing", {}))
+		set_default_engine(self.hash_engine)
 		self.discovery_complete_flag: MultiprocessingEventType = MultiprocessingEvent()
 		self.kill_flag: MultiprocessingEventType = MultiprocessingEvent()
+		self.min_workers, self.worker_count, initial_workers = pool_limits(SCHEDULER_CONFIGS)
+		self.throttle = WorkerThrottle(initial_workers, SCHEDULER_CONFIGS.get("listing_threads", 1), 2 * SCHEDULER_CONFIGS.get("read_threads", 0))
+		self.devices = DeviceLimiter(DEVICE_CONFIGS.get("limits")) if DEVICE_CONFIGS.get("enabled", False) else None
+		self.scheduler: Scheduler | None = None
+		self.watch = arguments.watch
+		self.shard: tuple[int, int] | None = arguments.shard
+		self.index_output = Path(arguments.index_output) if arguments.index_output else None
+		self.checkpoint_path = run_path(CHECKPOINT_PATH, self.shard, arguments.index_output) if CHECKPOINT_PATH else None
+		self.metrics = Metrics(self.worker_count + 2)  # this process, the scanner, then each worker
+		self.metrics_recorder = self.metrics.recorder(0)
+		self.metrics_writer: MetricsWriter | None = None
+		if METRICS_PATH:
+			self.metrics_writer = MetricsWriter(
+				self.metrics,
+				METRICS_PATH,
+				CONFIGS["metrics"].get("interval", 5),
+				echo=arguments.headless
+			)
+		profile_directory = None
+		if arguments.profile or PROFILING_CONFIGS.get("enabled", False):
+			profile_directory = Path(PROFILING_CONFIGS.get("directory", "logs/profiles"))
+			if not profile_directory.is_absolute():
+				profile_directory = BASE_DIRECTORY.joinpath(profile_directory)
+		self.profiler = Profiler(
+			profile_directory,
+			arguments.profile_sampling if arguments.profile_sampling is not None else PROFILING_CONFIGS.get("sampling_interval", 0)
+		)
+		self.profiler.clear()
+		self.process_monitor: Thread | None = None
+		self.user_interface: UserInterface | None = None
+		self.thumbnails: ThumbnailCache | None = None
+		self.preview_queue: Queue[list[Path]] | None = None
+		if not arguments.headless:
+			self.thumbnails = ThumbnailCache(REVIEW_CONFIGS.get("thumbnail_cache", 64), REVIEW_CONFIGS.get("shared_previews", 0))
+			if self.thumbnails.max_shared:
+				self.preview_queue = Queue()
+				self.preview_queue.cancel_join_thread()  # requests left once the workers exit are abandoned
+		self.checkpoint = None
+		scan_state = None
+		if arguments.resume:
+			self.checkpoint = load_checkpoint(self.checkpoint_path)
+			log.info("Resuming from %s, with %s entries indexed", self.checkpoint_path, len(self.checkpoint.entries))
+			self.shard = self.checkpoint.shard  # a checkpoint named for its index is resumed without giving the shard again
+			self.image_index.load(self.checkpoint.entries)
+			for group in self.checkpoint.groups:  # clustered again rather than queued, so images listed again rejoin the same groups
+				for duplicate, exact in zip(group.entries[1:], group.exact):
+					self.clusters.add(group.entries[0], duplicate, exact)
+			scan_state = ScanState(self.checkpoint.pending, self.checkpoint.unfinished, self.checkpoint.completed)
+		self.scan_id = self.checkpoint.scan_id if self.checkpoint else time_ns()  # marks the hash cache entries the scan sees, across its runs
+		self.root_directories: list[Path] = []
+		self.checkpointer: Checkpointer | None = None
+		if self.checkpoint_path:
+			self.checkpointer = Checkpointer(self.checkpoint_path, CONFIGS["checkpoint"].get("interval", 60), self.unresolved_groups, self.shard, self.scan_id)
+		self.index_service = IndexService(
+			self.record_queue,
+			self.duplicate_queue,
+			self.image_index,
+			self.kill_flag,
+			self.hash_engine,
+			self.metrics_recorder,
+			HASH_CACHE_PATH,
+			IDENTITY_ALGORITHM,
+			auto_resolve=not arguments.headless or arguments.resolve_exact,
+			profiler=self.profiler,
+			scan_state=scan_state,
+			checkpointer=self.checkpointer,
+			clusters=self.clusters,
+			thumbnails=self.thumbnails,
+			preview_queue=self.preview_queue
+		)
+		if arguments.headless:
+			self.run_headless(
+				self.checkpoint.root_directories if self.checkpoint
+				else [Path(root) for root in arguments.roots or CONFIGS.get("scan", {}).get("roots", [])],
+				Path(arguments.output),
+				arguments.format,
+				arguments.resolve_exact
+			)
+			return
 		self.user_interface = UserInterface(
 			self.duplicate_queue,
-			self.image_map,
+			self.image_index,
 			self.discovery_complete_flag,
-			self.kill_flag
+			self.kill_flag,
+			self.metrics_recorder,
+			REVIEW_CONFIGS.get("prefetch", 8),
+			self.thumbnails
 		)
+		if arguments.review:
+			self.user_interface.build(select_directory=False)
+			self.load_report(Path(arguments.review))
+			self.start_metrics()
+			self.user_interface.start()
+			self.shutdown()
+			return
+		if self.checkpoint:
+			self.user_interface.build(select_directory=False)
+			self.start_scan(self.checkpoint.root_directories)
+			self.user_interface.start()
+			self.shutdown()
+			return
 		root_directory = self.user_interface.build()
 		log.debug("User selected base directory: %s", root_directory)
 		if LOG_LEVEL == DEBUG:
 			backup(root_directory)
-		self.__spawn_processes(root_directory)
+		self.start_scan([root_directory])
+		self.user_interface.start()
+		self.shutdown()
+
+	def start_scan(self, root_directories: list[Path]) -> None:
+		self.root_directories = root_directories
+		if self.checkpointer:
+			self.checkpointer.start(root_directories, self.checkpoint)
+			self.image_index.track_changes()  # after any resumed entries were loaded, which are already in the checkpoint
+		if HASH_CACHE_PATH:
+			HashCache(HASH_CACHE_PATH, self.hash_engine.algorithm, IDENTITY_ALGORITHM).close()  # create the cache before workers contend for it
+		if self.preview_queue and platform != "win32":  # Windows frees shared memory by handle counts, without a tracker
+			resource_tracker.ensure_running()  # shared by the workers, so the previews they render outlive them, yet not the application
+		self.__spawn_processes(root_directories)  # fork before any threads exist, which could hold locks the children inherit
+		self.index_service.start()
+		self.scheduler.start()
+		self.start_metrics()
 		self.process_monitor = Thread(target=self.__monitor_processes)
 		self.process_monitor.start()
-		self.user_interface.start()
+
+	def start_metrics(self) -> None:
+		if self.metrics_writer:
+			self.metrics_writer.start()
+
+	def shutdown(self) -> None:
+		if self.process_monitor:
+			self.process_monitor.join()
+		if self.scheduler:
+			self.scheduler.stop()
+		if self.metrics_writer:
+			self.metrics_writer.stop()
+		if self.checkpointer and self.checkpointer.root_directories:
+			if self.index_service.scan_state.is_complete() and not self.unresolved_groups():
+				self.checkpointer.discard()
+			else:
+				self.checkpointer.save(self.index_service.scan_state, self.image_index.take_changes())
+				log.info("Saved checkpoint to %s, resume with --resume", self.checkpointer.path)
+		self.image_index.close()
+		if self.thumbnails:
+			self.thumbnails.close()
+		if self.profiler.directory:
+			report_path = merge_profiles(self.profiler.directory)
+			if report_path:
+				log.info("Wrote merged profile to %s", report_path)
+
+	def run_headless(
+		self,
+		root_directories: list[Path],
+		output_path: Path,
+		report_format: str | None,
+		resolve_exact: bool
+	) -> None:
+		if not root_directories:
+			raise ValueError("No root directories given to scan")
+		log.debug("Scanning headless: %s", root_directories)
+		if resolve_exact and LOG_LEVEL == DEBUG:
+			for root_directory in root_directories:
+				backup(root_directory)
+		writer = ReportWriter(output_path, report_format, append=self.checkpoint is not None)
+		index_writer = None
+		if self.index_output:
+			index_writer = self.index_service.index_writer = ShardIndexWriter(
+				self.index_output,
+				root_directories,
+				self.shard,
+				self.hash_engine.algorithm,
+				IDENTITY_ALGORITHM,
+				append=self.checkpoint is not None
+			)
+		self.start_scan(root_directories)
+		if self.watch:
+			print("Watching for changes, press Ctrl+C to stop")
+		try:
+			while not (self.discovery_complete_flag.is_set() and self.duplicate_queue.empty()):
+				try:
+					writer.write(self.duplicate_queue.get(True, 1))
+				except Empty:
+					continue
+		except KeyboardInterrupt:
+			log.info("Interrupted, stopping scan...")
+			self.kill_flag.set()
+		self.shutdown()
+		writer.close()
+		log.info("Wrote %s duplicate groups to %s", writer.count, output_path)
+		print(f"Wrote {writer.count} duplicate groups to {output_path}")
+		if index_writer:
+			index_writer.close()
+			log.info("Wrote %s images to index %s", index_writer.count, self.index_output)
+			print(f"Wrote {index_writer.count} images to index {self.index_output}")
+
+	def merge_indexes(self, index_paths: list[Path], output_path: Path, report_format: str | None) -> None:
+		writer = ReportWriter(output_path, report_format)
+		try:
+			for group in merge_shard_indexes(index_paths, self.image_index):
+				writer.write(group)
+		finally:
+			writer.close()
+			self.image_index.close()
+		log.info("Wrote %s duplicate groups from %s indexes to %s", writer.count, len(index_paths), output_path)
+		print(f"Wrote {writer.count} duplicate groups from {len(index_paths)} indexes to {output_path}")
+
+	def load_report(self, report_path: Path) -> None:
+		for group in read_report(report_path):
+			self.image_index.match_or_insert(group.entries[0])
+			self.duplicate_queue.put(group)
+		self.discovery_complete_flag.set()
+		log.debug("Loaded %s duplicate groups from %s", self.duplicate_queue.qsize(), report_path)
+
+	def unresolved_groups(self) -> list[DuplicateGroup]:
+		with self.duplicate_queue.mutex:
+			groups = list(self.duplicate_queue.queue)
+		if self.user_interface:
+			groups = self.user_interface.pending_groups() + groups
+		return groups + self.clusters.pending()
 
 	def __monitor_processes(self) -> None:
-		for process in self.processes:
-			process.join()
+		running = {process.sentinel: process for process in self.processes}
+		while running:
+			for sentinel in wait(list(running)):
+				process = running.pop(sentinel)
+				process.join()
+				if process.exitcode:  # a crashed process would leave the others waiting on it forever
+					log.error("%s exited with code %s, stopping the scan", process.name, process.exitcode)
+					self.kill_flag.set()
+		if self.kill_flag.is_set():
+			self.record_queue.cancel_join_thread()  # the index service stops reading, leaving the workers' abandoned records in the pipe
+		self.record_queue.put(None)
+		self.index_service.join()
+		self.hash_engine.close()
 		self.discovery_complete_flag.set()
 		log.debug("Discovery complete!")
+		if HASH_CACHE_PATH and not self.kill_flag.is_set():
+			hash_cache = HashCache(HASH_CACHE_PATH, self.hash_engine.algorithm, IDENTITY_ALGORITHM, scan_id=self.scan_id)
+			log.debug("Evicted %s stale hash cache entries", hash_cache.evict_unseen(self.root_directories, self.in_shard))
+			hash_cache.close()
+
+	def in_shard(self, path: str) -> bool:
+		"""Whether a file is in the shard being scanned, if any"""
+		if not self.shard:
+			return True
+		index, count = self.shard
+		directory, name = split(path)
+		relative = relative_to_root(directory, [str(root_directory) for root_directory in self.root_directories])
+		return shard_of(join(relative, name), count) == index  # as the scanner assigns it
 
-	def __spawn_processes(self, root_directory: Path) -> None:
-		directory_queue: Queue[Path] = Queue()
-		directory_queue.put(root_directory)
-		self.processes: list[Process] = []
-		for _ in range(cpu_count() - 2):
+	def __spawn_processes(self, root_directories: list[Path]) -> None:
+		file_queue: Queue[FileBatch | None] = Queue()
+		self.processes: list[Process] = [
+			DirectoryScanner(
+				root_directories,
+				file_queue,
+				self.record_queue,
+				self.worker_count,
+				self.kill_flag,
+				None if DETECT_FILE_TYPES else DiscoveryWorker.IMAGE_EXTENSIONS,
+				self.metrics.recorder(1),
+				self.profiler,
+				self.watch,
+				self.checkpoint.pending if self.checkpoint and not self.watch else None,
+				self.checkpoint.unfinished if self.checkpoint and not self.watch else None,
+				set(self.checkpoint.completed) if self.checkpoint and self.watch else None,  # every directory must be walked to be watched
+				SCHEDULER_CONFIGS.get("listing_threads", 1),
+				self.shard,
+				self.devices,
+				self.throttle
+			)
+		]
+		for index in range(self.worker_count):
 			self.processes.append(
 				DiscoveryWorker(
-					directory_queue,
-					self.duplicate_queue,
-					self.image_map,
-					self.kill_flag
+					file_queue,
+					self.record_queue,
+					self.kill_flag,
+					self.metrics.recorder(index + 2),
+					HASH_CACHE_PATH,
+					self.hash_engine,
+					IDENTITY_ALGORITHM,
+					self.profiler,
+					DETECT_FILE_TYPES,
+					USE_LIBMAGIC,
+					index,
+					self.throttle,
+					SCHEDULER_CONFIGS.get("read_threads", 0),
+					self.preview_queue,
+					self.index_output is not None,  # an index is only mergeable with content hashes for every image
+					self.devices,
+					self.scan_id
 				)
 			)
 		log.debug("Spawning processes...")
 		for process in self.processes:
 			process.start()
+		self.scheduler = Scheduler(
+			self.throttle,
+			file_queue,
+			self.metrics,
+			self.min_workers,
+			self.worker_count,
+			SCHEDULER_CONFIGS.get("interval", 2),
+			SCHEDULER_CONFIGS.get("listing_threads", 1),
+			SCHEDULER_CONFIGS.get("read_threads", 0)
+		)
+
+
+def run_path(path: Path, shard: tuple[int, int] | None, index_output: str | None) -> Path:
+	"""Derive the path of a file kept for a scan, such as its checkpoint,
+	named for the scan's index, or else for its shard, so concurrent scans
+	into separate indexes or of separate shards do not share it
+
+	Parameters
+	----------
+	path: The file's configured path
+	shard: The scan's shard, as its index from 0 and the number of shards,
+		if any
+	index_output: The path of the scan's index, if any
+	"""
+	if index_output:
+		return path.with_name(f"{path.stem}-{Path(index_output).stem}{path.suffix}")
+	if shard:
+		return path.with_name(f"{path.stem}-shard-{shard[0] + 1}-of-{shard[1]}{path.suffix}")
+	return path
+
+
+def parse_arguments() -> Namespace:
+	parser = ArgumentParser(description="Find and clean up duplicate images")
+	parser.add_argument("roots", nargs="*", help="directories to scan in headless mode, defaulting to scan.roots in config.json")
+	parser.add_argument("--headless", action="store_true", help="scan without the GUI, writing duplicates to a report")
+	parser.add_argument("-o", "--output", default="duplicates.jsonl", help="path of the headless report")
+	parser.add_argument("--format", choices=("jsonl", "csv"), help="report format, inferred from the output extension by default")
+	parser.add_argument("--resolve-exact", action="store_true", help="in headless mode, delete all but the largest of exact duplicates rather than report them")
+	parser.add_argument("--review", metavar="REPORT", help="review the duplicates in a report in the GUI instead of scanning")
+	parser.add_argument("--shard", type=parse_shard, metavar="I/N", help="scan only the Ith of N shards of the images, split by a hash of their paths relative to their roots, so separate scans can split an archive")
+	parser.add_argument("--index-output", metavar="INDEX", help="in headless mode, also write every image scanned to a portable index, to be merged with --merge")
+	parser.add_argument("--merge", nargs="+", metavar="INDEX", help="merge the indexes of separate scans into one report of duplicate groups at --output, without reading any images")
+	parser.add_argument("--watch", action="store_true", help="after the initial scan, keep watching the directories for new and changed images (Linux only)")
+	parser.add_argument("--resume", action="store_true", help="resume the scan saved in the last checkpoint")
+	parser.add_argument("--profile", action="store_true", help="profile every process, merging the profiles at shutdown")
+	parser.add_argument("--profile-sampling", type=float, metavar="SECONDS", help="also sample every thread's stack at this interval while profiling")
+	arguments = parser.parse_args()
+	if arguments.index_output and not arguments.headless:
+		parser.error("--index-output requires --headless")
+	if arguments.index_output and arguments.resolve_exact:
+		parser.error("--index-output cannot be used with --resolve-exact, as the index would list the deleted images")
+	if arguments.resume:
+		if not CHECKPOINT_PATH:
+			parser.error("--resume requires checkpoints to be enabled in config.json")
+		checkpoint_path = run_path(CHECKPOINT_PATH, arguments.shard, arguments.index_output)
+		if not checkpoint_path.exists():
+			parser.error(f"there is no checkpoint at {checkpoint_path} to resume")
+	return arguments
 
 
 if __name__ == "__main__":
-	Main()
\ No newline at end of file
+	Main(parse_arguments())
\ No newline at end of file
@@ -0,0 +1,206 @@
+from bisect import bisect_left
+from collections.abc import Iterator
+from contextlib import contextmanager
+from json import dumps
+from logging import getLogger
+from multiprocessing.sharedctypes import RawArray
+from os import replace
+from pathlib import Path
+from sys import stderr
+from threading import Event, Lock, Thread
+from time import monotonic, perf_counter
+
+
+log = getLogger()
+
+STAGES = (
+	"listing",
+	"stat",
+	"decode",
+	"perceptual_hash",
+	"content_hash",
+	"preview_render",
+	"index_ipc",
+	"queue_wait",
+	"ui_decision"
+)
+COUNTERS = ("files_listed", "files_hashed", "bytes_hashed", "cache_hits", "duplicates_found", "listing_complete")
+BUCKETS = tuple(2.0 ** exponent for exponent in range(-20, 5))  # upper bounds in seconds, from about 1us to 16s
+STAGE_WIDTH = 2 + len(BUCKETS) + 1  # count, sum, then each bucket and the overflow
+SLOT_WIDTH = len(COUNTERS) + len(STAGES) * STAGE_WIDTH
+METRIC_PREFIX = "duplicate_cleaner"
+
+
+class MetricsRecorder:
+	"""Records into one process's slot of a Metrics table
+
+	Only the owning process writes to a slot, so recording needs no
+	inter-process locking; the lock only serializes threads within the
+	process.
+	"""
+
+	def __init__(self, values: "RawArray", slot: int) -> None:
+		self.values = values
+		self.offset = slot * SLOT_WIDTH
+		self.lock = Lock()
+
+	def __getstate__(self) -> dict:
+		state = self.__dict__.copy()
+		del state["lock"]
+		return state
+
+	def __setstate__(self, state: dict) -> None:
+		self.__dict__.update(state)
+		self.lock = Lock()
+
+	def add(self, counter: str, amount: float = 1) -> None:
+		with self.lock:
+			self.values[self.offset + COUNTERS.index(counter)] += amount
+
+	def observe(self, stage: str, seconds: float) -> None:
+		base = self.offset + len(COUNTERS) + STAGES.index(stage) * STAGE_WIDTH
+		with self.lock:
+			self.values[base] += 1
+			self.values[base + 1] += seconds
+			self.values[base + 2 + bisect_left(BUCKETS, seconds)] += 1
+
+	@contextmanager
+	def time(self, stage: str) -> Iterator[None]:
+		start = perf_counter()
+		try:
+			yield
+		finally:
+			self.observe(stage, perf_counter() - start)
+
+
+class Metrics:
+	"""Counters and latency histograms for each stage of a scan, aggregated
+	across processes
+
+	Each process records into its own slot of a shared array, and the slots
+	are summed whenever a snapshot is taken, so recording never blocks on, or
+	sends a message to, another process.
+	"""
+
+	def __init__(self, slots: int) -> None:
+		"""
+		Parameters
+		----------
+		slots: The number of processes which will record metrics
+		"""
+		self.values = RawArray("d", slots * SLOT_WIDTH)
+		self.slots = slots
+
+	def recorder(self, slot: int) -> MetricsRecorder:
+		if not 0 <= slot < self.slots:
+			raise IndexError(f"Metrics slot {slot} out of range")
+		return MetricsRecorder(self.values, slot)
+
+	def snapshot(self) -> dict:
+		"""Sum every process's slot
+
+		Returns
+		-------
+		A dict of each counter to its total, and of "stages" to a dict of each
+		stage to its count, sum, and per-bucket (not cumulative) counts
+		"""
+		totals = [0.0] * SLOT_WIDTH
+		for slot in range(self.slots):
+			for index, value in enumerate(self.values[slot * SLOT_WIDTH:(slot + 1) * SLOT_WIDTH]):
+				totals[index] += value
+		snapshot: dict = {counter: totals[index] for index, counter in enumerate(COUNTERS)}
+		snapshot["stages"] = {}
+		for index, stage in enumerate(STAGES):
+			base = len(COUNTERS) + index * STAGE_WIDTH
+			snapshot["stages"][stage] = {
+				"count": int(totals[base]),
+				"sum": totals[base + 1],
+				"buckets": [int(count) for count in totals[base + 2:base + STAGE_WIDTH]]
+			}
+		return snapshot
+
+
+def to_prometheus(snapshot: dict) -> str:
+	"""Render a snapshot in the Prometheus text exposition format"""
+	lines = []
+	for counter in COUNTERS:
+		lines.append(f"# TYPE {METRIC_PREFIX}_{counter}_total counter")
+		lines.append(f"{METRIC_PREFIX}_{counter}_total {snapshot[counter]:g}")
+	name = f"{METRIC_PREFIX}_stage_seconds"
+	lines.append(f"# TYPE {name} histogram")
+	for stage, histogram in snapshot["stages"].items():
+		cumulative = 0
+		for bound, count in zip(BUCKETS + (float("inf"),), histogram["buckets"]):
+			cumulative += count
+			lines.append(f'{name}_bucket{{stage="{stage}",le="{"+Inf" if bound == float("inf") else f"{bound:g}"}"}} {cumulative}')
+		lines.append(f'{name}_sum{{stage="{stage}"}} {histogram["sum"]:g}')
+		lines.append(f'{name}_count{{stage="{stage}"}} {histogram["count"]}')
+	return "\n".join(lines) + "\n"
+
+
+class MetricsWriter(Thread):
+	"""Periodically writes a snapshot of the metrics to a file, and reports
+	progress and an estimated time remaining
+
+	The file is written as Prometheus text if its extension is .prom, and as
+	JSON otherwise.
+	"""
+
+	def __init__(self, metrics: Metrics, path: Path, interval: float = 5.0, echo: bool = False) -> None:
+		"""
+		Parameters
+		----------
+		metrics: The metrics to write
+		path: Path to the metrics file, replaced on every write
+		interval: Seconds between writes
+		echo: Whether to also print the progress line to stderr
+		"""
+		Thread.__init__(self, daemon=True)
+		self.metrics = metrics
+		self.path = path
+		self.interval = interval
+		self.echo = echo
+		self.stopped = Event()
+		self.started_at = monotonic()
+		self.last_progress = (self.started_at, 0.0)
+
+	def progress(self, snapshot: dict) -> str:
+		now = monotonic()
+		listed, hashed = snapshot["files_listed"], snapshot["files_hashed"]
+		last_time, last_hashed = self.last_progress
+		rate = (hashed - last_hashed) / (now - last_time) if now > last_time else 0.0
+		self.last_progress = (now, hashed)
+		line = f"{hashed:.0f}/{listed:.0f}{'' if snapshot['listing_complete'] else '+'} files, {rate:.1f} files/s"
+		if rate > 0:
+			remaining = int((listed - hashed) / rate)
+			line += f", ETA {remaining // 3600}:{remaining // 60 % 60:02}:{remaining % 60:02}"
+		return line
+
+	def write(self) -> None:
+		snapshot = self.metrics.snapshot()
+		snapshot["elapsed"] = monotonic() - self.started_at
+		temporary_path = self.path.with_name(self.path.name + ".tmp")
+		try:
+			self.path.parent.mkdir(parents=True, exist_ok=True)
+			temporary_path.write_text(
+				to_prometheus(snapshot) if self.path.suffix == ".prom" else dumps(snapshot, indent="\t"),
+				encoding="utf-8"
+			)
+			replace(temporary_path, self.path)
+		except OSError as error:
+			log.warning("Could not write metrics to %s: %s", self.path, error)
+		line = self.progress(snapshot)
+		log.info("Progress: %s", line)
+		if self.echo:
+			print(line, file=stderr)
+
+	def run(self) -> None:
+		while not self.stopped.wait(self.interval):
+			self.write()
+
+	def stop(self) -> None:
+		"""Stop writing, after one final write"""
+		self.stopped.set()
+		if self.is_alive():
+			self.join()
+		self.write()
\ No newline at end of file
@@ -0,0 +1,150 @@
+from collections import Counter
+from collections.abc import Iterator
+from contextlib import contextmanager
+from cProfile import Profile
+from logging import getLogger
+from os import getpid
+from pathlib import Path
+from pstats import Stats
+from sys import _current_frames
+from threading import Event, get_ident, Thread
+
+
+log = getLogger()
+
+MERGED_NAMES = ("merged.txt", "merged.prof", "merged.samples")
+
+
+class StackSampler(Thread):
+	"""Periodically samples the stack of every other thread in the process,
+	counting each distinct stack, which costs far less than tracing every call
+	on long runs
+	"""
+
+	def __init__(self, interval: float) -> None:
+		Thread.__init__(self, daemon=True)
+		self.interval = interval
+		self.samples: Counter[str] = Counter()
+		self.stopped = Event()
+
+	def run(self) -> None:
+		own_id = get_ident()
+		while not self.stopped.wait(self.interval):
+			for thread_id, frame in _current_frames().items():
+				if thread_id == own_id:
+					continue
+				stack = []
+				while frame is not None:
+					stack.append(f"{Path(frame.f_code.co_filename).name}:{frame.f_code.co_name}")
+					frame = frame.f_back
+				self.samples[";".join(reversed(stack))] += 1
+
+	def stop(self) -> None:
+		self.stopped.set()
+		self.join()
+
+
+class Profiler:
+	"""Profiles sections of each process separately, dumping a profile per
+	process which merge_profiles combines once every process has exited
+
+	A Profiler without a directory is disabled, and profiling with it does
+	nothing.
+	"""
+
+	def __init__(self, directory: Path | None = None, sampling_interval: float = 0.0) -> None:
+		"""
+		Parameters
+		----------
+		directory: The directory to dump profiles into
+		sampling_interval: Seconds between stack samples, or 0 not to sample
+		"""
+		self.directory = directory
+		self.sampling_interval = sampling_interval
+
+	@contextmanager
+	def profile(self, name: str) -> Iterator[None]:
+		"""Profile the calling thread, and sample the stacks of every other
+		thread in its process if sampling is on, until the context exits
+
+		Parameters
+		----------
+		name: The name of the profiled section, prefixed to the dump's file
+			name
+		"""
+		if not self.directory:
+			yield
+			return
+		sampler = None
+		if self.sampling_interval > 0:
+			sampler = StackSampler(self.sampling_interval)
+			sampler.start()
+		profile = Profile()
+		profile.enable()
+		try:
+			yield
+		finally:
+			profile.disable()
+			self.directory.mkdir(parents=True, exist_ok=True)
+			dump_path = self.directory.joinpath(f"{name}-{getpid()}")
+			profile.dump_stats(str(dump_path.with_suffix(".prof")))
+			if sampler:
+				sampler.stop()
+				write_samples(dump_path.with_suffix(".samples"), sampler.samples)
+			log.debug("(%s) Dumped %s profile to %s", getpid(), name, dump_path)
+
+	def clear(self) -> None:
+		"""Delete the dumps and merged report of any previous run, leaving
+		anything else in the directory alone"""
+		if self.directory and self.directory.exists():
+			for path in self.directory.iterdir():
+				if path.name in MERGED_NAMES or is_dump(path):
+					path.unlink()
+
+
+def is_dump(path: Path) -> bool:
+	"""Whether a file is named as a Profiler names the profile or samples it
+	dumps for a process, as {name}-{pid}.prof or {name}-{pid}.samples"""
+	_, separator, pid = path.stem.rpartition("-")
+	return path.suffix in (".prof", ".samples") and bool(separator) and pid.isdigit()
+
+
+def write_samples(path: Path, samples: Counter[str]) -> None:
+	"""Write stack samples in the collapsed format read by flame graph tools"""
+	with path.open("w", encoding="utf-8") as file:
+		for stack, count in samples.most_common():
+			file.write(f"{stack} {count}\n")
+
+
+def merge_profiles(directory: Path, limit: int = 50) -> Path | None:
+	"""Merge the profiles and stack samples dumped by every process into one
+	report
+
+	Parameters
+	----------
+	directory: The directory the profiles were dumped into
+	limit: The number of functions to list in the report
+
+	Returns
+	-------
+	Path to the report, or None if no profiles were dumped
+	"""
+	profile_paths = sorted(path for path in directory.glob("*-*.prof") if is_dump(path))
+	if not profile_paths:
+		return None
+	report_path = directory.joinpath("merged.txt")
+	with report_path.open("w", encoding="utf-8") as report:
+		report.write(f"Merged from {', '.join(path.name for path in profile_paths)}\n")
+		stats = Stats(*(str(path) for path in profile_paths), stream=report)
+		stats.dump_stats(str(directory.joinpath("merged.prof")))
+		stats.sort_stats("cumulative").print_stats(limit)
+		stats.sort_stats("tottime").print_stats(limit)
+	samples: Counter[str] = Counter()
+	for path in filter(is_dump, directory.glob("*-*.samples")):
+		with path.open("r", encoding="utf-8") as file:
+			for line in file:
+				stack, _, count = line.rpartition(" ")
+				samples[stack] += int(count)
+	if samples:
+		write_samples(directory.joinpath("merged.samples"), samples)
+	return report_path
\ No newline at end of file
@@ -0,0 +1,110 @@
+from csv import DictReader, DictWriter
+from json import dumps, loads
+from pathlib import Path
+from typing import Iterator, TextIO
+
+from clusters import DuplicateGroup
+from image_index import IndexEntry
+
+
+FIELDS = ("path", "identity_hash", "image_hash", "area")
+CSV_FIELDS = ["group", *FIELDS, "exact"]
+
+
+def entry_to_dict(entry: IndexEntry) -> dict[str, str | int]:
+	return {
+		"path": str(entry.path),
+		"identity_hash": f"{entry.identity_hash:016x}",
+		"image_hash": entry.image_hash,
+		"area": entry.area
+	}
+
+
+def entry_from_dict(data: dict) -> IndexEntry:
+	return IndexEntry(int(data["identity_hash"], 16), Path(data["path"]), data["image_hash"], int(data["area"]))
+
+
+def group_to_dict(group: DuplicateGroup) -> dict[str, list]:
+	return {"entries": [entry_to_dict(entry) for entry in group.entries], "exact": group.exact}
+
+
+def group_from_dict(data: dict) -> DuplicateGroup:
+	return DuplicateGroup([entry_from_dict(entry) for entry in data["entries"]], data["exact"])
+
+
+class ReportWriter:
+	"""Streams duplicate groups to a JSON Lines or CSV file as they are found
+
+	JSON Lines reports hold one group per line. CSV reports hold one image per
+	row, with consecutive rows of the same group number forming a group.
+	"""
+
+	def __init__(self, path: Path, report_format: str | None = None, append: bool = False) -> None:
+		"""
+		Parameters
+		----------
+		path: Path to the report file, overwritten if it exists
+		report_format: Either "jsonl" or "csv", inferred from the file
+			extension if not given
+		append: Whether to add to an existing report instead, such as when
+			resuming the scan it is of
+		"""
+		self.path = path
+		self.format = report_format or ("csv" if path.suffix.lower() == ".csv" else "jsonl")
+		write_header = not (append and path.exists())
+		self.file: TextIO = path.open("a" if append else "w", newline="", encoding="utf-8")
+		self.count = 0
+		if self.format == "csv":
+			self.csv_writer = DictWriter(self.file, CSV_FIELDS)
+			if write_header:
+				self.csv_writer.writeheader()
+
+	def write(self, group: DuplicateGroup) -> None:
+		"""Write a duplicate group to the report
+
+		Parameters
+		----------
+		group: The group, whose first entry is the image found first
+		"""
+		if self.format == "csv":
+			for entry, exact in zip(group.entries, ["", *group.exact]):
+				self.csv_writer.writerow({"group": self.count, **entry_to_dict(entry), "exact": exact})
+		else:
+			self.file.write(dumps(group_to_dict(group)) + "\n")
+		self.file.flush()
+		self.count += 1
+
+	def close(self) -> None:
+		self.file.close()
+
+
+def read_report(path: Path) -> Iterator[DuplicateGroup]:
+	"""Read the duplicate groups back out of a report written by ReportWriter
+
+	Parameters
+	----------
+	path: Path to the report file
+
+	Yields
+	------
+	Each duplicate group
+	"""
+	with path.open("r", newline="", encoding="utf-8") as file:
+		if path.suffix.lower() == ".csv":
+			group: DuplicateGroup | None = None
+			group_number = None
+			for row in DictReader(file):
+				entry = entry_from_dict(row)
+				if group is None or row["group"] != group_number:  # numbers restart when a resumed scan appends to a report
+					if group:
+						yield group
+					group, group_number = DuplicateGroup([entry], []), row["group"]
+				else:
+					group.entries.append(entry)
+					group.exact.append(row["exact"] == "True")
+			if group:
+				yield group
+			return
+		for line in file:
+			if line.strip():
+				yield group_from_dict(loads(line))
\ No newline at end of file
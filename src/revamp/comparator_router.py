@@ -1,17 +1,54 @@
-from typing import Callable
+from collections import OrderedDict
+from collections.abc import Collection, Iterable
+from functools import partial
+from importlib import import_module
+from logging import getLogger
+from os import stat_result
+from pathlib import Path
+from threading import RLock
+from typing import Any, Callable
 
-from pdd_defaultcomparators.base_classes import classproperty, IFileComparator
+from pdd_defaultcomparators.base_classes import ANY_FILE_TYPE, classproperty, File, IBulkFileComparator, IFileComparator, ISignatureComparator
+from pdd_defaultcomparators.file_types import DEFAULT_DETECTOR
+
+
+log = getLogger()
+
+CONSENSUS_POLICIES = ("any", "majority", "all")
+
+# A cascade stage: the filters a pair must pass, the comparators which vote
+# on it, and the votes needed for it to match
+CascadeStage = tuple[list[Callable], list[Callable], int]
 
 
 class ComparatorRouter:
-    __routing_map: dict[str, dict[str, list[Callable]]] = {}
+    SIGNATURE_CACHE_SIZE = 100_000
+
+    __consensus: str | int = "any"
+    __routing_map: dict[str, dict[str, list[IFileComparator]]] = {}
+    __bulk_comparators: list[IBulkFileComparator] = []
+    __signature_cache: OrderedDict[tuple[ISignatureComparator, Path], Any] = OrderedDict()
+    __lazy_modules: dict[str, set[str]] = {}  # file type to the modules of its unimported comparators
+    __lazy_bulk_modules: set[str] = set()
+    __lazy_comparators: dict[str, list[str]] = {}  # module to the names of its comparators
+    __import_lock = RLock()
 
     @classproperty
-    def routing_map(cls) -> dict[str, dict[str, list[Callable]]]:  # pylint: disable=no-self-argument
+    def routing_map(cls) -> dict[str, dict[str, list[IFileComparator]]]:  # pylint: disable=no-self-argument
+        for module_name in list(cls.__lazy_comparators):  # so the map is complete
+            cls.__import(module_name)
         return cls.__routing_map
 
+    @classproperty
+    def bulk_comparators(cls) -> list[IBulkFileComparator]:  # pylint: disable=no-self-argument
+        for module_name in list(cls.__lazy_bulk_modules):
+            cls.__import(module_name)
+        return cls.__bulk_comparators
+
     @classmethod
     def register_comparator(cls, comparator: IFileComparator) -> None:
+        if issubclass(comparator, IBulkFileComparator):
+            cls.__bulk_comparators.append(comparator)
         for file_type in comparator.file_types:
             if file_type not in cls.__routing_map:
                 cls.__routing_map[file_type] = {}
@@ -20,10 +57,243 @@ class ComparatorRouter:
                 #     continue
                 if file_type2 not in cls.__routing_map[file_type]:
                     cls.__routing_map[file_type][file_type2] = []
-                cls.__routing_map[file_type][file_type2].append(
-                    comparator.compare
-                )
+                cls.__routing_map[file_type][file_type2].append(comparator)
+                cls.__routing_map[file_type][file_type2].sort(key=lambda comparator: comparator.cost)
+
+    @classmethod
+    def register_lazy(
+        cls,
+        module_name: str,
+        comparator_name: str,
+        file_types: Iterable[str],
+        bulk: bool = False
+    ) -> None:
+        """Register a comparator without importing it, to be imported and
+        registered the first time a file of one of its types is routed
+
+        Parameters
+        ----------
+        module_name: The name of the module defining the comparator
+        comparator_name: The name of the comparator's class
+        file_types: The types of files the comparator can compare
+        bulk: Whether the comparator is also a bulk comparator
+        """
+        cls.__lazy_comparators.setdefault(module_name, []).append(comparator_name)
+        for file_type in file_types:
+            cls.__lazy_modules.setdefault(file_type, set()).add(module_name)
+        if bulk:
+            cls.__lazy_bulk_modules.add(module_name)
+
+    @classmethod
+    def __import(cls, module_name: str) -> None:
+        with cls.__import_lock:
+            comparator_names = cls.__lazy_comparators.pop(module_name, None)
+            if comparator_names is None:
+                return  # already imported
+            cls.__lazy_bulk_modules.discard(module_name)
+            try:
+                module = import_module(module_name)
+                comparators = [getattr(module, comparator_name) for comparator_name in comparator_names]
+            except Exception:  # such as a missing optional dependency; its comparators are skipped, not retried
+                log.warning("Failed to import comparators %s from %s", ", ".join(comparator_names), module_name, exc_info=True)
+                return
+            for comparator in comparators:
+                cls.register_comparator(comparator)
+
+    @classmethod
+    def __import_for(cls, file_type: str) -> None:
+        with cls.__import_lock:
+            for module_name in cls.__lazy_modules.pop(file_type, ()):
+                cls.__import(module_name)
+
+    @classproperty
+    def consensus(cls) -> str | int:  # pylint: disable=no-self-argument
+        return cls.__consensus
+
+    @classmethod
+    def set_consensus(cls, consensus: str | int) -> None:
+        """Set how many of the approximate comparators routed to a pair of
+        files must match them for the files to be considered a match
+
+        Parameters
+        ----------
+        consensus: One of CONSENSUS_POLICIES, or a number of comparators,
+            capped at the number routed to the pair
+        """
+        if consensus not in CONSENSUS_POLICIES and not (isinstance(consensus, int) and consensus > 0):
+            raise ValueError(f"Invalid consensus policy: {consensus!r}")
+        cls.__consensus = consensus
+
+    @classmethod
+    def required_votes(cls, voters: int) -> int:
+        if cls.__consensus == "any":
+            return min(1, voters)
+        if cls.__consensus == "all":
+            return voters
+        if cls.__consensus == "majority":
+            return voters // 2 + 1
+        return min(cls.__consensus, voters)
+
+    @classmethod
+    def signature(cls, comparator: ISignatureComparator, file: File) -> Any:
+        """Get the signature of a file, extracting it only on first request
+
+        Parameters
+        ----------
+        comparator: The comparator to extract the signature with
+        file: The file to get the signature of
+
+        Returns
+        -------
+        The signature of the file, or None if it could not be extracted
+        """
+        key = (comparator, file.path)
+        if key in cls.__signature_cache:
+            cls.__signature_cache.move_to_end(key)
+            return cls.__signature_cache[key]
+        try:
+            signature = comparator.extract_signature(file)
+        except Exception:
+            signature = None
+        cls.__signature_cache[key] = signature
+        if len(cls.__signature_cache) > cls.SIGNATURE_CACHE_SIZE:
+            cls.__signature_cache.popitem(last=False)
+        return signature
+
+    @classmethod
+    def __compare_signatures(
+        cls,
+        comparator: ISignatureComparator,
+        file1: File,
+        file2: File,
+        threshold: float = 0.0
+    ) -> bool:
+        signature1 = cls.signature(comparator, file1)
+        signature2 = cls.signature(comparator, file2)
+        if signature1 is None or signature2 is None:
+            return False
+        return comparator.compare_signatures(signature1, signature2, threshold)
+
+    @classmethod
+    def comparison(cls, comparator: IFileComparator) -> Callable:
+        """Get the function to compare two files with a comparator, which uses
+        cached signatures if the comparator supports them
+
+        Parameters
+        ----------
+        comparator: The comparator to compare with
+
+        Returns
+        -------
+        A function taking two files and a threshold, and returning whether
+        the files match
+        """
+        if issubclass(comparator, ISignatureComparator):
+            return partial(cls.__compare_signatures, comparator)
+        return comparator.compare
+
+    @staticmethod
+    def identify(path: Path, stat: stat_result | None = None) -> File:
+        """Get a File to route, typed by its contents rather than its name
+
+        Parameters
+        ----------
+        path: Path to the file
+        stat: The file's stat, if already known
+
+        Returns
+        -------
+        A File object containing the path to and detected type of the file
+        """
+        return File(path, DEFAULT_DETECTOR.detect(path, stat))
+
+    @classmethod
+    def route_comparators(cls, file_type1: str, file_type2: str) -> list[IFileComparator]:
+        """Get the comparators which can compare two types of file, cheapest
+        first
+        """
+        if cls.__lazy_modules:
+            for file_type in (file_type1, file_type2, ANY_FILE_TYPE):
+                cls.__import_for(file_type)
+        comparators = cls.__routing_map.get(file_type1, {}).get(file_type2, [])
+        wildcards = cls.__routing_map.get(ANY_FILE_TYPE, {}).get(ANY_FILE_TYPE, [])
+        if not wildcards or file_type1 == file_type2 == ANY_FILE_TYPE:
+            return comparators
+        return sorted(comparators + wildcards, key=lambda comparator: comparator.cost)
 
     @classmethod
     def route(cls, file_type1: str, file_type2: str) -> list[Callable]:
-        return cls.__routing_map.get(file_type1, {}).get(file_type2, [])
\ No newline at end of file
+        return [
+            cls.comparison(comparator)
+            for comparator in cls.route_comparators(file_type1, file_type2)
+        ]
+
+    @classmethod
+    def cascade(
+        cls,
+        file_type1: str,
+        file_type2: str,
+        exact: bool | None = None,
+        exclude: Collection[IFileComparator] = ()
+    ) -> Callable[[File, File, float], bool] | None:
+        """Get a function which compares two files with every comparator
+        routed to their types, cheapest first, stopping as soon as the
+        outcome is settled
+
+        A pair is first compared by the exact comparators, and matches if any
+        of them match it. Failing that, it is compared by the approximate
+        comparators, and matches once the consensus policy is met. Either way
+        it must first pass every filter of the same exactness, so costly
+        comparators only see pairs which survived the cheap ones.
+
+        Parameters
+        ----------
+        file_type1: The type of the first file to compare
+        file_type2: The type of the second file to compare
+        exact: Whether to only compare exactly (True) or approximately
+            (False), or both if None
+        exclude: Comparators not to compare with, such as those already
+            matched by an index
+
+        Returns
+        -------
+        A function taking two files and a threshold, and returning whether
+        the files match, or None if no comparator could match them
+        """
+        stages: list[CascadeStage] = []
+        for stage_exact in (True, False):
+            if exact is not None and exact != stage_exact:
+                continue
+            comparators = [
+                comparator
+                for comparator in cls.route_comparators(file_type1, file_type2)
+                if comparator.exact == stage_exact and comparator not in exclude
+            ]
+            voters = [cls.comparison(comparator) for comparator in comparators if not comparator.is_filter]
+            if not voters:
+                continue
+            filters = [cls.comparison(comparator) for comparator in comparators if comparator.is_filter]
+            stages.append((filters, voters, 1 if stage_exact else cls.required_votes(len(voters))))
+        if not stages:
+            return None
+        return partial(cls.__run_cascade, stages)
+
+    @staticmethod
+    def __run_cascade(
+        stages: list[CascadeStage],
+        file1: File,
+        file2: File,
+        threshold: float = 0.0
+    ) -> bool:
+        for filters, voters, required in stages:
+            if not all(compare(file1, file2, threshold) for compare in filters):
+                continue
+            votes = 0
+            for index, compare in enumerate(voters):
+                if compare(file1, file2, threshold):
+                    votes += 1
+                    if votes >= required:
+                        return True
+                elif votes + len(voters) - index - 1 < required:
+                    break
+        return False
\ No newline at end of file
@@ -1,33 +1,42 @@
+from collections.abc import Iterator
 from importlib import import_module
-from inspect import isclass
-from pkgutil import iter_modules, walk_packages
+from inspect import isabstract, isclass
+from json import dumps, loads
+from pathlib import Path
+from pkgutil import iter_modules, ModuleInfo
 from types import ModuleType
 
 from comparator_router import ComparatorRouter
-from pdd_defaultcomparators.base_classes import IFileComparator
+from pdd_defaultcomparators.base_classes import IBulkFileComparator, IFileComparator
 
 
-def __get_modules() -> list[ModuleType]:
-    plugin_modules = [
-        import_module(name)
-        for _, name, ispkg
-        in iter_modules()
-        if name.startswith('pdd_') and not ispkg
-    ]
-    packages = [
-        import_module(name)
-        for _, name, ispkg
-        in iter_modules()
-        if name.startswith('pdd_') and ispkg
-    ]
-    for package in packages:
-        plugin_modules.extend([
-            import_module(name)
-            for _, name, ispkg
-            in walk_packages(package.__path__, f'{package.__name__}.')
-            if not ispkg
-        ])
-    return plugin_modules
+MANIFEST_PATH = Path(__file__).with_name("plugin_manifest.json")
+
+
+def __walk(module_info: ModuleInfo, name: str) -> Iterator[tuple[str, str]]:
+    spec = module_info.module_finder.find_spec(name)  # type: ignore[call-arg]
+    if spec is None:
+        return
+    if module_info.ispkg:
+        for submodule_info in iter_modules(spec.submodule_search_locations or []):
+            yield from __walk(submodule_info, f"{name}.{submodule_info.name}")
+    elif spec.origin:
+        yield name, spec.origin
+
+
+def __find_modules() -> dict[str, str]:
+    """Find every plugin module, without importing any of them
+
+    Returns
+    -------
+    A dict of the name of each plugin module to the path of its source
+    """
+    modules: dict[str, str] = {}
+    for module_info in iter_modules():
+        if module_info.name.startswith('pdd_'):
+            for name, origin in __walk(module_info, module_info.name):
+                modules.setdefault(name, origin)  # earlier entries of sys.path shadow later ones
+    return modules
 
 
 def get_plugins(modules: list[ModuleType]) -> list[IFileComparator]:
@@ -35,13 +44,61 @@ def get_plugins(modules: list[ModuleType]) -> list[IFileComparator]:
     for module in modules:
         for _, cls in module.__dict__.items():
             if isclass(cls) and issubclass(cls, IFileComparator) \
-                and cls != IFileComparator:
+                and not isabstract(cls):
                 plugins.append(cls)
     return plugins
 
 
-def load_plugins() -> None:
-    modules = __get_modules()
-    plugins = get_plugins(modules)
-    for plugin in plugins:
-        ComparatorRouter.register_comparator(plugin)
\ No newline at end of file
+def describe_plugins(module: ModuleType) -> list[dict]:
+    """Describe the comparators defined in a module, for the manifest
+
+    Parameters
+    ----------
+    module: The plugin module
+
+    Returns
+    -------
+    The name, file types, and whether it is a bulk comparator, of each
+    comparator defined in (not merely imported into) the module
+    """
+    return [
+        {
+            "name": plugin.__name__,
+            "file_types": list(plugin.file_types),
+            "bulk": issubclass(plugin, IBulkFileComparator)
+        }
+        for plugin in get_plugins([module])
+        if plugin.__module__ == module.__name__
+    ]
+
+
+def load_plugins(manifest_path: Path = MANIFEST_PATH) -> None:
+    """Register every plugin's comparators with the router, to be imported
+    the first time a file of one of their types is routed
+
+    Which comparators a module defines, and which file types they compare, is
+    cached in a manifest, so a module is only imported here if it has changed
+    since the manifest was written.
+
+    Parameters
+    ----------
+    manifest_path: Path to the manifest
+    """
+    try:
+        manifest = loads(manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        manifest = {}
+    updated = {}
+    for name, origin in __find_modules().items():
+        mtime = Path(origin).stat().st_mtime
+        entry = manifest.get(name)
+        if entry is None or entry["origin"] != origin or entry["mtime"] != mtime:
+            entry = {"origin": origin, "mtime": mtime, "comparators": describe_plugins(import_module(name))}
+        updated[name] = entry
+        for comparator in entry["comparators"]:
+            ComparatorRouter.register_lazy(name, comparator["name"], comparator["file_types"], comparator["bulk"])
+    if updated != manifest:
+        try:
+            manifest_path.write_text(dumps(updated, indent=4), encoding="utf-8")
+        except OSError:
+            pass  # the manifest is only a cache; without it plugins are described again next time
\ No newline at end of file
@@ -1,2 +1,13 @@
-from . import base_classes
-from . import default_comparators
\ No newline at end of file
+from importlib import import_module
+from types import ModuleType
+
+
+# Submodules are imported on first access, so importing one does not load the
+# heavy dependencies of the others
+__all__ = ["base_classes", "default_comparators", "exact_comparators", "exact_matching", "file_types"]
+
+
+def __getattr__(name: str) -> ModuleType:
+    if name in __all__:
+        return import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-from collections.abc import Callable
+from collections.abc import Callable, Iterator, Sequence
 from multiprocessing import Lock
 from pathlib import Path
 from typing import Any, NamedTuple, Self
@@ -23,6 +23,8 @@ from typing import Any, NamedTuple, Self
 
 File = NamedTuple("File", [("path", Path), ("type", str)])
 
+ANY_FILE_TYPE = "*"  # file type of comparators which can compare files of every type
+
 
 class Singleton:
     """A process-safe metaclass for singleton objects"""
@@ -56,6 +58,14 @@ class IFileComparator(ABC):
     file_types: A tuple of strings representing the types of files this
     class can compare
 
+    Class Properties
+    ----------------
+    cost: The estimated relative cost of comparing two files, by which
+    comparators are ordered so the cheapest run first
+    exact: Whether files only match if their contents are identical
+    is_filter: Whether a match is necessary but not sufficient for the files
+    to be considered duplicates, so the comparator can only rule pairs out
+
     Abstract Methods
     ----------------
     compare: Compare two files and return whether they match
@@ -72,6 +82,18 @@ class IFileComparator(ABC):
         compare
         """
 
+    @classproperty
+    def cost(cls) -> float:  # pylint: disable=no-self-argument
+        return 100.0
+
+    @classproperty
+    def exact(cls) -> bool:  # pylint: disable=no-self-argument
+        return False
+
+    @classproperty
+    def is_filter(cls) -> bool:  # pylint: disable=no-self-argument
+        return False
+
     @staticmethod
     @abstractmethod
     def compare(
@@ -94,3 +116,101 @@ class IFileComparator(ABC):
         -------
         Whether the files match
         """
+
+
+class ISignatureComparator(IFileComparator):
+    """Interface for a file comparator which extracts a signature from each
+    file once, and then compares signatures rather than files
+
+    Class Properties
+    ----------------
+    hamming_signatures: Whether signatures are integer hashes matched by their
+    Hamming distance, and so may be indexed for fast lookup
+
+    Abstract Methods
+    ----------------
+    extract_signature: Extract the features of a file needed to compare it
+    compare_signatures: Compare the signatures of two files and return whether
+    they match
+    """
+
+    @classproperty
+    def hamming_signatures(cls) -> bool:  # pylint: disable=no-self-argument
+        return False
+
+    @classmethod
+    def compare(
+        cls,
+        file1: File,
+        file2: File,
+        threshold: float = 0.0
+    ) -> bool:
+        return cls.compare_signatures(
+            cls.extract_signature(file1),
+            cls.extract_signature(file2),
+            threshold
+        )
+
+    @staticmethod
+    @abstractmethod
+    def extract_signature(file: File) -> Any:
+        """Extract the features of a file needed to compare it
+
+        Parameters
+        ----------
+        file: A File object containing the path to and filetype of the file
+
+        Returns
+        -------
+        The signature of the file
+        """
+
+    @staticmethod
+    @abstractmethod
+    def compare_signatures(
+        signature1: Any,
+        signature2: Any,
+        threshold: float = 0.0
+    ) -> bool:
+        """Compare the signatures of two files and return whether they match
+
+        Parameters
+        ----------
+        signature1: The signature of the first file to compare
+        signature2: The signature of the second file to compare
+        threshold: The threshold to determine the files a match, if comparison
+            is approximate
+
+        Returns
+        -------
+        Whether the files match
+        """
+
+
+class IBulkFileComparator(IFileComparator):
+    """Interface for a file comparator which can also compare many files at
+    once, far faster than comparing every pair individually
+
+    Abstract Methods
+    ----------------
+    bulk_compare: Find every matching pair among many files
+    """
+
+    @staticmethod
+    @abstractmethod
+    def bulk_compare(
+        files: Sequence[File],
+        threshold: float = 0.0
+    ) -> Iterator[tuple[File, File]]:
+        """Find every matching pair among many files
+
+        Parameters
+        ----------
+        files: File objects of the types this class can compare
+        threshold: The threshold to determine the files a match, if comparison
+            is approximate
+
+        Yields
+        ------
+        Each matching pair of files
+        """
\ No newline at end of file
@@ -0,0 +1,80 @@
+from collections.abc import Iterable, Iterator
+
+import numpy as np
+from imagehash import ImageHash
+
+from .image_hashing import hash_to_int
+
+
+BLOCK_SIZE = 4096
+
+if hasattr(np, "bitwise_count"):
+    def popcount(array: np.ndarray) -> np.ndarray:
+        """Count the set bits of each element of a uint64 array"""
+        return np.bitwise_count(array)
+else:
+    __BYTE_COUNTS = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+    def popcount(array: np.ndarray) -> np.ndarray:
+        """Count the set bits of each element of a uint64 array"""
+        counts = __BYTE_COUNTS[array.view(np.uint8)]
+        return counts.reshape(*array.shape, 8).sum(axis=-1, dtype=np.uint8)
+
+
+def pack_hashes(hashes: Iterable[ImageHash | int]) -> np.ndarray:
+    """Pack 64-bit image hashes into a uint64 array
+
+    Parameters
+    ----------
+    hashes: The hashes to pack, as ImageHash objects or integers
+
+    Returns
+    -------
+    A one dimensional uint64 array of the hashes
+    """
+    return np.fromiter(
+        (
+            image_hash if isinstance(image_hash, int) else hash_to_int(image_hash)
+            for image_hash in hashes
+        ),
+        dtype=np.uint64
+    )
+
+
+def pairs_within(
+    hashes: np.ndarray,
+    threshold: int,
+    block_size: int = BLOCK_SIZE
+) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """Find every pair of hashes within a Hamming distance of each other
+
+    The pairwise distances are computed with XOR and popcount over square
+    blocks of the array, so memory stays bounded by the block size squared no
+    matter how many hashes there are.
+
+    Parameters
+    ----------
+    hashes: A one dimensional uint64 array of hashes
+    threshold: The greatest Hamming distance to consider a match
+    block_size: The number of hashes per side of each block
+
+    Yields
+    ------
+    Arrays of the first indices, second indices, and distances of the matching
+    pairs in each block, where the first index is always less than the second
+    """
+    for row_start in range(0, len(hashes), block_size):
+        rows = hashes[row_start:row_start + block_size, np.newaxis]
+        for column_start in range(row_start, len(hashes), block_size):
+            columns = hashes[np.newaxis, column_start:column_start + block_size]
+            distances = popcount(rows ^ columns)
+            mask = distances <= threshold
+            if row_start == column_start:
+                mask = np.triu(mask, 1)
+            row_indices, column_indices = np.nonzero(mask)
+            if len(row_indices):
+                yield (
+                    row_indices + row_start,
+                    column_indices + column_start,
+                    distances[row_indices, column_indices]
+                )
\ No newline at end of file
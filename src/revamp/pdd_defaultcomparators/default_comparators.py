@@ -1,43 +1,107 @@
-from imagehash import average_hash
-from PIL import Image
+from collections.abc import Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor
 
-from .base_classes import classproperty, File, IFileComparator
+from .base_classes import classproperty, File, IBulkFileComparator, ISignatureComparator
+from .batch_hamming import pack_hashes, pairs_within
+from .image_hashing import compute_hashes, hash_to_int, read_dimensions
+from .similarity_index import hamming_distance
 
 
-class ImageComparator(IFileComparator):
-    """A file comparator for image files"""
+IMAGE_FILE_TYPES = (
+    ".jpeg", ".jpg", ".png",
+    ".gif", ".tiff", ".raw",
+    ".bmp", ".webp", ".svg"
+)
+ASPECT_RATIO_TOLERANCE = 0.02  # resizing rounds each edge to a whole pixel
+
 
-    _file_types = (
-        ".jpeg", ".jpg", ".png",
-        ".gif", ".tiff", ".raw",
-        ".bmp", ".webp", ".svg"
-    )
+class ImageDimensionsFilter(ISignatureComparator):
+    """Rules out approximate matches between images of different aspect
+    ratios, reading only their headers"""
 
     @classproperty
     def file_types(cls) -> tuple[str, ...]:  # pylint: disable=no-self-argument
-        return cls._file_types
+        return IMAGE_FILE_TYPES
+
+    @classproperty
+    def cost(cls) -> float:  # pylint: disable=no-self-argument
+        return 20.0
+
+    @classproperty
+    def is_filter(cls) -> bool:  # pylint: disable=no-self-argument
+        return True
 
     @staticmethod
-    def compare(
-        file1: File,
-        file2: File,
+    def extract_signature(file: File) -> tuple[int, int]:
+        return read_dimensions(file.path)
+
+    @staticmethod
+    def compare_signatures(
+        signature1: tuple[int, int],
+        signature2: tuple[int, int],
         threshold: float = 0.0
     ) -> bool:
-        with Image.open(file1.path) as image1, Image.open(file2.path) as image2:
-            diff = average_hash(image1) - average_hash(image2)
-        return diff <= threshold
+        (width1, height1), (width2, height2) = signature1, signature2
+        if not (height1 and height2):
+            return width1 == width2 and height1 == height2
+        return abs(width1 / height1 - width2 / height2) <= ASPECT_RATIO_TOLERANCE * width1 / height1
+
+
+class ImageComparator(ISignatureComparator, IBulkFileComparator):
+    """A file comparator for image files"""
 
+    _file_types = IMAGE_FILE_TYPES
 
-def exact_compare(file1: File, file2: File) -> bool:
-    """Compare two files and return whether they match exactly
+    @classproperty
+    def file_types(cls) -> tuple[str, ...]:  # pylint: disable=no-self-argument
+        return cls._file_types
 
-    Parameters
-    ----------
-    file1: The first file to compare
-    file2: The second file to compare
+    @classproperty
+    def cost(cls) -> float:  # pylint: disable=no-self-argument
+        return 200.0
+
+    @classproperty
+    def hamming_signatures(cls) -> bool:  # pylint: disable=no-self-argument
+        return True
+
+    @staticmethod
+    def extract_signature(file: File) -> int:
+        """Compute the 64-bit average hash of an image file
+
+        Parameters
+        ----------
+        file: A File object containing the path to and filetype of the image
+
+        Returns
+        -------
+        The average hash of the image as an integer
+        """
+        hashes, _ = compute_hashes(file.path)
+        return hash_to_int(hashes["average"])
+
+    @staticmethod
+    def compare_signatures(
+        signature1: int,
+        signature2: int,
+        threshold: float = 0.0
+    ) -> bool:
+        return hamming_distance(signature1, signature2) <= threshold
+
+    @staticmethod
+    def bulk_compare(
+        files: Sequence[File],
+        threshold: float = 0.0
+    ) -> Iterator[tuple[File, File]]:
+        def try_hash(file: File) -> int | None:
+            try:
+                return ImageComparator.extract_signature(file)
+            except Exception:
+                return None
 
-    Returns
-    -------
-    Whether the files match exactly
-    """
-    return file1.path.read_bytes() == file2.path.read_bytes()
\ No newline at end of file
+        with ThreadPoolExecutor() as pool:
+            hashes = list(pool.map(try_hash, files))
+        hashed = [file for file, image_hash in zip(files, hashes) if image_hash is not None]
+        packed = pack_hashes(image_hash for image_hash in hashes if image_hash is not None)
+        for first, second, _ in pairs_within(packed, int(threshold)):
+            for index1, index2 in zip(first.tolist(), second.tolist()):
+                yield hashed[index1], hashed[index2]
\ No newline at end of file
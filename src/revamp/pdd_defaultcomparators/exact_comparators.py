@@ -0,0 +1,86 @@
+from typing import Any
+
+from .base_classes import ANY_FILE_TYPE, classproperty, File, ISignatureComparator
+from .exact_matching import full_digest, partial_digest
+
+
+class EqualSignatureComparator(ISignatureComparator):
+    """A file comparator whose files match only if their signatures are
+    equal"""
+
+    @staticmethod
+    def compare_signatures(
+        signature1: Any,
+        signature2: Any,
+        threshold: float = 0.0
+    ) -> bool:
+        return signature1 == signature2
+
+
+class FileSizeFilter(EqualSignatureComparator):
+    """Rules out exact matches between files of different sizes"""
+
+    @classproperty
+    def file_types(cls) -> tuple[str, ...]:  # pylint: disable=no-self-argument
+        return (ANY_FILE_TYPE,)
+
+    @classproperty
+    def cost(cls) -> float:  # pylint: disable=no-self-argument
+        return 1.0
+
+    @classproperty
+    def exact(cls) -> bool:  # pylint: disable=no-self-argument
+        return True
+
+    @classproperty
+    def is_filter(cls) -> bool:  # pylint: disable=no-self-argument
+        return True
+
+    @staticmethod
+    def extract_signature(file: File) -> int:
+        return file.path.stat().st_size
+
+
+class HeaderBytesFilter(EqualSignatureComparator):
+    """Rules out exact matches between files whose first or last few
+    kilobytes differ"""
+
+    @classproperty
+    def file_types(cls) -> tuple[str, ...]:  # pylint: disable=no-self-argument
+        return (ANY_FILE_TYPE,)
+
+    @classproperty
+    def cost(cls) -> float:  # pylint: disable=no-self-argument
+        return 10.0
+
+    @classproperty
+    def exact(cls) -> bool:  # pylint: disable=no-self-argument
+        return True
+
+    @classproperty
+    def is_filter(cls) -> bool:  # pylint: disable=no-self-argument
+        return True
+
+    @staticmethod
+    def extract_signature(file: File) -> str:
+        return partial_digest(file.path)
+
+
+class ContentComparator(EqualSignatureComparator):
+    """A file comparator which matches files with identical contents"""
+
+    @classproperty
+    def file_types(cls) -> tuple[str, ...]:  # pylint: disable=no-self-argument
+        return (ANY_FILE_TYPE,)
+
+    @classproperty
+    def cost(cls) -> float:  # pylint: disable=no-self-argument
+        return 1000.0
+
+    @classproperty
+    def exact(cls) -> bool:  # pylint: disable=no-self-argument
+        return True
+
+    @staticmethod
+    def extract_signature(file: File) -> str:
+        return full_digest(file.path)
\ No newline at end of file
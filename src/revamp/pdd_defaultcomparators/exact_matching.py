@@ -0,0 +1,65 @@
+from collections.abc import Callable
+from pathlib import Path
+
+from . import hashing
+
+
+PARTIAL_HASH_SIZE = 4096
+
+
+def partial_digest(path: Path, size: int | None = None) -> str:
+    """Hash only the first and last PARTIAL_HASH_SIZE bytes of a file
+
+    Parameters
+    ----------
+    path: Path to the file to hash
+    size: The size of the file in bytes, if already known
+
+    Returns
+    -------
+    The hex digest of the head and tail of the file
+    """
+    return hashing.DEFAULT_ENGINE.partial_digest(path, PARTIAL_HASH_SIZE, size)
+
+
+def full_digest(path: Path) -> str:
+    """Hash the entire contents of a file
+
+    Parameters
+    ----------
+    path: Path to the file to hash
+
+    Returns
+    -------
+    The hex digest of the file
+    """
+    return hashing.DEFAULT_ENGINE.digest(path)
+
+
+def is_exact_match(
+    path1: Path,
+    path2: Path,
+    digest: Callable[[Path], str] = full_digest
+) -> bool:
+    """Check whether two files have identical contents, reading as little as
+    possible
+
+    Parameters
+    ----------
+    path1: Path to the first file
+    path2: Path to the second file
+    digest: The function used to hash the files in full, should their sizes,
+        heads, and tails all match
+
+    Returns
+    -------
+    Whether the files match exactly
+    """
+    size = path1.stat().st_size
+    if size != path2.stat().st_size:
+        return False
+    if partial_digest(path1, size) != partial_digest(path2, size):
+        return False
+    if size <= 2 * PARTIAL_HASH_SIZE:
+        return True
+    return digest(path1) == digest(path2)
\ No newline at end of file
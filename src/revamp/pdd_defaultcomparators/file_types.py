@@ -0,0 +1,138 @@
+from collections import OrderedDict
+from mimetypes import guess_extension
+from os import stat_result
+from pathlib import Path
+from threading import Lock
+
+try:
+    from magic import from_buffer  # type: ignore[import-untyped]
+except ImportError:  # libmagic is optional; only files with no known signature need it
+    from_buffer = None
+
+
+HEADER_SIZE = 2048  # enough for every signature below, and for libmagic to identify most other files
+
+# Each file type's signature, as the bytes expected at each offset of the
+# file's header; checked in order, so more specific signatures come first
+SIGNATURES: tuple[tuple[tuple[tuple[int, bytes], ...], str], ...] = (
+    (((0, b"\xff\xd8\xff"),), ".jpg"),
+    (((0, b"\x89PNG\r\n\x1a\n"),), ".png"),
+    (((0, b"GIF87a"),), ".gif"),
+    (((0, b"GIF89a"),), ".gif"),
+    (((0, b"RIFF"), (8, b"WEBP")), ".webp"),
+    (((0, b"RIFF"), (8, b"WAVE")), ".wav"),
+    (((0, b"RIFF"), (8, b"AVI ")), ".avi"),
+    (((0, b"II*\x00"),), ".tiff"),
+    (((0, b"MM\x00*"),), ".tiff"),
+    (((0, b"BM"),), ".bmp"),
+    (((4, b"ftypheic"),), ".heic"),
+    (((4, b"ftypmif1"),), ".heic"),
+    (((4, b"ftypavif"),), ".avif"),
+    (((4, b"ftypqt"),), ".mov"),
+    (((4, b"ftyp"),), ".mp4"),
+    (((0, b"%PDF-"),), ".pdf"),
+    (((0, b"PK\x03\x04"),), ".zip"),
+    (((0, b"PK\x05\x06"),), ".zip"),
+    (((0, b"\x1f\x8b"),), ".gz"),
+    (((0, b"7z\xbc\xaf\x27\x1c"),), ".7z"),
+    (((0, b"Rar!\x1a\x07"),), ".rar"),
+    (((0, b"ID3"),), ".mp3"),
+    (((0, b"fLaC"),), ".flac"),
+    (((0, b"OggS"),), ".ogg"),
+    (((0, b"\x1aE\xdf\xa3"),), ".mkv")
+)
+UNKNOWN_MIME_TYPE = "application/octet-stream"
+MIME_TYPES = {  # where guess_extension's answer differs from the suffixes comparators use
+    "image/jpeg": ".jpg",
+    "image/tiff": ".tiff",
+    "image/svg+xml": ".svg",
+    "text/plain": ".txt"
+}
+
+
+def sniff(header: bytes) -> str | None:
+    """Identify the type of a file from its header, by its signature
+
+    Parameters
+    ----------
+    header: The first bytes of the file
+
+    Returns
+    -------
+    The type of the file as a lower case suffix, such as ".jpg", or None if
+    its signature is unknown
+    """
+    for signature, file_type in SIGNATURES:
+        if all(header.startswith(magic, offset) for offset, magic in signature):
+            return file_type
+    return None
+
+
+class FileTypeDetector:
+    """Identifies the types of files by their contents rather than their
+    names
+
+    A file's header is read once and matched against SIGNATURES, falling back
+    to libmagic (if installed) for unknown signatures, and to the file's
+    suffix if neither identifies it. Types are cached by inode and
+    modification time, so a file is only read again once it has changed.
+    """
+
+    def __init__(self, cache_size: int = 100_000, use_libmagic: bool = True) -> None:
+        """
+        Parameters
+        ----------
+        cache_size: The most file types to cache
+        use_libmagic: Whether to identify unknown signatures with libmagic
+        """
+        self.cache_size = cache_size
+        self.use_libmagic = use_libmagic and from_buffer is not None
+        self.__cache: OrderedDict[tuple[int, int, int], str] = OrderedDict()
+        self.__lock = Lock()
+
+    def __identify(self, path: Path) -> str:
+        try:
+            with path.open("rb") as file:
+                header = file.read(HEADER_SIZE)
+        except OSError:
+            return path.suffix.lower()
+        file_type = sniff(header)
+        if file_type is None and self.use_libmagic and header:
+            try:
+                mime_type = from_buffer(header, mime=True)
+            except Exception:
+                mime_type = UNKNOWN_MIME_TYPE
+            if mime_type != UNKNOWN_MIME_TYPE:
+                file_type = MIME_TYPES.get(mime_type) or guess_extension(mime_type, strict=False)
+        return file_type or path.suffix.lower()
+
+    def detect(self, path: Path, stat: stat_result | None = None) -> str:
+        """Identify the type of a file
+
+        Parameters
+        ----------
+        path: Path to the file
+        stat: The file's stat, if already known
+
+        Returns
+        -------
+        The type of the file as a lower case suffix, such as ".jpg"
+        """
+        try:
+            stat = stat or path.stat()
+        except OSError:
+            return path.suffix.lower()
+        key = (stat.st_dev, stat.st_ino, stat.st_mtime_ns)
+        with self.__lock:
+            if key in self.__cache:
+                self.__cache.move_to_end(key)
+                return self.__cache[key]
+        file_type = self.__identify(path)
+        with self.__lock:
+            self.__cache[key] = file_type
+            if len(self.__cache) > self.cache_size:
+                self.__cache.popitem(last=False)
+        return file_type
+
+
+DEFAULT_DETECTOR = FileTypeDetector()
\ No newline at end of file
@@ -0,0 +1,170 @@
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import blake2b, sha256
+from mmap import ACCESS_READ, mmap
+from os import cpu_count
+from pathlib import Path
+from typing import Any
+
+try:
+    from xxhash import xxh3_128  # type: ignore[import-not-found]
+except ImportError:
+    xxh3_128 = None
+
+
+ALGORITHMS: dict[str, Callable[[], Any]] = {
+    "sha256": sha256,
+    "blake2b": blake2b
+}
+# Fast hashes which need an optional package, and fall back to blake2b
+# without it
+OPTIONAL_ALGORITHMS = ("xxh3_128",)
+if xxh3_128 is not None:
+    ALGORITHMS["xxh3_128"] = xxh3_128
+
+
+class HashEngine:
+    """A streaming file hasher with a configurable algorithm
+
+    Files are read in fixed size chunks (or mapped into memory), so the memory
+    used per file is bounded by two chunks no matter how large the file is.
+    The next chunk is read on a background thread while the current one is
+    hashed; both release the GIL, so disk reads and hashing overlap.
+    """
+
+    def __init__(
+        self,
+        algorithm: str = "sha256",
+        chunk_size: int = 1 << 20,
+        use_mmap: bool = False,
+        io_threads: int = 0
+    ) -> None:
+        """
+        Parameters
+        ----------
+        algorithm: The name of the hash algorithm to use, one of ALGORITHMS;
+            unavailable fast hashes, in OPTIONAL_ALGORITHMS, fall back to
+            blake2b
+        chunk_size: The number of bytes to read and hash at a time
+        use_mmap: Whether to map files into memory rather than read them
+        io_threads: The number of threads used to hash files concurrently,
+            defaulting to the number of CPUs
+        """
+        if algorithm not in ALGORITHMS:
+            if algorithm not in OPTIONAL_ALGORITHMS:
+                raise ValueError(
+                    f"Unknown hash algorithm {algorithm!r}, expected one of "
+                    f"{', '.join(dict.fromkeys([*ALGORITHMS, *OPTIONAL_ALGORITHMS]))}"
+                )
+            algorithm = "blake2b"
+        self.algorithm = algorithm
+        self.chunk_size = chunk_size
+        self.use_mmap = use_mmap
+        self.io_threads = io_threads or cpu_count() or 1
+        self.__file_pool: ThreadPoolExecutor | None = None
+        self.__read_pool: ThreadPoolExecutor | None = None
+
+    def __getstate__(self) -> dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_HashEngine__file_pool"] = None  # a copy starts threads of its own
+        state["_HashEngine__read_pool"] = None
+        return state
+
+    @property
+    def file_pool(self) -> ThreadPoolExecutor:
+        if self.__file_pool is None:
+            self.__file_pool = ThreadPoolExecutor(self.io_threads)
+        return self.__file_pool
+
+    @property
+    def read_pool(self) -> ThreadPoolExecutor:
+        if self.__read_pool is None:
+            self.__read_pool = ThreadPoolExecutor(self.io_threads)
+        return self.__read_pool
+
+    def __hash_stream(self, path: Path, hasher: Any) -> None:
+        buffers = (bytearray(self.chunk_size), bytearray(self.chunk_size))
+        index = 0
+        with path.open("rb", buffering=0) as file:
+            pending = self.read_pool.submit(file.readinto, buffers[index])
+            while True:
+                count = pending.result()
+                if not count:
+                    break
+                current = memoryview(buffers[index])[:count]
+                index ^= 1
+                pending = self.read_pool.submit(file.readinto, buffers[index])
+                hasher.update(current)
+
+    def __hash_mapped(self, path: Path, hasher: Any) -> None:
+        with path.open("rb") as file:
+            if not path.stat().st_size:
+                return
+            with mmap(file.fileno(), 0, access=ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                for offset in range(0, len(mapped), self.chunk_size):
+                    hasher.update(view[offset:offset + self.chunk_size])
+                view.release()
+
+    def digest(self, path: Path) -> str:
+        """Hash the entire contents of a file
+
+        Parameters
+        ----------
+        path: Path to the file to hash
+
+        Returns
+        -------
+        The hex digest of the file
+        """
+        hasher = ALGORITHMS[self.algorithm]()
+        if self.use_mmap:
+            self.__hash_mapped(path, hasher)
+        else:
+            self.__hash_stream(path, hasher)
+        return hasher.hexdigest()
+
+    def partial_digest(self, path: Path, length: int, size: int | None = None) -> str:
+        """Hash only the first and last bytes of a file
+
+        Parameters
+        ----------
+        path: Path to the file to hash
+        length: The number of bytes to hash from each end of the file
+        size: The size of the file in bytes, if already known
+
+        Returns
+        -------
+        The hex digest of the head and tail of the file
+        """
+        if size is None:
+            size = path.stat().st_size
+        hasher = ALGORITHMS[self.algorithm]()
+        with path.open("rb") as file:
+            hasher.update(file.read(length))
+            if size > length:
+                file.seek(max(length, size - length))
+                hasher.update(file.read(length))
+        return hasher.hexdigest()
+
+    def close(self) -> None:
+        for pool in (self.__file_pool, self.__read_pool):
+            if pool is not None:
+                pool.shutdown()
+        self.__file_pool = None
+        self.__read_pool = None
+
+
+DEFAULT_ENGINE = HashEngine()
+
+
+def set_default_engine(engine: HashEngine) -> None:
+    """Replace the engine the module level digest functions and comparators
+    hash files with, such as with one built from the application's configs
+
+    Parameters
+    ----------
+    engine: The engine to hash files with from now on
+    """
+    global DEFAULT_ENGINE  # pylint: disable=global-statement
+    DEFAULT_ENGINE = engine
\ No newline at end of file
@@ -0,0 +1,109 @@
+from collections.abc import Callable, Iterable
+from pathlib import Path
+from typing import BinaryIO
+
+from imagehash import average_hash, dhash, ImageHash, phash
+from PIL import Image
+
+
+HASH_FUNCTIONS: dict[str, Callable[[Image.Image], ImageHash]] = {
+    "average": average_hash,
+    "difference": dhash,
+    "perceptual": phash
+}
+REDUCIBLE_MODES = ("L", "LA", "RGB", "RGBA", "CMYK", "YCbCr", "I", "F")
+DECODE_SIZE = 64  # smallest edge to decode to; covers the 32x32 DCT input of phash with room to spare
+
+
+def reduce_image(
+    image: Image.Image,
+    size: int = DECODE_SIZE,
+    draft_mode: str = "L"
+) -> Image.Image:
+    """Decode an image at the smallest resolution which is still no smaller
+    than a given size
+
+    JPEGs are decoded directly at a reduced scale (and in grayscale, by
+    default), which skips most of the decoding work. Other formats must be decoded in full, but are
+    then reduced by an integer factor before any further processing.
+
+    Parameters
+    ----------
+    image: A freshly opened, not yet loaded, image
+    size: The smallest either edge of the decoded image may be
+    draft_mode: The mode to decode JPEGs in
+
+    Returns
+    -------
+    The decoded, reduced image
+    """
+    if image.format == "JPEG":
+        image.draft(draft_mode, (size, size))
+    image.load()
+    if image.mode not in REDUCIBLE_MODES:
+        image = image.convert("RGBA")
+    factor = min(image.width, image.height) // size
+    if factor > 1:
+        return image.reduce(factor)
+    return image
+
+
+def decode_reduced(path: Path | BinaryIO, size: int = DECODE_SIZE) -> tuple[Image.Image, tuple[int, int]]:
+    """Decode an image in grayscale, at the smallest resolution its hashes can
+    be computed from
+
+    Parameters
+    ----------
+    path: Path to the image, or a file object of its contents
+    size: The smallest either edge of the decoded image may be
+
+    Returns
+    -------
+    The decoded, reduced image, and the full size of the image
+    """
+    with Image.open(path) as image:
+        full_size = image.size
+        return reduce_image(image, size).convert("L"), full_size
+
+
+def read_dimensions(path: Path) -> tuple[int, int]:
+    """Read the size of an image from its header, without decoding it
+
+    Parameters
+    ----------
+    path: Path to the image
+
+    Returns
+    -------
+    The width and height of the image
+    """
+    with Image.open(path) as image:
+        return image.size
+
+
+def compute_hashes(
+    path: Path,
+    algorithms: Iterable[str] = ("average",),
+    size: int = DECODE_SIZE
+) -> tuple[dict[str, ImageHash], tuple[int, int]]:
+    """Compute several perceptual hashes of an image from a single, reduced
+    decode
+
+    Parameters
+    ----------
+    path: Path to the image
+    algorithms: The names of the hashes to compute, from HASH_FUNCTIONS
+    size: The smallest either edge of the decoded image may be
+
+    Returns
+    -------
+    A dict of each algorithm's name to the image's hash, and the full size of
+    the image
+    """
+    grayscale, full_size = decode_reduced(path, size)
+    return {name: HASH_FUNCTIONS[name](grayscale) for name in algorithms}, full_size
+
+
+def hash_to_int(image_hash: ImageHash) -> int:
+    """Pack a 64-bit image hash into an integer"""
+    return int(str(image_hash), 16)
\ No newline at end of file
@@ -0,0 +1,87 @@
+from array import array
+from collections.abc import Iterator
+from os.path import join, split
+from pathlib import Path
+
+
+class PathTable:
+    """Interns directories, so a path can be stored as a small integer
+    directory id and its name rather than as a Path object
+
+    Every file in a directory shares the one copy of the directory's path, so
+    millions of paths cost little more than their names.
+    """
+
+    def __init__(self) -> None:
+        self.directories: list[str] = []
+        self.directory_ids: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.directories)
+
+    def intern(self, path: Path | str) -> tuple[int, str]:
+        """Split a path into its directory's id, interning the directory if it
+        is new, and its name
+
+        Parameters
+        ----------
+        path: The path to intern
+
+        Returns
+        -------
+        The id of the path's directory, and the path's name
+        """
+        directory, name = split(str(path))
+        directory_id = self.directory_ids.get(directory)
+        if directory_id is None:
+            directory_id = self.directory_ids[directory] = len(self.directories)
+            self.directories.append(directory)
+        return directory_id, name
+
+    def find(self, path: Path | str) -> tuple[int, str] | None:
+        """Split a path like intern, but without interning its directory
+
+        Returns
+        -------
+        The id of the path's directory and the path's name, or None if its
+        directory was never interned
+        """
+        directory, name = split(str(path))
+        directory_id = self.directory_ids.get(directory)
+        return None if directory_id is None else (directory_id, name)
+
+    def beneath(self, directory: Path | str) -> list[int]:
+        """Get the ids of a directory and of every interned directory beneath
+        it
+        """
+        directory = str(directory)
+        prefix = join(directory, "")
+        return [
+            directory_id
+            for directory_id, interned in enumerate(self.directories)
+            if interned == directory or interned.startswith(prefix)
+        ]
+
+    def path(self, directory_id: int, name: str) -> Path:
+        return Path(self.directories[directory_id], name)
+
+
+class PathList:
+    """A compact, append-only list of paths, sharing a PathTable"""
+
+    def __init__(self, table: PathTable) -> None:
+        self.table = table
+        self.directory_ids = array("I")
+        self.names: list[str] = []
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __iter__(self) -> Iterator[Path]:
+        for directory_id, name in zip(self.directory_ids, self.names):
+            yield self.table.path(directory_id, name)
+
+    def append(self, path: Path | str) -> None:
+        directory_id, name = self.table.intern(path)
+        self.directory_ids.append(directory_id)
+        self.names.append(name)
\ No newline at end of file
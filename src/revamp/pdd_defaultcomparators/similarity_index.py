@@ -0,0 +1,130 @@
+from collections.abc import Iterator
+from itertools import combinations
+from typing import Any
+
+
+def hamming_distance(hash1: int, hash2: int) -> int:
+    """Count the bits which differ between two integer hashes"""
+    return (hash1 ^ hash2).bit_count()
+
+
+def split_bands(bits: int, bands: int) -> list[tuple[int, int]]:
+    """Split the bits of a hash into contiguous bands of near equal width
+
+    Returns
+    -------
+    The shift and width of each band
+    """
+    width, extra = divmod(bits, bands)
+    splits = []
+    shift = 0
+    for band in range(bands):
+        band_width = width + (band < extra)
+        splits.append((shift, band_width))
+        shift += band_width
+    return splits
+
+
+def neighbours(value: int, width: int, radius: int) -> Iterator[int]:
+    """Yield every value of a band within a Hamming distance of the given one"""
+    for flips in range(radius + 1):
+        for positions in combinations(range(width), flips):
+            yield value ^ sum(1 << position for position in positions)
+
+
+class MultiIndexHash:
+    """A multi-index hash table of integer hashes under the Hamming distance
+
+    Every hash is split into bands, and each band is indexed in a table of its
+    own. If two hashes differ in at most k bits across b bands, some band
+    differs in at most k // b of them; so with more bands than the greatest
+    distance searched for, a search only looks up the query's own band values
+    and checks the few hashes which share one, rather than every hash indexed.
+    Any number of items may share a hash, and emptied buckets are dropped.
+    """
+
+    def __init__(self, max_distance: int = 4, bits: int = 64) -> None:
+        """
+        Parameters
+        ----------
+        max_distance: The distance searches are tuned for, such that they only
+            look up exact band values; greater distances are still found, by
+            also looking up the band values near the query's
+        bits: The number of bits in a hash
+        """
+        self.bands = split_bands(bits, min(max_distance + 1, bits))
+        self.tables: list[dict[int, list[tuple[int, Any]]]] = [{} for _ in self.bands]
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[tuple[int, Any]]:
+        for bucket in self.tables[0].values():  # every pair is in every table
+            yield from bucket
+
+    def __keys(self, hash_value: int) -> Iterator[tuple[dict[int, list[tuple[int, Any]]], int]]:
+        for table, (shift, width) in zip(self.tables, self.bands):
+            yield table, (hash_value >> shift) & ((1 << width) - 1)
+
+    def insert(self, hash_value: int, item: Any) -> None:
+        """Add an item to the index
+
+        Parameters
+        ----------
+        hash_value: The hash to index the item by
+        item: The item to store
+        """
+        pair = (hash_value, item)  # shared by every table
+        for table, key in self.__keys(hash_value):
+            table.setdefault(key, []).append(pair)
+        self.count += 1
+
+    def remove(self, hash_value: int, item: Any) -> bool:
+        """Remove an item from the index
+
+        Parameters
+        ----------
+        hash_value: The hash the item was indexed by
+        item: The item to remove
+
+        Returns
+        -------
+        Whether the item was found and removed
+        """
+        pair = (hash_value, item)
+        for table, key in self.__keys(hash_value):
+            bucket = table.get(key)
+            if bucket is None or pair not in bucket:
+                return False
+            bucket.remove(pair)
+            if not bucket:
+                del table[key]
+        self.count -= 1
+        return True
+
+    def search(self, hash_value: int, max_distance: int) -> list[tuple[int, int, Any]]:
+        """Find every item whose hash is within a distance of the given hash
+
+        Parameters
+        ----------
+        hash_value: The hash to search around
+        max_distance: The greatest Hamming distance to consider a match
+
+        Returns
+        -------
+        A list of (distance, hash, item) tuples, closest first
+        """
+        radius = max_distance // len(self.bands)
+        candidates: dict[int, tuple[int, Any]] = {}
+        for (table, key), (_, width) in zip(self.__keys(hash_value), self.bands):
+            for neighbour in neighbours(key, width, radius):
+                for pair in table.get(neighbour, ()):
+                    candidates[id(pair)] = pair
+        matches = []
+        for candidate_hash, item in candidates.values():
+            distance = hamming_distance(hash_value, candidate_hash)
+            if distance <= max_distance:
+                matches.append((distance, candidate_hash, item))
+        matches.sort(key=lambda match: match[0])
+        return matches
\ No newline at end of file
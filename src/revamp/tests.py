@@ -1,16 +1,20 @@
+from json import load
 from pathlib import Path
 from threading import Thread, Event
 from time import time
 from typing import Generator, Any
 
-from magic import from_buffer, from_file, MagicException  # type: ignore[import-untyped]
-
 from comparator_router import ComparatorRouter  # type: ignore[import-not-found]
-from pdd_defaultcomparators.default_comparators import exact_compare  # type: ignore[import-not-found]
-from pdd_defaultcomparators.base_classes import File  # type: ignore[import-not-found]
+from pdd_defaultcomparators.similarity_index import MultiIndexHash  # type: ignore[import-not-found]
+from pdd_defaultcomparators.hashing import HashEngine, set_default_engine  # type: ignore[import-not-found]
+from pdd_defaultcomparators.base_classes import File, IFileComparator, ISignatureComparator  # type: ignore[import-not-found]
+from pdd_defaultcomparators.path_table import PathList, PathTable  # type: ignore[import-not-found]
 from load_plugins import load_plugins  # type: ignore[import-not-found]
 
 
+CONSENSUS = "any"
+
+
 def walk(root: Path) -> Generator[Path, Any, None]:
     try:
         for path in root.iterdir():
@@ -24,48 +28,77 @@ def walk(root: Path) -> Generator[Path, Any, None]:
         pass
 
 
-def run(kill: Event, files: dict[str, list[Path]]) -> None:
+def run(kill: Event, files: dict[str, PathList], paths: PathTable) -> None:
+    sizes: dict[int, PathList] = {}
+    indexes: dict[IFileComparator, MultiIndexHash] = {}
     root = Path(r"C:\Users\caiparker\source\repos\duplicate_file_cleaner\tests")
     for file in walk(root):
         if kill.is_set():
             break
-        file_type = file.suffix
-        # try:
-        #     file_type = from_file(str(file), mime=True)
-        # except MagicException:
-        #     try:
-        #         file_type = from_buffer(file.open().read(4096), mime=True)
-        #     except Exception:
-        #         continue
-        # except PermissionError:
-        #     continue
-        # if file_type not in files:
-        #     files[file_type] = []
-        # files[file_type].append(file)
         fp = file
-        file = File(file, file_type)
-        for file2 in files.get(file_type, []):
-            if exact_compare(file, File(file2, file_type)):
-                print("exact:", file, "==", file2)
+        try:
+            stat = fp.stat()
+        except OSError:
+            continue
+        file = ComparatorRouter.identify(fp, stat)
+        file_type = file.type
+        for path2 in sizes.get(stat.st_size, []):
+            file2 = ComparatorRouter.identify(path2)  # its type is cached
+            compare = ComparatorRouter.cascade(file_type, file2.type, exact=True)
+            if compare and compare(file, file2):
+                print("exact:", fp, "==", path2)
+        if stat.st_size not in sizes:
+            sizes[stat.st_size] = PathList(paths)
+        sizes[stat.st_size].append(fp)
+        for comparator in ComparatorRouter.route_comparators(file_type, file_type):
+            if not issubclass(comparator, ISignatureComparator) or not comparator.hamming_signatures:
+                continue
+            signature = ComparatorRouter.signature(comparator, file)
+            if signature is None:
+                continue
+            if comparator not in indexes:
+                indexes[comparator] = MultiIndexHash(5)
+            for _, _, reference in indexes[comparator].search(signature, 5):
+                print("approx:", fp, "==", paths.path(*reference))
+            indexes[comparator].insert(signature, paths.intern(fp))
         for file_type2 in files:
-            for comparator in ComparatorRouter.route(file_type, file_type2):
-                for file2 in files[file_type2]:
-                    if comparator(file, File(file2, file_type2), 5.0):
-                        print("approx:", fp, "==", file2)
+            compare = ComparatorRouter.cascade(file_type, file_type2, exact=False, exclude=indexes)
+            if compare is None:
+                continue
+            for file2 in files[file_type2]:
+                if compare(file, File(file2, file_type2), 5.0):
+                    print("approx:", fp, "==", file2)
         if file_type not in files:
-            files[file_type] = []
+            files[file_type] = PathList(paths)
         files[file_type].append(fp)
     print("!!!DONE!!!")
 
 
+def bulk_report(files: dict[str, PathList], threshold: float) -> None:
+    for comparator in ComparatorRouter.bulk_comparators:
+        candidates = [
+            File(path, file_type)
+            for file_type, paths in files.items()
+            if file_type in comparator.file_types
+            for path in paths
+        ]
+        for file1, file2 in comparator.bulk_compare(candidates, threshold):
+            print("bulk:", file1.path, "==", file2.path)
+
+
+with Path(__file__).parents[2].joinpath("resources", "config.json").open("r") as config_file:
+    set_default_engine(HashEngine(**load(config_file).get("hashing", {})))
 load_plugins()
-files_dict: dict[str, list[Path]] = {}
+ComparatorRouter.set_consensus(CONSENSUS)
+path_table = PathTable()
+files_dict: dict[str, PathList] = {}
 event = Event()
-t = Thread(target=run, args=(event, files_dict))
+t = Thread(target=run, args=(event, files_dict, path_table))
 t0 = time()
 t.start()
 input("Press enter to stop")
 event.set()
 t.join()
 print((time() - t0)/60, "minutes")
-print("\n".join([f"{k}: {len(v)}" for k, v in files_dict.items()]))
+bulk_report(files_dict, 5.0)
+print("\n".join([f"{k}: {len(v)}" for k, v in files_dict.items()]))
\ No newline at end of file
@@ -0,0 +1,181 @@
+from logging import getLogger
+from multiprocessing import Event as MultiprocessingEvent, Queue
+from multiprocessing.sharedctypes import RawValue
+from os import cpu_count
+from threading import Event, Thread
+from time import monotonic
+
+from metrics import Metrics
+
+
+log = getLogger()
+
+
+def pool_limits(configs: dict) -> tuple[int, int, int]:
+	"""Work out how many worker processes to spawn and start with
+
+	Parameters
+	----------
+	configs: The scheduler section of config.json
+
+	Returns
+	-------
+	The fewest and most workers which may be active, and how many to start
+	with
+	"""
+	cpus = cpu_count() or 1
+	minimum = max(1, configs.get("min_workers", 1))
+	maximum = max(minimum, configs.get("max_workers", 0) or cpus)
+	return minimum, maximum, min(maximum, max(minimum, cpus - 2))  # leave a core each for the scanner and the index service
+
+
+class WorkerThrottle:
+	"""Shared by the scanner, the workers and the scheduler to decide how
+	many workers take work, and how many directories and files they list and
+	read at once
+
+	Every worker process is spawned at the start, since forking once other
+	threads are running risks the children inheriting held locks, and those
+	beyond the active count wait idle until they are needed. Likewise, the
+	thread pools are created at their largest, and only as many of their
+	threads as allowed are given work.
+	"""
+
+	def __init__(self, active: int, listing_threads: int = 1, read_ahead: int = 0) -> None:
+		self.active = RawValue("i", active)  # only the scheduler writes these
+		self.listing_threads = RawValue("i", listing_threads)
+		self.read_ahead = RawValue("i", read_ahead)
+		self.input_exhausted = MultiprocessingEvent()
+
+	def may_work(self, index: int) -> bool:
+		"""Whether the worker with the given index may take its next batch;
+		once the input is exhausted every worker may, so each receives its end
+		of input signal
+		"""
+		return index < self.active.value or self.input_exhausted.is_set()
+
+	def exhaust(self) -> None:
+		self.input_exhausted.set()
+
+
+class Stage:
+	"""The adaptive concurrency of one stage of a scan"""
+
+	def __init__(self, name: str, value: "RawValue", minimum: int, maximum: int) -> None:
+		"""
+		Parameters
+		----------
+		name: The name of the stage's concurrency, for logging
+		value: Where the stage's current concurrency is shared with the
+			processes running it
+		minimum: The least concurrency to allow
+		maximum: The most concurrency to allow
+		"""
+		self.name = name
+		self.value = value
+		self.minimum = minimum
+		self.maximum = maximum
+		self.hold = 0
+
+	def may_change(self, change: int) -> bool:
+		return not self.hold and self.minimum <= self.value.value + change <= self.maximum
+
+
+class Scheduler(Thread):
+	"""Adapts the concurrency of each stage of a scan to the depth of the file
+	queue and the measured hashing throughput
+
+	While batches are queueing up, a worker is added, or if no more may be,
+	each worker reads further ahead, or else the scanner lists fewer
+	directories at once. While the workers are starved, the scanner lists
+	more directories at once, or if it has finished, a worker is removed, or
+	else the workers read less far ahead. One change is made at a time, and
+	one which does not pay off, such as more workers contending for one
+	spinning disk, is reverted, and that stage is left alone for a while.
+	"""
+
+	TOLERANCE = 0.05  # the least relative change in throughput taken to be real
+	HOLD_INTERVALS = 5
+
+	def __init__(
+		self,
+		throttle: WorkerThrottle,
+		file_queue: Queue,
+		metrics: Metrics,
+		minimum: int,
+		maximum: int,
+		interval: float = 2.0,
+		listing_threads: int = 1,
+		read_threads: int = 0
+	) -> None:
+		"""
+		Parameters
+		----------
+		throttle: The throttle the scanner and workers consult
+		file_queue: The queue of batches of files the workers consume
+		metrics: Where the workers record the files they hash
+		minimum: The fewest workers to keep active
+		maximum: The most workers to make active, at most the number spawned
+		interval: Seconds between adjustments
+		listing_threads: The most directories the scanner may list at once,
+			the size of its thread pool
+		read_threads: The size of each worker's read thread pool, which may
+			read up to twice as many files ahead
+		"""
+		Thread.__init__(self, daemon=True)
+		self.throttle = throttle
+		self.file_queue = file_queue
+		self.metrics = metrics
+		self.interval = interval
+		self.workers = Stage("workers", throttle.active, minimum, maximum)
+		self.listing = Stage("listing threads", throttle.listing_threads, 1, max(1, listing_threads))
+		self.reads = Stage("read ahead", throttle.read_ahead, 0, 2 * read_threads)
+		self.stopped = Event()
+		self.last_change: tuple[Stage, int] | None = None
+		self.rate_before_change = 0.0
+
+	def queue_depth(self) -> int:
+		try:
+			return self.file_queue.qsize()
+		except NotImplementedError:  # not available on macOS
+			return 0 if self.file_queue.empty() else self.throttle.active.value + 1
+
+	def adjust(self, rate: float, depth: int, listing_complete: bool) -> None:
+		if self.last_change:
+			stage, change = self.last_change
+			gain = rate / self.rate_before_change - 1
+			if change > 0 and gain < self.TOLERANCE or change < 0 and gain < -self.TOLERANCE:
+				stage.value.value -= change
+				stage.hold = self.HOLD_INTERVALS
+			self.last_change = None
+			return
+		for stage in (self.workers, self.listing, self.reads):
+			if stage.hold:
+				stage.hold -= 1
+		if not rate:  # nothing to judge a change against yet, such as while the workers warm up
+			return
+		if depth > self.workers.value.value:
+			candidates = ((self.workers, 1), (self.reads, 1), (self.listing, -1))
+		elif depth == 0:
+			candidates = ((self.listing, 1), (self.workers, -1), (self.reads, -1)) if not listing_complete else ((self.workers, -1), (self.reads, -1))
+		else:
+			return
+		for stage, change in candidates:
+			if stage.may_change(change):
+				stage.value.value += change
+				self.last_change = (stage, change)
+				self.rate_before_change = rate
+				log.debug("Scheduler: %s %s, at %.1f files/s with %s batches queued", stage.value.value, stage.name, rate, depth)
+				return
+
+	def run(self) -> None:
+		last_time, last_hashed = monotonic(), 0.0
+		while not (self.stopped.wait(self.interval) or self.throttle.input_exhausted.is_set()):
+			now, snapshot = monotonic(), self.metrics.snapshot()
+			self.adjust((snapshot["files_hashed"] - last_hashed) / (now - last_time), self.queue_depth(), bool(snapshot["listing_complete"]))
+			last_time, last_hashed = now, snapshot["files_hashed"]
+
+	def stop(self) -> None:
+		self.stopped.set()
+		if self.is_alive():
+			self.join()
\ No newline at end of file
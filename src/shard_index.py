@@ -0,0 +1,169 @@
+from collections.abc import Iterator
+from hashlib import blake2b
+from json import dumps, loads
+from logging import getLogger
+from os.path import pardir, relpath, sep
+from pathlib import Path
+from socket import gethostname
+from typing import TextIO
+
+from clusters import DuplicateClusters, DuplicateGroup
+from image_index import IndexEntry, SimilarityIndex
+from report import entry_from_dict, entry_to_dict
+
+
+log = getLogger()
+
+INDEX_FORMAT = "duplicate_cleaner_index"
+INDEX_VERSION = 1
+
+
+def parse_shard(shard: str) -> tuple[int, int]:
+	"""Parse a shard given as "I/N", the Ith of N shards counting from 1
+
+	Returns
+	-------
+	The shard's index, counting from 0, and the number of shards
+	"""
+	index, _, count = shard.partition("/")
+	try:
+		index, count = int(index), int(count)
+	except ValueError:
+		raise ValueError(f"Shard must be given as I/N, not {shard!r}") from None
+	if not 1 <= index <= count:
+		raise ValueError(f"Shard {index} is not one of 1 to {count}")
+	return index - 1, count
+
+
+def shard_of(relative_path: str, count: int) -> int:
+	"""Assign a file to one of a number of shards, by a hash of its path
+	relative to the root it was found under, so every host assigns a file the
+	same shard wherever it has the archive mounted
+	"""
+	digest = blake2b(relative_path.encode("utf-8", "surrogateescape"), digest_size=8).digest()
+	return int.from_bytes(digest, "big") % count
+
+
+def relative_to_root(path: str, root_directories: list[str]) -> str:
+	"""Get a path relative to whichever of the root directories it is beneath"""
+	for root_directory in root_directories:
+		relative = relpath(path, root_directory)
+		if not (relative == pardir or relative.startswith(pardir + sep)):
+			return relative
+	return path
+
+
+class ShardIndexWriter:
+	"""Streams every image a scan indexes to a portable index file, which
+	--merge combines with the indexes of other scans into global duplicate
+	groups, without reading any of the images again
+
+	The file is JSON Lines: a header describing the scan, then one line per
+	image with its path, size, content hash and perceptual hash.
+	"""
+
+	def __init__(
+		self,
+		path: Path,
+		root_directories: list[Path],
+		shard: tuple[int, int] | None,
+		hash_algorithm: str,
+		identity_algorithm: str,
+		append: bool = False
+	) -> None:
+		"""
+		Parameters
+		----------
+		path: Path to the index file, overwritten if it exists
+		root_directories: The directories the scan walks
+		shard: The shard of the files beneath them which the scan takes, as
+			its index from 0 and the number of shards, if any
+		hash_algorithm: The algorithm content hashes are computed with
+		identity_algorithm: The algorithm perceptual hashes are computed with
+		append: Whether to add to an existing index instead, such as when
+			resuming the scan it is of
+		"""
+		self.path = path
+		write_header = not (append and path.exists())
+		self.file: TextIO = path.open("a" if append else "w", encoding="utf-8")
+		self.count = 0
+		if write_header:
+			self.file.write(dumps({
+				"format": INDEX_FORMAT,
+				"version": INDEX_VERSION,
+				"host": gethostname(),
+				"root_directories": [str(root_directory) for root_directory in root_directories],
+				"shard": f"{shard[0] + 1}/{shard[1]}" if shard else None,
+				"hash_algorithm": hash_algorithm,
+				"identity_algorithm": identity_algorithm
+			}) + "\n")
+
+	def write(self, entry: IndexEntry, size: int) -> None:
+		self.file.write(dumps({**entry_to_dict(entry), "size": size}) + "\n")
+		self.count += 1
+
+	def close(self) -> None:
+		self.file.close()
+
+
+def read_shard_index(path: Path) -> tuple[dict, Iterator[tuple[IndexEntry, int]]]:
+	"""Read an index written by ShardIndexWriter
+
+	Returns
+	-------
+	The index's header, and an iterator over each image's entry and size
+	"""
+	file = path.open("r", encoding="utf-8")
+	header = loads(file.readline() or "{}")
+	if header.get("format") != INDEX_FORMAT or header.get("version") != INDEX_VERSION:
+		file.close()
+		raise ValueError(f"{path} is not a version {INDEX_VERSION} index")
+
+	def entries() -> Iterator[tuple[IndexEntry, int]]:
+		with file:
+			for line in file:
+				if line.strip():
+					data = loads(line)
+					yield entry_from_dict(data), int(data["size"])
+	return header, entries()
+
+
+def merge_shard_indexes(paths: list[Path], image_index: SimilarityIndex) -> Iterator[DuplicateGroup]:
+	"""Combine the indexes of any number of scans into global duplicate
+	groups
+
+	Every entry is matched against the entries of all the indexes read before
+	it, exactly as a single scan would match them, and entries are exact
+	duplicates if their content hashes are equal.
+
+	Parameters
+	----------
+	paths: Paths to the indexes
+	image_index: An empty index to match the entries in
+
+	Yields
+	------
+	Each duplicate group
+	"""
+	indexes = [read_shard_index(path) for path in paths]
+	headers = [header for header, _ in indexes]
+	for key in ("hash_algorithm", "identity_algorithm"):
+		if len({header[key] for header in headers}) > 1:
+			raise ValueError(f"Cannot merge indexes computed with different {key.replace('_', ' ')}s")
+	shards = [header["shard"] for header in headers if header["shard"]]
+	if shards:
+		count = int(shards[0].partition("/")[2])
+		missing = {f"{index}/{count}" for index in range(1, count + 1)} - set(shards)
+		if missing:
+			log.warning("Merging without shards %s", ", ".join(sorted(missing)))
+	clusters = DuplicateClusters()
+	merged = 0
+	for path, (header, entries) in zip(paths, indexes):
+		log.info("Merging %s, from %s on %s", path, header["shard"] or "an unsharded scan", header["host"])
+		for entry, _ in entries:
+			mapped = image_index.match_or_insert(entry)
+			if mapped is not None:
+				clusters.add(mapped, entry, bool(entry.image_hash) and mapped.image_hash == entry.image_hash)
+			merged += 1
+	log.info("Merged %s entries from %s indexes", merged, len(paths))
+	yield from clusters.take_stable(flush=True)
\ No newline at end of file
@@ -0,0 +1,205 @@
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from logging import getLogger
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from threading import Lock
+from typing import NamedTuple
+
+from PIL import Image as PILImage
+
+from clusters import DuplicateGroup
+from revamp.pdd_defaultcomparators.image_hashing import reduce_image
+
+
+log = getLogger()
+
+
+THUMBNAIL_SIZE = (500, 500)
+
+
+class Thumbnail(NamedTuple):
+	image: PILImage.Image | None  # None if it is held in shared memory
+	width: int
+	height: int
+	shared_name: str | None = None  # the shared memory a worker rendered it into, if any
+
+
+class Previews(NamedTuple):
+	"""Thumbnails rendered into shared memory by a worker, sent to the index
+	service through the record queue
+	"""
+	thumbnails: list[tuple[Path, Thumbnail | None]]  # None for any which could not be rendered
+
+
+class PreparedGroup(NamedTuple):
+	group: DuplicateGroup
+	thumbnails: list[Thumbnail]  # of each of the group's entries
+
+
+def make_thumbnail(path: Path) -> Thumbnail:
+	"""Decode an image at display size, decoding as little of it as possible
+
+	Parameters
+	----------
+	path: Path to the image
+
+	Returns
+	-------
+	The display-size image, and the full size of the original
+	"""
+	with PILImage.open(path) as image:
+		width, height = image.size
+		reduced = reduce_image(image, max(THUMBNAIL_SIZE), "RGB").convert("RGB")
+		return Thumbnail(reduced.resize(THUMBNAIL_SIZE, PILImage.ADAPTIVE), width, height)
+
+
+def share_thumbnail(thumbnail: Thumbnail) -> tuple[Thumbnail, SharedMemory]:
+	"""Copy a thumbnail into a new block of shared memory
+
+	The block outlives the caller's handle to it, until the process which
+	adopts the returned thumbnail unlinks it.
+
+	Returns
+	-------
+	A handle to the shared thumbnail, small enough to send between processes,
+	and the caller's handle to the block, to close once it is sent
+	"""
+	data = thumbnail.image.tobytes()
+	shared = SharedMemory(create=True, size=len(data))
+	shared.buf[:len(data)] = data
+	return Thumbnail(None, thumbnail.width, thumbnail.height, shared.name), shared
+
+
+def release_shared(shared: SharedMemory) -> None:
+	shared.close()
+	try:
+		shared.unlink()
+	except FileNotFoundError:
+		pass
+
+
+class ThumbnailCache:
+	"""A thread-safe, bounded LRU cache of display-size thumbnails, so an
+	image shared by several duplicate groups is only decoded once
+
+	Thumbnails rendered by workers into shared memory are adopted into a
+	separate LRU, with its own budget, since they are rendered as soon as an
+	image is matched and may wait a long time to be reviewed. Shared
+	thumbnails are reserved before they are requested, so no more are
+	requested than the budget allows. The cache owns the blocks of shared
+	memory it adopts, and unlinks each when it is discarded or evicted.
+	"""
+
+	def __init__(self, max_size: int = 64, max_shared: int = 0) -> None:
+		"""
+		Parameters
+		----------
+		max_size: The most thumbnails decoded locally to keep
+		max_shared: The most thumbnails to hold in shared memory, or 0 to not
+			have workers render any
+		"""
+		self.max_size = max_size
+		self.max_shared = max_shared
+		self.thumbnails: OrderedDict[Path, Thumbnail] = OrderedDict()
+		self.shared: OrderedDict[Path, tuple[Thumbnail, SharedMemory]] = OrderedDict()
+		self.reserved: set[Path] = set()
+		self.lock = Lock()
+
+	def reserve(self, paths: list[Path]) -> list[Path]:
+		"""Reserve room for shared thumbnails of the given images, for any
+		not already cached or reserved, while there is room in the budget
+
+		Returns
+		-------
+		The paths reserved, whose thumbnails should be requested from workers
+		"""
+		reserved = []
+		with self.lock:
+			for path in paths:
+				if len(self.shared) + len(self.reserved) >= self.max_shared:
+					break
+				if path in self.shared or path in self.reserved or path in self.thumbnails:
+					continue
+				self.reserved.add(path)
+				reserved.append(path)
+		return reserved
+
+	def cancel_reservations(self) -> None:
+		"""Free the room reserved for thumbnails which will no longer arrive"""
+		with self.lock:
+			self.reserved.clear()
+
+	def adopt(self, path: Path, thumbnail: Thumbnail | None) -> None:
+		"""Take ownership of a thumbnail rendered into shared memory, or only
+		free its reservation if it could not be rendered
+		"""
+		try:
+			shared = SharedMemory(thumbnail.shared_name) if thumbnail else None
+		except FileNotFoundError:
+			log.debug("Shared thumbnail of %s is gone", path)
+			shared = None
+		if not shared:
+			with self.lock:
+				self.reserved.discard(path)
+			return
+		with self.lock:
+			self.reserved.discard(path)
+			if path in self.shared:
+				release_shared(self.shared.pop(path)[1])
+			self.shared[path] = (thumbnail, shared)
+			evicted = self.shared.popitem(last=False) if len(self.shared) > self.max_shared else None
+		if evicted:
+			release_shared(evicted[1][1])
+
+	@contextmanager
+	def open(self, path: Path, thumbnail: Thumbnail) -> Iterator[PILImage.Image]:
+		"""Open a thumbnail's image, mapping it straight from shared memory
+		rather than copying it if it is held there, in which case the image is
+		only valid, and the cache locked, until the context exits
+		"""
+		if thumbnail.image is not None:
+			yield thumbnail.image
+			return
+		with self.lock:
+			shared = self.shared.get(path)
+			if shared and shared[0] is thumbnail:
+				self.shared.move_to_end(path)
+				image = PILImage.frombuffer("RGB", THUMBNAIL_SIZE, shared[1].buf, "raw", "RGB", 0, 1)
+				try:
+					yield image
+				finally:
+					image.close()  # releases its hold on the block, so the block can be closed
+				return
+		yield make_thumbnail(path).image  # evicted since it was taken
+
+	def get(self, path: Path) -> Thumbnail:
+		with self.lock:
+			if path in self.shared:
+				self.shared.move_to_end(path)
+				return self.shared[path][0]
+			if path in self.thumbnails:
+				self.thumbnails.move_to_end(path)
+				return self.thumbnails[path]
+		thumbnail = make_thumbnail(path)
+		with self.lock:
+			self.thumbnails[path] = thumbnail
+			if len(self.thumbnails) > self.max_size:
+				self.thumbnails.popitem(last=False)
+		return thumbnail
+
+	def discard(self, path: Path) -> None:
+		with self.lock:
+			self.thumbnails.pop(path, None)
+			shared = self.shared.pop(path, None)
+		if shared:
+			release_shared(shared[1])
+
+	def close(self) -> None:
+		"""Unlink every block of shared memory still held"""
+		with self.lock:
+			shared, self.shared = self.shared, OrderedDict()
+			self.reserved.clear()
+		for _, block in shared.values():
+			release_shared(block)
\ No newline at end of file
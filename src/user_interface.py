@@ -1,16 +1,18 @@
-from enum import Enum
 from logging import getLogger
-from multiprocessing import Queue
-from multiprocessing.managers import DictProxy
+from math import ceil, sqrt
 from multiprocessing.synchronize import Event as MultiprocessingEventType
 from pathlib import Path
 from PIL import Image as PILImage, ImageTk
-from queue import Empty
+from queue import Empty, Full, Queue
 from threading import Thread
-from time import sleep
+from time import perf_counter
 from tkinter import *  # type: ignore
 from tkinter import filedialog, messagebox
 
+from clusters import DuplicateGroup
+from image_index import SimilarityIndex
+from metrics import MetricsRecorder
+from thumbnails import PreparedGroup, THUMBNAIL_SIZE, Thumbnail, ThumbnailCache
 from utils import BASE_DIRECTORY
 
 
@@ -18,161 +20,222 @@ log = getLogger()
 
 
 class UserInterface:
-	class KeepSelection(Enum):
-		NEITHER = -1
-		BOTH = 0
-		LEFT = 1
-		RIGHT = 2
+	"""Shows each group of duplicates at once, for the user to choose which of
+	its images to keep
+
+	The largest image of a group starts out kept and the rest deleted, so a
+	group whose best copy is also its largest takes a single click.
+	"""
+
+	GRID_SIZE = 1000  # the most pixels a group's thumbnails span in either direction
 
 	def __init__(
 		self,
-		duplicate_queue: "Queue[tuple[str, Path, Path, str]]",
-		image_map: "DictProxy[str, tuple[Path, str]]",
+		duplicate_queue: "Queue[DuplicateGroup]",
+		image_index: SimilarityIndex,
 		discovery_complete_flag: MultiprocessingEventType,
-		kill_flag: MultiprocessingEventType
+		kill_flag: MultiprocessingEventType,
+		metrics: MetricsRecorder,
+		prefetch_count: int = 8,
+		thumbnails: ThumbnailCache | None = None
 	) -> None:
 		self.blank_image = PILImage.open(BASE_DIRECTORY.joinpath("resources/blank.jpg"))
 		self.duplicate_queue = duplicate_queue
-		self.image_map = image_map
+		self.image_index = image_index
 		self.discovery_complete_flag = discovery_complete_flag
 		self.kill_flag = kill_flag
-		self.target: tuple[str, Path, Path, str] = ("", Path(), Path(), "")
+		self.metrics = metrics
+		self.prepared_queue: Queue[PreparedGroup | None] = Queue(maxsize=prefetch_count)
+		self.thumbnails = thumbnails or ThumbnailCache()
+		self.target: DuplicateGroup | None = None
+		self.keep: list[bool] = []
+		self.shown_thumbnails: list[Thumbnail] = []
+		self.shown_at = 0.0
 		self.closed = False
 
-	def build(self) -> Path:
+	def build(self, select_directory: bool = True) -> Path:
 		self.window = Tk()
 		self.window.title('Duplicate Image Handler')
 		self.window.resizable(width=False, height=False)
 		self.window.protocol("WM_DELETE_WINDOW", self.on_closing)
 
-		header = Label(self.window, text="Click image to KEEP")
+		header = Label(self.window, text="Click images to toggle KEEP or DELETE, then apply")
+		self.basic_img = ImageTk.PhotoImage(self.blank_image.resize(THUMBNAIL_SIZE, PILImage.ADAPTIVE))
+		self.group_frame = Frame(self.window)
+		self.image_buttons: list[Button] = []
+		self.image_labels: list[Label] = []
+		self.images: list[ImageTk.PhotoImage] = []
+		Label(self.group_frame, image=self.basic_img).grid(row=0, column=0)
+		apply_button = Button(self.window, command=self.apply_callback, text="APPLY")
+		keep_button = Button(self.window, command=self.keep_all_callback, text="KEEP ALL")
+
+		header.grid(row=0, column=0, columnspan=2)
+		self.group_frame.grid(row=1, column=0, columnspan=2)
+		apply_button.grid(row=2, column=0, sticky="E")
+		keep_button.grid(row=2, column=1, sticky="W")
+
+		if not select_directory:
+			return Path()
+		log.debug("Waiting for user to select base directory...")
+		return Path(filedialog.askdirectory())
 
-		self.basic_img = ImageTk.PhotoImage(self.blank_image.resize((500, 500), PILImage.ADAPTIVE))
-		self.l_button = Button(
-			self.window,
-			command=lambda: self.button_callback(self.KeepSelection.LEFT),
-			height=500,
-			width=500,
-			image=self.basic_img
-		)
-		self.l_label = Label(self.window, text="\n")
-		self.r_button = Button(
-			self.window,
-			command=lambda: self.button_callback(self.KeepSelection.RIGHT),
-			height=500,
-			width=500,
-			image=self.basic_img
-		)
-		self.r_label = Label(self.window, text="\n")
-		keep_button = Button(
-			self.window,
-			command=lambda: self.button_callback(self.KeepSelection.BOTH),
-			text="KEEP\nBOTH"
-		)
-		delete_button = Button(
-			self.window,
-			command=lambda: self.button_callback(self.KeepSelection.NEITHER),
-			text="DELETE\nBOTH"
+	def update_label(self, index: int) -> None:
+		entry, thumbnail = self.target.entries[index], self.shown_thumbnails[index]
+		exact = " (exact)" if index and self.target.exact[index - 1] else ""
+		self.image_labels[index].configure(
+			text=f"{entry.path.name}\n{thumbnail.height}x{thumbnail.width}{exact}\n{'KEEP' if self.keep[index] else 'DELETE'}",
+			fg="black" if self.keep[index] else "red"
 		)
 
-		header.grid(row=0, column=0, columnspan=11)
-		self.l_button.grid(row=1, column=0, columnspan=5, sticky="NW")
-		self.l_label.grid(row=2, column=0, columnspan=5, sticky="N")
-		self.r_button.grid(row=1, column=6, columnspan=5, sticky="NE")
-		self.r_label.grid(row=2, column=6, columnspan=5, sticky="N")
-		keep_button.grid(row=1, column=5, sticky="N")
-		delete_button.grid(row=2, column=5, sticky="S")
+	def toggle_callback(self, index: int) -> None:
+		if not self.target:
+			return
+		self.keep[index] = not self.keep[index]
+		self.update_label(index)
 
-		log.debug("Waiting for user to select base directory...")
-		return Path(filedialog.askdirectory())
+	def keep_all_callback(self) -> None:
+		if not self.target:
+			return
+		self.keep = [True] * len(self.keep)
+		self.apply_callback()
 
-	def button_callback(self, selection: KeepSelection) -> None:
-		identity_hash, left_image, right_image, right_hash = self.target
-		if not identity_hash:
+	def apply_callback(self) -> None:
+		if not self.target:
 			return
-		if selection == self.KeepSelection.NEITHER:
-			if not messagebox.askyesno("Delete", "Are you sure you want to delete both images?"):
-				return
-			log.info("Removing %s and %s", left_image, right_image)
-			left_image.unlink()
-			right_image.unlink()
-			del self.image_map[identity_hash]
-		elif selection == self.KeepSelection.LEFT:
-			log.info("Removing %s", right_image)
-			right_image.unlink()
-		elif selection == self.KeepSelection.RIGHT:
-			log.info("Removing %s", left_image)
-			left_image.unlink()
-			self.image_map[identity_hash] = (right_image, right_hash)
-		self.l_button.configure(image=self.basic_img)
-		self.l_label.configure(text="")
-		self.r_button.configure(image=self.basic_img)
-		self.r_label.configure(text="")
-		self.target = ("", Path(), Path(), "")
-
-	def monitor_duplicates(self) -> None:
+		if not any(self.keep) and not messagebox.askyesno("Delete", "Are you sure you want to delete every image in this group?"):
+			return
+		original = self.target.entries[0]
+		for entry, keep in zip(self.target.entries, self.keep):
+			if not keep:
+				log.info("Removing %s", entry.path)
+				entry.path.unlink(missing_ok=True)
+			self.thumbnails.discard(entry.path)  # an image is rarely in a later group, so make room for those which are
+		if not self.keep[0]:
+			kept = [entry for entry, keep in zip(self.target.entries, self.keep) if keep]
+			if kept:
+				self.image_index.replace(original, kept[0])  # so later duplicates are matched against an image which still exists
+			else:
+				self.image_index.remove(original)
+		self.metrics.observe("ui_decision", perf_counter() - self.shown_at)
+		self.clear_grid()
+		self.target = None
+		self.show_next()
+
+	def clear_grid(self) -> None:
+		for widget in self.group_frame.winfo_children():
+			widget.destroy()
+		self.image_buttons = []
+		self.image_labels = []
+		self.images = []
+		self.shown_thumbnails = []
+
+	def prefetch_duplicates(self) -> None:
 		while not (
 			self.duplicate_queue.empty() and self.discovery_complete_flag.is_set()
 		) and not self.kill_flag.is_set():
 			try:
-				package = self.duplicate_queue.get(True, 1)
-				while self.target[0] and not self.kill_flag.is_set():
-					sleep(0.2)
-				self.stage_duplicates(*package)
+				group = self.duplicate_queue.get(True, 1)
 			except Empty:
 				continue
-		while not self.kill_flag.is_set() and self.target[0]:
-			sleep(0.2)
-		log.debug("Exiting...")
-		if not self.closed:
-			self.on_closing(True)
+			prepared = self.prepare_duplicates(group)
+			while prepared and not self.kill_flag.is_set():
+				try:
+					self.prepared_queue.put(prepared, True, 1)
+					break
+				except Full:
+					continue
+		log.debug("Prefetching complete")
+		while not self.kill_flag.is_set():
+			try:
+				self.prepared_queue.put(None, True, 1)
+				break
+			except Full:
+				continue
+
+	def pending_groups(self) -> list[DuplicateGroup]:
+		"""Get the duplicate groups taken from the duplicate queue, but not yet
+		decided on
+		"""
+		with self.prepared_queue.mutex:
+			prepared = [prepared.group for prepared in self.prepared_queue.queue if prepared]
+		target = self.target
+		return ([target] if target else []) + prepared
 
-	def on_closing(self, from_thread: bool = False) -> None:
+	def on_closing(self) -> None:
 		self.closed = True
 		self.kill_flag.set()
-		if not from_thread:
-			self.duplicate_monitor.join(2)
+		self.duplicate_prefetcher.join(2)
 		self.window.destroy()
 
-	def stage_duplicates(
-		self,
-		identity_hash: str,
-		left_image: Path,
-		right_image: Path,
-		right_hash: str
-	) -> None:
-		log.debug("Comparing %s and %s", left_image, right_image)
-		if not left_image.exists():
-			log.debug(f"{left_image} no longer exists!")
-			left_image, left_hash = self.image_map.get(identity_hash, (Path(), ""))
-			if not left_hash:
-				self.image_map[identity_hash] = (right_image, right_hash)
+	def prepare_duplicates(self, group: DuplicateGroup) -> PreparedGroup | None:
+		log.debug("Preparing group of %s: %s", len(group.entries), group.entries[0].path)
+		original = group.entries[0]
+		if not original.path.exists():
+			log.debug(f"{original.path} no longer exists!")
+			self.image_index.remove(original)
+		members = [(entry, exact) for entry, exact in zip(group.entries[1:], group.exact) if entry.path.exists()]
+		if not original.path.exists():
+			if not members:
+				return None
+			first, _ = members.pop(0)
+			mapped = self.image_index.match_or_insert(first)  # the group's images are now duplicates of whatever first matches, if anything
+			original = mapped or first
+			if mapped:
+				members.insert(0, (first, False))
+			members = [(entry, False) for entry, _ in members]  # exactness was judged against the removed image
+		if not members:
+			return None
+		group = DuplicateGroup([original] + [entry for entry, _ in members], [exact for _, exact in members])
+		try:
+			return PreparedGroup(group, [self.thumbnails.get(entry.path) for entry in group.entries])
+		except OSError as error:
+			log.debug("Could not prepare group of %s: %s", original.path, error)
+			return None
+
+	def stage_duplicates(self, prepared: PreparedGroup) -> None:
+		if not all(entry.path.exists() for entry in prepared.group.entries):
+			refreshed = self.prepare_duplicates(prepared.group)  # a previous decision removed some of these images
+			if not refreshed:
+				return
+			prepared = refreshed
+		self.target = prepared.group
+		self.shown_thumbnails = prepared.thumbnails
+		largest = max(range(len(prepared.group.entries)), key=lambda index: prepared.group.entries[index].area)
+		self.keep = [index == largest for index in range(len(prepared.group.entries))]
+		columns = ceil(sqrt(len(prepared.thumbnails)))
+		size = min(THUMBNAIL_SIZE[0], self.GRID_SIZE // columns)
+		for index, (entry, thumbnail) in enumerate(zip(prepared.group.entries, prepared.thumbnails)):
+			with self.thumbnails.open(entry.path, thumbnail) as image:  # mapped from shared memory, if a worker rendered it
+				self.images.append(ImageTk.PhotoImage(image if size == THUMBNAIL_SIZE[0] else image.resize((size, size), PILImage.ADAPTIVE)))
+			button = Button(self.group_frame, command=lambda index=index: self.toggle_callback(index), height=size, width=size, image=self.images[-1])
+			label = Label(self.group_frame)
+			button.grid(row=index // columns * 2, column=index % columns)
+			label.grid(row=index // columns * 2 + 1, column=index % columns, sticky="N")
+			self.image_buttons.append(button)
+			self.image_labels.append(label)
+			self.update_label(index)
+		self.shown_at = perf_counter()
+
+	def show_next(self) -> None:
+		while not self.target and not self.closed:
+			try:
+				prepared = self.prepared_queue.get_nowait()
+			except Empty:
 				return
-			if left_hash == right_hash:
-				with PILImage.open(right_image) as r_img:
-					r_width, r_hight = r_img.size
-				with PILImage.open(str(left_image.resolve())) as l_img:
-					l_width, l_hight = l_img.size
-				if l_width * l_hight >= r_width * r_hight:
-					log.info("Removing %s", right_image)
-					right_image.unlink()
-				else:
-					log.info("Removing %s", left_image)
-					self.image_map[identity_hash] = (right_image, right_hash)
-					left_image.unlink()
+			if prepared is None:
+				log.debug("Exiting...")
+				self.on_closing()
 				return
-		l_orig = PILImage.open(str(left_image.resolve()))
-		r_orig = PILImage.open(str(right_image.resolve()))
-		self.l_img = ImageTk.PhotoImage(l_orig.resize((500, 500), PILImage.ADAPTIVE))
-		self.r_img = ImageTk.PhotoImage(r_orig.resize((500, 500), PILImage.ADAPTIVE))
-		self.l_button.configure(image=self.l_img)
-		self.l_label.configure(text=f"{left_image.name}\n{l_orig.height}x{l_orig.width}")
-		self.r_button.configure(image=self.r_img)
-		self.r_label.configure(text=f"{right_image.name}\n{r_orig.height}x{r_orig.width}")
-		self.window.update()
-		self.target = (identity_hash, left_image, right_image, right_hash)
+			self.clear_grid()
+			self.stage_duplicates(prepared)
+
+	def poll_prepared(self) -> None:
+		self.show_next()
+		if not self.closed:
+			self.window.after(50, self.poll_prepared)
 
 	def start(self) -> None:
-		self.duplicate_monitor = Thread(target=self.monitor_duplicates)
-		self.duplicate_monitor.start()
+		self.duplicate_prefetcher = Thread(target=self.prefetch_duplicates)
+		self.duplicate_prefetcher.start()
+		self.window.after(50, self.poll_prepared)
 		self.window.mainloop()
\ No newline at end of file
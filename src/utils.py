@@ -1,10 +1,12 @@
 from json import load
+from os import environ
 from pathlib import Path
 from shutil import copytree
 
 
 BASE_DIRECTORY = Path(__file__).parent.parent
-with BASE_DIRECTORY.joinpath(r"resources/config.json").open("r") as config_file:
+CONFIG_PATH = Path(environ.get("DUPLICATE_CLEANER_CONFIG", BASE_DIRECTORY.joinpath(r"resources/config.json")))  # overridable, such as for benchmarks
+with CONFIG_PATH.open("r") as config_file:
 	CONFIGS = load(config_file)
 
 
@@ -0,0 +1,109 @@
+from ctypes import CDLL, get_errno
+from ctypes.util import find_library
+from os import close, fsdecode, fsencode, read, strerror
+from select import select
+from struct import calcsize, unpack_from
+from typing import NamedTuple
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+EVENT_HEADER = "iIII"  # struct inotify_event: wd, mask, cookie, len, then the name
+EVENT_HEADER_SIZE = calcsize(EVENT_HEADER)
+
+
+class WatchEvent(NamedTuple):
+	directory: str
+	name: str
+	mask: int
+
+	@property
+	def is_directory(self) -> bool:
+		return bool(self.mask & IN_ISDIR)
+
+
+class Inotify:
+	"""A minimal binding of the Linux inotify API, which reports changes to
+	watched directories
+
+	Watches are not recursive; each directory of a tree must be watched
+	separately.
+	"""
+
+	def __init__(self) -> None:
+		self.libc = CDLL(find_library("c") or "libc.so.6", use_errno=True)
+		if not hasattr(self.libc, "inotify_init1"):
+			raise OSError("inotify is not available on this platform")
+		self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			raise OSError(get_errno(), strerror(get_errno()))
+		self.directories: dict[int, str] = {}  # watch descriptor to watched directory
+		self.descriptors: dict[str, int] = {}
+
+	def watch(self, directory: str) -> None:
+		descriptor = self.libc.inotify_add_watch(self.fd, fsencode(directory), WATCH_MASK)
+		if descriptor < 0:
+			raise OSError(get_errno(), strerror(get_errno()), directory)
+		self.directories[descriptor] = directory
+		self.descriptors[directory] = descriptor
+
+	def unwatch_tree(self, directory: str) -> None:
+		"""Stop watching a directory and every watched directory beneath it,
+		such as when it has been moved away
+		"""
+		prefix = directory.rstrip("/") + "/"
+		for watched in [watched for watched in self.descriptors if watched == directory or watched.startswith(prefix)]:
+			descriptor = self.descriptors.pop(watched)
+			del self.directories[descriptor]
+			self.libc.inotify_rm_watch(self.fd, descriptor)
+
+	def read(self, timeout: float) -> list[WatchEvent]:
+		"""Wait for events on the watched directories
+
+		Parameters
+		----------
+		timeout: The most seconds to wait for
+
+		Returns
+		-------
+		The events which occurred, or an empty list if none did in time
+		"""
+		if not select([self.fd], [], [], timeout)[0]:
+			return []
+		try:
+			buffer = read(self.fd, 1 << 16)
+		except BlockingIOError:
+			return []
+		events = []
+		offset = 0
+		while offset < len(buffer):
+			descriptor, mask, _, length = unpack_from(EVENT_HEADER, buffer, offset)
+			name = fsdecode(buffer[offset + EVENT_HEADER_SIZE:offset + EVENT_HEADER_SIZE + length].rstrip(b"\0"))
+			offset += EVENT_HEADER_SIZE + length
+			if mask & IN_Q_OVERFLOW:
+				events.append(WatchEvent("", "", mask))
+				continue
+			directory = self.directories.get(descriptor)
+			if mask & IN_IGNORED:
+				if directory is not None:
+					del self.directories[descriptor]
+					self.descriptors.pop(directory, None)
+				continue
+			if directory is not None:
+				events.append(WatchEvent(directory, name, mask))
+		return events
+
+	def close(self) -> None:
+		close(self.fd)
\ No newline at end of file
@@ -0,0 +1,246 @@
+from argparse import ArgumentParser, Namespace
+from itertools import combinations
+from json import dumps, loads
+from os import environ
+from pathlib import Path
+from random import Random
+from shutil import rmtree
+from subprocess import run
+from sys import executable, path as sys_path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from PIL import Image, ImageDraw, ImageEnhance
+
+try:
+	from resource import getrusage, RUSAGE_CHILDREN, RUSAGE_SELF
+except ImportError:  # not on Windows
+	getrusage = None
+try:
+	from psutil import Process
+except ImportError:
+	Process = None
+
+
+base_path = Path(__file__).parent
+source_path = base_path.parent.joinpath("src")
+config_path = base_path.parent.joinpath("resources", "config.json")
+SIZE_DISTRIBUTIONS = {
+	"small": ((320, 240), (640, 480)),
+	"mixed": ((320, 240), (1024, 768), (1920, 1080), (4000, 3000)),
+	"large": ((4000, 3000), (6000, 4000))
+}
+NEAR_DUPLICATE_KINDS = ("reencode", "resize", "edit")
+
+
+def parse_arguments() -> Namespace:
+	parser = ArgumentParser(description="Generate a synthetic corpus and benchmark the duplicate finder against it")
+	parser.add_argument("--files", type=int, default=1000, help="number of original images to generate")
+	parser.add_argument("--depth", type=int, default=3, help="depth of the directory tree")
+	parser.add_argument("--fanout", type=int, default=4, help="subdirectories per directory")
+	parser.add_argument("--sizes", choices=SIZE_DISTRIBUTIONS, default="small", help="image size distribution")
+	parser.add_argument("--exact-rate", type=float, default=0.1, help="fraction of originals given exact copies")
+	parser.add_argument("--near-rate", type=float, default=0.1, help="fraction of originals given near-duplicate copies")
+	parser.add_argument("--seed", type=int, default=0)
+	parser.add_argument("--corpus", type=Path, default=base_path.joinpath("benchmark-corpus"), help="where to generate the corpus")
+	parser.add_argument("--reuse", action="store_true", help="benchmark an existing corpus instead of generating one")
+	parser.add_argument("--keep", action="store_true", help="keep a generated corpus afterwards; a reused one is always kept")
+	parser.add_argument("--skip-revamp", action="store_true", help="only benchmark the main engine")
+	return parser.parse_args()
+
+
+def directories(root: Path, depth: int, fanout: int) -> list[Path]:
+	level = [root]
+	found = [root]
+	for _ in range(depth):
+		level = [directory.joinpath(str(i)) for directory in level for i in range(fanout)]
+		found.extend(level)
+	return found
+
+
+def synthesize(generator: Random, size: tuple[int, int]) -> Image.Image:
+	"""Upscale random low resolution noise, so every image is smooth, distinct,
+	and cheap to make at any size"""
+	seed = Image.frombytes("RGB", (6, 6), bytes(generator.randrange(256) for _ in range(6 * 6 * 3)))
+	return seed.resize(size, Image.BICUBIC)
+
+
+def near_duplicate(generator: Random, image: Image.Image, kind: str) -> tuple[Image.Image, int]:
+	if kind == "resize":
+		scale = generator.uniform(0.5, 0.9)
+		return image.resize((int(image.width * scale), int(image.height * scale)), Image.BILINEAR), 90
+	if kind == "edit":
+		edited = ImageEnhance.Brightness(image).enhance(generator.uniform(0.95, 1.05))
+		ImageDraw.Draw(edited).rectangle((0, 0, image.width // 20, image.height // 20), fill=(255, 255, 255))
+		return edited, 90
+	return image, generator.choice((60, 75))
+
+
+def truth_path(corpus: Path) -> Path:
+	"""The ground truth written beside a generated corpus, which also marks the
+	directory as one this script may delete"""
+	return corpus.with_name(corpus.name + "-truth.json")
+
+
+def generate(arguments: Namespace) -> list[list[Path]]:
+	"""Generate the corpus, returning each group of images which should be
+	found to be duplicates of each other"""
+	generator = Random(arguments.seed)
+	if arguments.corpus.exists():
+		if not truth_path(arguments.corpus).exists():
+			raise SystemExit(f"{arguments.corpus} exists and is not a benchmark corpus, refusing to overwrite it")
+		rmtree(arguments.corpus)
+	tree = directories(arguments.corpus, arguments.depth, arguments.fanout)
+	for directory in tree:
+		directory.mkdir(parents=True, exist_ok=True)
+	groups = []
+	for i in range(arguments.files):
+		image = synthesize(generator, generator.choice(SIZE_DISTRIBUTIONS[arguments.sizes]))
+		original = generator.choice(tree).joinpath(f"{i}.jpg")
+		image.save(original, quality=90)
+		group = [original]
+		if generator.random() < arguments.exact_rate:
+			copy = generator.choice(tree).joinpath(f"{i}-exact.jpg")
+			copy.write_bytes(original.read_bytes())
+			group.append(copy)
+		if generator.random() < arguments.near_rate:
+			kind = generator.choice(NEAR_DUPLICATE_KINDS)
+			variant, quality = near_duplicate(generator, image, kind)
+			copy = generator.choice(tree).joinpath(f"{i}-{kind}.jpg")
+			variant.save(copy, quality=quality)
+			group.append(copy)
+		if len(group) > 1:
+			groups.append(group)
+	return groups
+
+
+def expected_pairs(groups: list[list[Path]]) -> set[frozenset[str]]:
+	return {frozenset((str(a), str(b))) for group in groups for a, b in combinations(group, 2)}
+
+
+def closed_pairs(pairs: list[tuple[str, str]]) -> set[frozenset[str]]:
+	"""Expand matched pairs to every pair within their transitive clusters,
+	since the engine reports each image against only one earlier match"""
+	parents: dict[str, str] = {}
+
+	def find(item: str) -> str:
+		parents.setdefault(item, item)
+		while parents[item] != item:
+			parents[item] = parents[parents[item]]
+			item = parents[item]
+		return item
+
+	for a, b in pairs:
+		parents[find(a)] = find(b)
+	clusters: dict[str, list[str]] = {}
+	for item in list(parents):
+		clusters.setdefault(find(item), []).append(item)
+	return {frozenset(pair) for cluster in clusters.values() for pair in combinations(cluster, 2)}
+
+
+def score(found: set[frozenset[str]], expected: set[frozenset[str]]) -> dict[str, float]:
+	true_positives = len(found & expected)
+	return {
+		"precision": true_positives / len(found) if found else 1.0,
+		"recall": true_positives / len(expected) if expected else 1.0
+	}
+
+
+def corpus_stats(corpus: Path) -> tuple[int, int]:
+	files = [file for file in corpus.rglob("*") if file.is_file()]
+	return len(files), sum(file.stat().st_size for file in files)
+
+
+def isolated_config(directory: Path) -> Path:
+	"""Write a copy of the configs which keeps every file a scan writes in a
+	directory of its own, without the hash cache or checkpoints, so a run
+	neither reads nor disturbs the state of real scans"""
+	configs = loads(config_path.read_text())
+	configs["logging"]["path"] = str(directory.joinpath("app.log"))
+	configs["hash_cache"] = {"enabled": False}
+	configs["checkpoint"] = {"enabled": False}
+	configs["metrics"] = {**configs.get("metrics", {}), "path": str(directory.joinpath("metrics.json"))}
+	configs["profiling"] = {**configs.get("profiling", {}), "directory": str(directory.joinpath("profiles"))}
+	configs["index"] = {**configs.get("index", {}), "spill_path": str(directory.joinpath("index_spill.sqlite3"))}
+	path = directory.joinpath("config.json")
+	path.write_text(dumps(configs, indent="\t"))
+	return path
+
+
+def peak_rss_kib(children: bool) -> int | None:
+	"""The peak resident set size of this process, or of its finished children,
+	in KiB, or None where the platform cannot report it"""
+	if getrusage is not None:
+		return getrusage(RUSAGE_CHILDREN if children else RUSAGE_SELF).ru_maxrss
+	if Process is not None and not children:  # psutil only knows the peak of live Windows processes
+		peak = getattr(Process().memory_info(), "peak_wset", None)
+		return peak // 1024 if peak is not None else None
+	return None
+
+
+def benchmark_engine(corpus: Path, expected: set[frozenset[str]]) -> dict:
+	report = corpus.parent.joinpath("benchmark-report.jsonl")
+	with TemporaryDirectory() as directory:
+		environment = {**environ, "DUPLICATE_CLEANER_CONFIG": str(isolated_config(Path(directory)))}
+		start = perf_counter()
+		run([executable, str(source_path.joinpath("main.py")), "--headless", str(corpus), "-o", str(report)], check=True, env=environment)
+		elapsed = perf_counter() - start
+	pairs = []
+	with report.open() as file:
+		for line in file:
+			entries = loads(line)["entries"]
+			pairs.extend((entries[0]["path"], entry["path"]) for entry in entries[1:])
+	report.unlink()
+	file_count, byte_count = corpus_stats(corpus)
+	return {
+		"seconds": elapsed,
+		"files_per_second": file_count / elapsed,
+		"bytes_per_second": byte_count / elapsed,
+		"peak_rss_kib": peak_rss_kib(children=True),
+		**score(closed_pairs(pairs), expected)
+	}
+
+
+def benchmark_revamp(corpus: Path, expected: set[frozenset[str]]) -> dict:
+	sys_path.insert(0, str(source_path.joinpath("revamp")))
+	from pdd_defaultcomparators.base_classes import File  # type: ignore[import-not-found]
+	from pdd_defaultcomparators.default_comparators import ImageComparator  # type: ignore[import-not-found]
+	from pdd_defaultcomparators.exact_matching import is_exact_match  # type: ignore[import-not-found]
+
+	paths = [file for file in corpus.rglob("*.jpg")]
+	start = perf_counter()
+	pairs = [
+		(file1.path, file2.path)
+		for file1, file2 in ImageComparator.bulk_compare([File(path, path.suffix) for path in paths], 5.0)
+	]
+	exact_pairs = sum(is_exact_match(path1, path2) for path1, path2 in pairs)  # as the scanner checks its matches
+	elapsed = perf_counter() - start
+	file_count, byte_count = corpus_stats(corpus)
+	return {
+		"seconds": elapsed,
+		"files_per_second": file_count / elapsed,
+		"bytes_per_second": byte_count / elapsed,
+		"peak_rss_kib": peak_rss_kib(children=False),
+		"exact_pairs": exact_pairs,
+		**score(closed_pairs([(str(path1), str(path2)) for path1, path2 in pairs]), expected)
+	}
+
+
+if __name__ == "__main__":
+	arguments = parse_arguments()
+	ground_truth_path = truth_path(arguments.corpus)
+	if arguments.reuse:
+		groups = [[Path(path) for path in group] for group in loads(ground_truth_path.read_text())]
+	else:
+		start = perf_counter()
+		groups = generate(arguments)
+		ground_truth_path.write_text(dumps([[str(path) for path in group] for group in groups]))
+		print(f"Generated corpus in {perf_counter() - start:.1f}s")
+	expected = expected_pairs(groups)
+	results = {"engine": benchmark_engine(arguments.corpus, expected)}
+	if not arguments.skip_revamp:
+		results["revamp"] = benchmark_revamp(arguments.corpus, expected)
+	print(dumps(results, indent=2))
+	if not (arguments.keep or arguments.reuse):  # a reused corpus was not made by this run
+		rmtree(arguments.corpus)
+		ground_truth_path.unlink()
\ No newline at end of file